@@ -544,6 +544,13 @@ rx_streamer::sptr device3_impl::get_rx_stream(const stream_args_t &args_)
 
         // Setup the DSP transport hints
         device_addr_t rx_hints = get_rx_hints(mb_index);
+        // Describe the stream, so the device can pick a link that has enough
+        // bandwidth for it
+        rx_hints["otw_format"] = args.otw_format;
+        const double rx_samp_rate = recv_terminator->get_output_samp_rate();
+        if (rx_samp_rate != rfnoc::rate_node_ctrl::RATE_UNDEFINED) {
+            rx_hints["rate"] = std::to_string(rx_samp_rate);
+        }
 
         //allocate sid and create transport
         uhd::sid_t stream_address = blk_ctrl->get_address(block_port);
@@ -766,6 +773,13 @@ tx_streamer::sptr device3_impl::get_tx_stream(const uhd::stream_args_t &args_)
 
         // Setup the dsp transport hints
         device_addr_t tx_hints = get_tx_hints(mb_index);
+        // Describe the stream, so the device can pick a link that has enough
+        // bandwidth for it
+        tx_hints["otw_format"] = args.otw_format;
+        const double tx_samp_rate = send_terminator->get_input_samp_rate();
+        if (tx_samp_rate != rfnoc::rate_node_ctrl::RATE_UNDEFINED) {
+            tx_hints["rate"] = std::to_string(tx_samp_rate);
+        }
 
         //allocate sid and create transport
         uhd::sid_t stream_address = blk_ctrl->get_address(block_port);
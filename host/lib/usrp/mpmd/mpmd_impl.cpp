@@ -38,7 +38,7 @@ namespace {
     //! Most pessimistic time for a CHDR query to go to device and back
     const double MPMD_CHDR_MAX_RTT = 0.02;
     //! MPM Compatibility number
-    const std::vector<size_t> MPM_COMPAT_NUM = {1, 2};
+    const std::vector<size_t> MPM_COMPAT_NUM = {1, 3};
 
     /*************************************************************************
      * Helper functions
@@ -421,13 +421,25 @@ uhd::both_xports_t mpmd_mboard_impl::make_transport(
         << xport_type_str
     ;
 
+    // Pass on everything MPM needs to estimate the bandwidth of this stream
+    const std::set<std::string> mpm_xport_arg_keys{
+        "rate", "otw_format", "nchans"
+    };
+    std::map<std::string, std::string> mpm_xport_args;
+    for (const auto &key : xport_args.keys()) {
+        if (mpm_xport_arg_keys.count(key)) {
+            mpm_xport_args[key] = xport_args[key];
+        }
+    }
+
     using namespace uhd::mpmd::xport;
     const auto xport_info_list =
         rpc->request_with_token<mpmd_xport_mgr::xport_info_list_t>(
             "request_xport",
             sid.get_dst(),
             sid.get_src(),
-            xport_type_str
+            xport_type_str,
+            mpm_xport_args
     );
     UHD_LOGGER_TRACE("MPMD")
         << __func__
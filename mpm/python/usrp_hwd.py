@@ -8,14 +8,19 @@
 Main executable for the USRP Hardware Daemon
 """
 from __future__ import print_function
-import sys
 import time
+# This is time zero for the startup timeline
+_START_TIME = time.time()
+import sys
 import argparse
 from gevent import signal
 from gevent.hub import BlockingSwitchOutError
 import usrp_mpm as mpm
 from usrp_mpm.mpmtypes import SharedState
 from usrp_mpm.sys_utils import watchdog
+from usrp_mpm.timeline import STARTUP_TIMELINE
+STARTUP_TIMELINE.origin = _START_TIME
+STARTUP_TIMELINE.mark('imports_done')
 
 _PROCESSES = []
 
@@ -52,6 +57,12 @@ def setup_arg_parser():
              "used as defaults for device initialization.",
         default=None
     )
+    parser.add_argument(
+        '--startup-timeline',
+        help="Write a timeline of the startup (until the RPC server is " \
+             "ready) to this JSON file. The timeline is always logged.",
+        default=None
+    )
     parser.add_argument(
         '-v',
         '--verbose',
@@ -117,14 +128,17 @@ def init_only(log, default_args):
     # configuration with cmake (-DMPM_DEVICE).
     # mgr is thus derived from PeriphManagerBase
     # (see periph_manager/base.py)
-    from usrp_mpm.periph_manager import periph_manager
+    with STARTUP_TIMELINE.span('periph_manager_import'):
+        from usrp_mpm.periph_manager import periph_manager
     log.info("Spawning periph manager...")
     ctor_time_start = time.time()
-    mgr = periph_manager(default_args)
+    with STARTUP_TIMELINE.span('periph_manager_ctor'):
+        mgr = periph_manager(default_args)
     ctor_duration = time.time() - ctor_time_start
     log.info("Ctor Duration: {:.02f} s".format(ctor_duration))
     init_time_start = time.time()
-    init_result = mgr.init(default_args)
+    with STARTUP_TIMELINE.span('periph_manager_init'):
+        init_result = mgr.init(default_args)
     init_duration = time.time() - init_time_start
     if init_result:
         log.info("Initialization successful! Duration: {:.02f} s"
@@ -132,6 +146,7 @@ def init_only(log, default_args):
     else:
         log.warning("Initialization failed! Duration: {:.02f} s"
                     .format(init_duration))
+    STARTUP_TIMELINE.finish(log.getChild('startup'))
     log.info("Terminating on user request before launching RPC server.")
     mgr.deinit()
     return init_result
@@ -177,6 +192,7 @@ def main():
     if args.override_db_pids is not None:
         log.warning('Overriding daughterboard PIDs!')
         args.default_args['override_db_pids'] = args.override_db_pids
+    STARTUP_TIMELINE.json_path = args.startup_timeline
     if args.init_only:
         return init_only(log, args.default_args)
     return spawn_processes(log, args)
@@ -5,19 +5,24 @@
 #
 """
 MPM Module
+
+Only the lightweight parts are imported here. The RPC server, the periph
+manager and everything they pull in (gevent monkey patching, mprpc, the
+device drivers) are imported on first use, which keeps the startup of
+usrp_hwd and of the discovery process short.
 """
 
 from . import libpyusrp_periphs as lib
-from .discovery import spawn_discovery_process
-from .rpc_server import spawn_rpc_process
 from . import mpmtypes
-from . import periph_manager
-from . import dboard_manager
-from . import xports
-from . import cores
-from . import chips
-from . import gpsd_iface
 from .mpmlog import get_main_logger
+from .version import __version__, __githash__
+
+def spawn_discovery_process(*args, **kwargs):
+    " See discovery.spawn_discovery_process() "
+    from .discovery import spawn_discovery_process as _spawn_discovery_process
+    return _spawn_discovery_process(*args, **kwargs)
 
-__version__ = periph_manager.__version__
-__githash__ = periph_manager.__githash__
+def spawn_rpc_process(*args, **kwargs):
+    " See rpc_server.spawn_rpc_process() "
+    from .rpc_server import spawn_rpc_process as _spawn_rpc_process
+    return _spawn_rpc_process(*args, **kwargs)
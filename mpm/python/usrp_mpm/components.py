@@ -9,7 +9,128 @@ MPM Component management
 import os
 import shutil
 import subprocess
+import tempfile
+import time
+from hashlib import md5, sha256
 from usrp_mpm.rpc_server import no_rpc
+from usrp_mpm.jobs import report_progress
+
+
+# Uploaded component files are staged in this directory
+COMPONENT_UPLOAD_DIR = os.path.join(os.sep, "tmp", "uploads")
+
+class ComponentUpload(object):
+    """
+    Receives a component file in chunks.
+
+    Chunks are written directly to a staging file, and the checksums are
+    updated as the chunks come in, so memory usage does not depend on the
+    size of the file. Chunks must arrive in order, but chunks (or parts of
+    chunks) that were already received are ignored. This means a client can
+    resume an upload after a connection loss simply by continuing from the
+    offset it was given, or by resending the last chunk.
+
+    Every upload has its own staging file, so uploads of the same file can't
+    interfere with each other. Whichever is finalized last wins.
+
+    Arguments:
+    upload_id -- String identifying this upload
+    metadata -- Dictionary of strings containing metadata, as used by
+                update_component(). If it contains 'md5' or 'sha256' keys,
+                the file will be verified against those when it's finalized.
+                If it contains a 'size' key, no more than that many bytes
+                are accepted.
+    log -- Logger object
+    """
+    def __init__(self, upload_id, metadata, log):
+        self.upload_id = upload_id
+        self.metadata = metadata
+        self.log = log
+        self.filepath = os.path.join(
+            COMPONENT_UPLOAD_DIR, os.path.basename(metadata['filename']))
+        self._max_size = int(metadata['size']) if 'size' in metadata else None
+        if not os.path.isdir(COMPONENT_UPLOAD_DIR):
+            self.log.trace("Creating directory {}".format(COMPONENT_UPLOAD_DIR))
+            os.makedirs(COMPONENT_UPLOAD_DIR)
+        part_fd, self._partpath = tempfile.mkstemp(
+            suffix='.part',
+            prefix=os.path.basename(self.filepath) + '.',
+            dir=COMPONENT_UPLOAD_DIR,
+        )
+        self.log.trace("Staging upload `%s' to %s", upload_id, self._partpath)
+        self._file = os.fdopen(part_fd, 'wb')
+        self._md5 = md5()
+        self._sha256 = sha256()
+        self.offset = 0
+        self.last_activity = time.time()
+
+    def append(self, offset, data):
+        """
+        Add a chunk of data, which starts at byte offset. Returns the offset
+        of the next byte that is expected.
+        """
+        self.last_activity = time.time()
+        if offset > self.offset:
+            raise RuntimeError(
+                "Upload `{}': Chunk at offset {} would leave a gap, expected "
+                "offset {}.".format(self.upload_id, offset, self.offset))
+        # Skip anything we already have
+        data = data[self.offset - offset:]
+        if not data:
+            return self.offset
+        if self._max_size is not None \
+                and self.offset + len(data) > self._max_size:
+            raise RuntimeError(
+                "Upload `{}' exceeds its declared size of {} bytes.".format(
+                    self.upload_id, self._max_size))
+        self._file.write(data)
+        self._md5.update(data)
+        self._sha256.update(data)
+        self.offset += len(data)
+        return self.offset
+
+    def finalize(self):
+        """
+        Close the staging file and verify its size and checksums. On success,
+        the file is moved to its final location, which is returned. Throws
+        if the file can't be verified.
+        """
+        self._file.close()
+        if self._max_size is not None and self.offset != self._max_size:
+            self.abort()
+            raise RuntimeError(
+                "Upload `{}' is incomplete: Got {} of {} bytes.".format(
+                    self.upload_id, self.offset, self._max_size))
+        for hash_key, comp_hash in (('md5', self._md5),
+                                    ('sha256', self._sha256)):
+            if hash_key not in self.metadata:
+                continue
+            given_hash = self.metadata[hash_key]
+            if comp_hash.hexdigest() != given_hash:
+                self.log.error("Component file hash mismatched:\n"
+                               "Calculated {}\n"
+                               "Given      {}\n".format(
+                                   comp_hash.hexdigest(), given_hash))
+                self.abort()
+                raise RuntimeError("Component file hash mismatch")
+            self.log.trace("Component file hash matched: {}".format(
+                given_hash))
+        # Store the verified checksums, so the component can be recorded in
+        # the manifest when it's installed
+        self.metadata['md5'] = self._md5.hexdigest()
+        self.metadata['sha256'] = self._sha256.hexdigest()
+        os.rename(self._partpath, self.filepath)
+        self.log.trace("Upload `%s' complete: %d bytes written to %s",
+                       self.upload_id, self.offset, self.filepath)
+        return self.filepath
+
+    def abort(self):
+        """
+        Close and delete the staging file.
+        """
+        self._file.close()
+        if os.path.exists(self._partpath):
+            os.remove(self._partpath)
 
 
 class ZynqComponents(object):
@@ -47,10 +168,12 @@ class ZynqComponents(object):
         if file_extension == "bit":
             self.log.trace("Converting bit to bin file and writing to {}"
                            .format(binfile_path))
+            report_progress("Converting FPGA bitfile")
             from usrp_mpm.fpga_bit_to_bin import fpga_bit_to_bin
             fpga_bit_to_bin(filepath, binfile_path, flip=True)
         elif file_extension == "bin":
             self.log.trace("Copying bin file to %s", binfile_path)
+            report_progress("Copying FPGA binfile")
             shutil.copy(filepath, binfile_path)
         else:
             self.log.error("Invalid FPGA bitfile: %s", filepath)
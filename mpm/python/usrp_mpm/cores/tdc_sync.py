@@ -14,6 +14,7 @@ from functools import reduce
 from builtins import object
 from usrp_mpm.mpmutils import poll_with_timeout
 from usrp_mpm.mpmlog import get_logger
+from usrp_mpm.timeline import INIT_TIMELINE
 
 def mean(vals):
     " Calculate arithmetic mean of vals "
@@ -187,6 +188,7 @@ class ClockSynchronizer(object):
         self.configured = False
 
 
+    @INIT_TIMELINE.timed('tdc_sync')
     def run(self, num_meas, target_offset=0.0e-9):
         """
         Perform a basic synchronization routine by calling configure(), measure(), and
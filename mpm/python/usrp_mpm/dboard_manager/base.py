@@ -11,6 +11,7 @@ from builtins import object
 from six import iteritems
 from usrp_mpm.mpmlog import get_logger
 from usrp_mpm.mpmutils import to_native_str
+from usrp_mpm.mpmutils import get_sensor_callback, TTLCache
 
 class DboardManagerBase(object):
     """
@@ -38,6 +39,10 @@ class DboardManagerBase(object):
     def __init__(self, slot_idx, **kwargs):
         self.log = get_logger('dboardManager')
         self.slot_idx = slot_idx
+        # See update_clock_fingerprint()
+        self.clock_fingerprint = {}
+        # Cached sensor values, see PeriphManager.mboard_sensor_callback_map
+        self._sensor_cache = TTLCache()
         if 'eeprom_md' not in kwargs:
             self.log.debug("No EEPROM metadata given!")
         # In C++, we can only handle dicts if all the values are of the
@@ -104,6 +109,15 @@ class DboardManagerBase(object):
         """
         self.log.warning("update_ref_clock_freq() called but not implemented")
 
+    def update_clock_fingerprint(self, fingerprint):
+        """
+        Called by the periph manager before every init() with the current
+        state of the motherboard's clock domain (see
+        PeriphManagerBase.get_clock_fingerprint()). If it matches the state
+        of the previous init(), clocking doesn't need to be re-initialized.
+        """
+        self.clock_fingerprint = fingerprint
+
     ##########################################################################
     # Sensors
     ##########################################################################
@@ -136,7 +150,36 @@ class DboardManagerBase(object):
             )
             self.log.error(error_msg)
             raise RuntimeError(error_msg)
-        return getattr(
-            self, callback_map.get(sensor_name)
-        )(chan)
+        method_name, ttl = get_sensor_callback(callback_map.get(sensor_name))
+        return self._sensor_cache.get(
+            (direction.lower(), sensor_name, chan),
+            ttl,
+            getattr(self, method_name),
+            chan
+        )
+
+    def get_all_sensors(self, chan=0):
+        """
+        Return the values of all sensors of channel chan as a dictionary with
+        the keys 'RX' and 'TX', each of which maps sensor names to sensor
+        values. If a sensor can't be read, its value is a dictionary with an
+        'error' key instead.
+        """
+        values = {}
+        for direction in ('RX', 'TX'):
+            values[direction] = {}
+            for sensor_name in self.get_sensors(direction, chan):
+                try:
+                    values[direction][sensor_name] = \
+                        self.get_sensor(direction, sensor_name, chan)
+                except Exception as ex:
+                    values[direction][sensor_name] = {'error': str(ex)}
+        return values
+
+    def invalidate_sensor_cache(self):
+        """
+        Drop all cached sensor values, so the next read goes to the hardware.
+        Call this when the sensors are known to have changed.
+        """
+        self._sensor_cache.invalidate()
 
@@ -16,6 +16,8 @@ from usrp_mpm import lib
 from usrp_mpm.dboard_manager import DboardManagerBase
 from usrp_mpm.dboard_manager.lmk_eiscat import LMK04828EISCAT
 from usrp_mpm.cores import ClockSynchronizer
+from usrp_mpm.mpmutils import InitStages, str2bool
+from usrp_mpm.timeline import INIT_TIMELINE
 
 def create_spidev_iface_sane(dev_node):
     """
@@ -222,6 +224,13 @@ class DboardClockControl(object):
             self.log.trace("Enabling output MMCM clocks...")
             self.enable_outputs(True)
 
+    def check_mmcm_locked(self):
+        """
+        Returns True if the MMCM is locked.
+        """
+        with self.regs.open():
+            return bool(self.peek32(self.RADIO_CLK_MMCM) & 0x10)
+
     def check_refclk(self):
         """
         Not technically a clocking reg, but related.
@@ -417,6 +426,11 @@ class EISCAT(DboardManagerBase):
 
     INIT_PHASE_DAC_WORD = 500 # Intentionally decimal
 
+    # Init stages, in the order they're run: clocking is done by init(), the
+    # JESD stage by init_jesd_core_reset_adcs(), init_adcs_and_deframers(),
+    # and check_deframer_status().
+    INIT_STAGES = ('clocking', 'jesd')
+
     def __init__(self, slot_idx, **kwargs):
         super(EISCAT, self).__init__(slot_idx, **kwargs)
         self.log = get_logger("EISCAT-{}".format(slot_idx))
@@ -431,6 +445,8 @@ class EISCAT(DboardManagerBase):
         self.dboard_clk_control = None
         self.clock_synchronizer = None
         self._spi_ifaces = None
+        # Remembers which init stages can be skipped in the next session
+        self._init_stages = InitStages(self.INIT_STAGES, self.log)
 
     def is_initialized(self):
         """
@@ -455,7 +471,11 @@ class EISCAT(DboardManagerBase):
         and check_deframer_status().
 
         Note that this function will do nothing if the device was previously
-        initialized, unless force_init was specified in the init args.
+        initialized with the same clocking (see update_clock_fingerprint()),
+        and the LMK, MMCM, and JESD links are still locked, unless force_init
+        was specified in the init args. If only the JESD links are down, the
+        clocking is left alone, and only the ADCs and deframers get
+        re-initialized.
         """
         def _init_dboard_regs():
             " Create a UIO object to talk to dboard regs "
@@ -536,14 +556,27 @@ class EISCAT(DboardManagerBase):
             synchronizer = None
             self.log.debug("Clock Synchronization Complete!")
         # Go, go, go!
-        if args.get("force_init", False):
+        if str2bool(args.get("force_init", False)):
             self.log.info("Forcing re-initialization of dboard.")
-        self.initialized = args.get("force_init", self.initialized)
-        if self.initialized:
+            self._init_stages.invalidate()
+        stage_inputs = self._get_stage_inputs()
+        first_stage = self._init_stages.get_first_stage(stage_inputs, {
+            'clocking': self._check_clocking,
+            'jesd': self._check_jesd,
+        })
+        if first_stage is None:
             self.log.debug(
                 "Dboard was previously initialized; skipping init. " \
                 "Specify force_init=1 to force initialization."
             )
+            self.initialized = True
+            return True
+        self._init_stages.invalidate(first_stage)
+        self.initialized = False
+        if first_stage == 'jesd':
+            self.log.debug(
+                "Clocking unchanged; only re-initializing ADCs and JESD cores."
+            )
             return True
         self.log.debug("init() called with args `{}'".format(
             ",".join(['{}={}'.format(x, args[x]) for x in args])
@@ -585,8 +618,41 @@ class EISCAT(DboardManagerBase):
         )
         _sync_db_clock(self.clock_synchronizer)
         # Clocks and PPS are now fully active!
+        self._init_stages.set_done('clocking', stage_inputs['clocking'])
         return True
 
+    def _get_stage_inputs(self):
+        """
+        Return the inputs of the init stages. If any of them changes, the
+        according stage needs to be re-run.
+        """
+        return {
+            'clocking': {
+                'clock_fingerprint': self.clock_fingerprint,
+                'ref_clock_freq': self.ref_clock_freq,
+            },
+            'jesd': {},
+        }
+
+    def _check_clocking(self):
+        """
+        Returns True if the clocking from the previous init is still good,
+        i.e., the LMK PLLs and the MMCM are still locked.
+        """
+        return self.lmk is not None \
+            and self.lmk.check_plls_locked() \
+            and self.dboard_clk_control.check_mmcm_locked()
+
+    def _check_jesd(self):
+        """
+        Returns True if the JESD links from the previous init are still up.
+        """
+        with self.radio_regs.open():
+            return all(
+                jesd_core.check_deframer_status()
+                for jesd_core in self.jesd_cores
+            )
+
     def send_sysref(self):
         """
         Send a SYSREF from MPM. This is not possible to do in a timed
@@ -625,6 +691,7 @@ class EISCAT(DboardManagerBase):
         self.log.trace("ADC Reset Sequence Complete!")
         return True
 
+    @INIT_TIMELINE.timed('eiscat.adcs_and_deframers')
     def init_adcs_and_deframers(self):
         """
         Initialize the ADCs and the JESD deframers. Assumption is that they were
@@ -659,6 +726,7 @@ class EISCAT(DboardManagerBase):
                 "is fine."
             )
             return True
+        error = False
         for jesd_idx, jesd_core in enumerate(self.jesd_cores):
             if not jesd_core.check_deframer_status():
                 self.log.error("JESD204B Core {} Error: Failed to Link. " \
@@ -670,6 +738,7 @@ class EISCAT(DboardManagerBase):
             return False
 
         self.log.debug("JESD Core Initialized, link up! (woohoo!)")
+        self._init_stages.set_done('jesd', self._get_stage_inputs()['jesd'])
         self.initialized = True
         return self.initialized
 
@@ -680,6 +749,7 @@ class EISCAT(DboardManagerBase):
         """
         self.log.info("Shutting down daughterboard")
         self.initialized = False
+        self._init_stages.invalidate()
         self._deinit_power(self.radio_regs)
 
     def _init_power(self, regs):
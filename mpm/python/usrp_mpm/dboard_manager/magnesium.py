@@ -15,7 +15,9 @@ from usrp_mpm import lib # Pulls in everything from C++-land
 from usrp_mpm.dboard_manager import DboardManagerBase
 from usrp_mpm.dboard_manager.mg_periphs import TCA6408, MgCPLD
 from usrp_mpm.dboard_manager.mg_init import MagnesiumInitManager
+from usrp_mpm.dboard_manager.mg_init import MagnesiumCalCache
 from usrp_mpm.mpmlog import get_logger
+from usrp_mpm.mpmutils import InitStages, str2bool
 from usrp_mpm.sys_utils.uio import open_uio
 from usrp_mpm.sys_utils.udev import get_eeprom_paths
 from usrp_mpm.bfrfs import BufferFS
@@ -134,7 +136,11 @@ class Magnesium(DboardManagerBase):
         self.eeprom_fs = None
         self.eeprom_path = None
         self.cpld = None
-        self._init_args = {}
+        # Remembers which init stages can be skipped in the next session
+        self.init_stages = InitStages(
+            MagnesiumInitManager.INIT_STAGES, self.log.getChild('init'))
+        # Remembers under which conditions the AD9371 was calibrated
+        self.cal_cache = MagnesiumCalCache(self.log.getChild('cal_cache'))
         # Now initialize all peripherals. If that doesn't work, put this class
         # into a non-functional state (but don't crash, or we can't talk to it
         # any more):
@@ -218,21 +224,15 @@ class Magnesium(DboardManagerBase):
         """
         Propagate the C++ Mykonos API into Python land.
         """
-        def export_method(obj, method):
-            " Export a method object, including docstring "
-            meth_obj = getattr(obj, method)
-            def func(*args):
-                " Functor for storing docstring too "
-                return meth_obj(*args)
-            func.__doc__ = meth_obj.__doc__
-            return func
         self.log.trace("Forwarding AD9371 methods to Magnesium class...")
         for method in [
                 x for x in dir(self.mykonos)
                 if not x.startswith("_") and \
                         callable(getattr(self.mykonos, x))]:
             self.log.trace("adding {}".format(method))
-            setattr(self, method, export_method(myk, method))
+            # The bound C++ method already carries its docstring, so we can
+            # register it directly without wrapping it
+            setattr(self, method, getattr(myk, method))
 
     def _get_user_eeprom_info(self, rev):
         """
@@ -283,36 +283,28 @@ class Magnesium(DboardManagerBase):
             error_msg = "Cannot run init(), peripherals are not initialized!"
             self.log.error(error_msg)
             raise RuntimeError(error_msg)
-        # Check if ref clock freq changed (would require a full init)
-        ref_clk_freq_changed = False
         if 'ref_clk_freq' in args:
             new_ref_clock_freq = float(args['ref_clk_freq'])
             assert new_ref_clock_freq in (10e6, 20e6, 25e6)
-            if new_ref_clock_freq != self.ref_clock_freq:
-                self.ref_clock_freq = float(args['ref_clk_freq'])
-                ref_clk_freq_changed = True
+            self.ref_clock_freq = new_ref_clock_freq
         assert self.ref_clock_freq is not None
-        # Check if master clock freq changed (would require a full init)
         master_clock_rate = \
             float(args.get('master_clock_rate',
                            self.default_master_clock_rate))
         assert master_clock_rate in (122.88e6, 125e6, 153.6e6), \
                 "Invalid master clock rate: {:.02f} MHz".format(
                     master_clock_rate / 1e6)
-        master_clock_rate_changed = \
-            master_clock_rate != self.master_clock_rate
-        if master_clock_rate_changed:
+        if master_clock_rate != self.master_clock_rate:
             self.master_clock_rate = master_clock_rate
             self.log.debug(
                 "Updating master clock rate to {:.02f} MHz!"
                 .format(self.master_clock_rate / 1e6)
             )
-        # Track if we're able to do a "fast reinit", which means there were no
-        # major changes and can skip all slow initialization steps.
-        fast_reinit = \
-            not bool(args.get("force_reinit", False)) \
-            and not master_clock_rate_changed \
-            and not ref_clk_freq_changed
+        # Track if we're able to do a "fast reinit", which means the init
+        # manager skips all initialization steps whose settings (including
+        # master clock rate, ref clock frequency, and the motherboard's clock
+        # fingerprint) didn't change since the last init.
+        fast_reinit = not str2bool(args.get("force_reinit", False))
         if fast_reinit:
             self.log.debug(
                 "Attempting fast re-init with the following settings: "
@@ -322,13 +314,8 @@ class Magnesium(DboardManagerBase):
                     self.ref_clock_freq,
                 )
             )
-        # Note: MagnesiumInitManager.init() can still override fast_reinit.
-        # Consider it a hint.
-        result = MagnesiumInitManager(self, self._spi_ifaces).init(
-            args, self._init_args, fast_reinit)
-        if result:
-            self._init_args = args
-        return result
+        return MagnesiumInitManager(self, self._spi_ifaces).init(
+            args, fast_reinit)
 
     def get_user_eeprom_data(self):
         """
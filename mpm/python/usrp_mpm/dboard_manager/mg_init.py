@@ -12,13 +12,16 @@ import re
 import time
 import math
 from builtins import object
+from six import iteritems
 
 from usrp_mpm.sys_utils.uio import open_uio
+from usrp_mpm.sys_utils.sysfs_thermal import read_thermal_sensor_value
 from usrp_mpm.dboard_manager.lmk_mg import LMK04828Mg
 from usrp_mpm.dboard_manager.mg_periphs import DboardClockControl
 from usrp_mpm.cores import ClockSynchronizer
 from usrp_mpm.cores import nijesdcore
 from usrp_mpm.mpmutils import async_exec
+from usrp_mpm.timeline import INIT_TIMELINE
 
 INIT_CALIBRATION_TABLE = {"TX_BB_FILTER"              :   0x0001,
                           "ADC_TUNER"                 :   0x0002,
@@ -57,6 +60,87 @@ TRACKING_CALIBRATION_TABLE = {"TRACK_RX1_QEC"         :   0x01,
                               "ALL"                   :   0xF3,
                              }
 
+# Width of the LO frequency bands used by the calibration cache, in Hz
+CAL_CACHE_LO_BAND_WIDTH = 250e6
+# Width of the temperature buckets used by the calibration cache, in deg C
+CAL_CACHE_TEMP_BUCKET = 10
+# Default for the cal_cache_max_age init arg: Calibrations older than this
+# (in seconds) are re-run.
+CAL_CACHE_DEFAULT_MAX_AGE = 3600
+# Default for the cal_cache_max_temp_drift init arg: Calibrations are re-run
+# if the temperature changed by more than this (in deg C) since they ran.
+CAL_CACHE_DEFAULT_MAX_TEMP_DRIFT = 10
+
+
+class MagnesiumCalCache(object):
+    """
+    Remembers the conditions under which the AD9371 calibrations ran, so a
+    re-init can skip them if the radio is still calibrated for the current
+    conditions.
+
+    Entries are keyed on the RX and TX LO bands, the master clock rate, and a
+    temperature bucket. An entry expires when it's older than max_age, or
+    when the temperature drifted by more than max_temp_drift since the
+    calibration ran.
+
+    Note: The AD9371 API doesn't allow reading back the calibration data, so
+    calibrations can't be restored into the chip after it was reset. That's
+    why all entries need to be dropped (see clear()) whenever the chip is
+    reset.
+    """
+    def __init__(self, log):
+        self.log = log
+        # Maps key -> (time.monotonic() timestamp, temperature)
+        self._entries = {}
+
+    @staticmethod
+    def get_key(rx_lo_freq, tx_lo_freq, master_clock_rate, temp):
+        " Return the cache key for the given conditions "
+        return (
+            int(rx_lo_freq // CAL_CACHE_LO_BAND_WIDTH),
+            int(tx_lo_freq // CAL_CACHE_LO_BAND_WIDTH),
+            master_clock_rate,
+            int(temp // CAL_CACHE_TEMP_BUCKET),
+        )
+
+    def store(self, key, temp):
+        " Store that a calibration ran successfully under conditions key "
+        self._entries[key] = (time.monotonic(), temp)
+
+    def lookup(self, key, temp, max_age, max_temp_drift):
+        """
+        Returns True if there is a valid calibration for key. Expired entries
+        are removed.
+
+        Arguments:
+        key -- Cache key for the current conditions, see get_key()
+        temp -- Current temperature in deg C
+        max_age -- Max. age of the calibration in seconds
+        max_temp_drift -- Max. temperature change since the calibration, in
+                          deg C
+        """
+        if key not in self._entries:
+            self.log.debug("No cached calibration for the current LO bands, "
+                           "master clock rate, and temperature.")
+            return False
+        timestamp, cal_temp = self._entries[key]
+        age = time.monotonic() - timestamp
+        if age > max_age:
+            self.log.debug("Cached calibration expired (%d s old).", age)
+            del self._entries[key]
+            return False
+        if abs(temp - cal_temp) > max_temp_drift:
+            self.log.debug("Temperature drifted from %.1f C to %.1f C since "
+                           "the last calibration.", cal_temp, temp)
+            del self._entries[key]
+            return False
+        self.log.debug("Reusing calibration from %d s ago (at %.1f C).",
+                       age, cal_temp)
+        return True
+
+    def clear(self):
+        " Drop all entries. Call this when the chip gets reset. "
+        self._entries = {}
 
 
 class MagnesiumInitManager(object):
@@ -76,6 +160,8 @@ class MagnesiumInitManager(object):
     # Variable PPS delay before the RP/SP pulsers begin. Fixed value for the
     # N3xx devices.
     N3XX_INT_PPS_DELAY = 4
+    # Init stages, in the order they're run (see init())
+    INIT_STAGES = ('clocking', 'rfic', 'rf_cal')
 
     def __init__(self, mg_class, spi_ifaces):
         self.mg_class = mg_class
@@ -151,6 +237,7 @@ class MagnesiumInitManager(object):
         return success
 
 
+    @INIT_TIMELINE.timed('mg.lmk')
     def _init_lmk(
             self,
             lmk_spi,
@@ -354,6 +441,7 @@ class MagnesiumInitManager(object):
         self.log.debug("TX LO source is set at {}".format(self.mykonos.get_lo_source("TX")))
 
 
+    @INIT_TIMELINE.timed('mg.rf_cal')
     def init_rf_cal(self, args):
         """ Setup RF CAL """
         def _parse_and_convert_cal_args(table, cal_args):
@@ -421,6 +509,7 @@ class MagnesiumInitManager(object):
         )
 
 
+    @INIT_TIMELINE.timed('mg.jesd')
     def init_jesd(self, jesdcore, master_clock_rate, args):
         """
         Bring up the JESD link between Mykonos and the N310.
@@ -504,12 +593,23 @@ class MagnesiumInitManager(object):
         self.log.debug("JESD204B Link Initialization & Training Complete")
 
 
-    def _full_init(self, slot_idx, master_clock_rate, ref_clock_freq, args):
+    @INIT_TIMELINE.timed('mg.full_init')
+    def _full_init(
+            self,
+            slot_idx,
+            master_clock_rate,
+            ref_clock_freq,
+            args,
+            init_clocking=True):
         """
         Run the full initialization sequence. This will bring everything up
         from scratch: The LMK, JESD cores, the AD9371, calibrations, and
         anything else that is clocking-related.
         Depending on the settings, this can take a fair amount of time.
+
+        If init_clocking is False, the LMK and the clock synchronization are
+        skipped, and only the JESD link and the AD9371 are brought up again.
+        This requires the clocking from a previous run to still be valid.
         """
         # Init some more periphs:
         # The following peripherals are only used during init, so we don't
@@ -522,30 +622,36 @@ class MagnesiumInitManager(object):
         ) as dboard_ctrl_regs:
             self.log.trace("Creating jesdcore object...")
             jesdcore = nijesdcore.NIMgJESDCore(dboard_ctrl_regs, slot_idx)
-            # Now get cracking with the actual init sequence:
-            self.log.trace("Creating dboard clock control object...")
-            db_clk_control = DboardClockControl(dboard_ctrl_regs, self.log)
-            self.log.debug("Reset Dboard Clocking and JESD204B interfaces...")
-            db_clk_control.reset_mmcm()
-            jesdcore.reset()
-            self.log.trace("Initializing LMK...")
-            self.mg_class.lmk = self._init_lmk(
-                self._spi_ifaces['lmk'],
-                ref_clock_freq,
-                master_clock_rate,
-                self._spi_ifaces['phase_dac'],
-                self.INIT_PHASE_DAC_WORD,
-                self.PHASE_DAC_SPI_ADDR,
-            )
-            db_clk_control.enable_mmcm()
-            # Synchronize DB Clocks
-            self._sync_db_clock(
-                dboard_ctrl_regs,
-                master_clock_rate,
-                ref_clock_freq,
-                args)
-            self.log.debug(
-                "Sample Clocks and Phase DAC Configured Successfully!")
+            if init_clocking:
+                # Now get cracking with the actual init sequence:
+                self.log.trace("Creating dboard clock control object...")
+                db_clk_control = DboardClockControl(dboard_ctrl_regs, self.log)
+                self.log.debug(
+                    "Reset Dboard Clocking and JESD204B interfaces...")
+                db_clk_control.reset_mmcm()
+                jesdcore.reset()
+                self.log.trace("Initializing LMK...")
+                self.mg_class.lmk = self._init_lmk(
+                    self._spi_ifaces['lmk'],
+                    ref_clock_freq,
+                    master_clock_rate,
+                    self._spi_ifaces['phase_dac'],
+                    self.INIT_PHASE_DAC_WORD,
+                    self.PHASE_DAC_SPI_ADDR,
+                )
+                db_clk_control.enable_mmcm()
+                # Synchronize DB Clocks
+                self._sync_db_clock(
+                    dboard_ctrl_regs,
+                    master_clock_rate,
+                    ref_clock_freq,
+                    args)
+                self.log.debug(
+                    "Sample Clocks and Phase DAC Configured Successfully!")
+            else:
+                self.log.debug("Clocking unchanged, resetting JESD204B "
+                               "interfaces only...")
+                jesdcore.reset()
             # Clocks and PPS are now fully active!
             self.mykonos.set_master_clock_rate(master_clock_rate)
             self.init_jesd(jesdcore, master_clock_rate, args)
@@ -554,73 +660,189 @@ class MagnesiumInitManager(object):
         return True
 
 
-    def init(self, args, old_args, fast_reinit):
+    def _get_stage_inputs(self, args):
         """
-        Runs the actual initialization.
-
-        Arguments:
-        args -- Dictionary with user-specified args
-        old_args -- Dictionary with user-specified args from the previous
-                    initialization run.
-        fast_reinit -- A hint to do a fast reinit. If nothing changes, then
-                       we don't have to re-init everything and their dogs, we
-                       can skip a whole bunch of things.
+        Return the inputs of all init stages (see init()). If any of them
+        changes, the according stage needs to be re-run.
         """
-        # If any of these changes, we need a full re-init:
         # TODO: This is not very DRY (because we're repeating default values),
         # and is generally smelly design. However, we're being super
         # conservative for now, because the only reliable reset sequence we
         # have for AD9371 is the full Monty. As we learn more about the chip,
         # we might be able to get away with a partial (fast) reinit even when
         # some of these values change.
-        args_that_must_not_change = [
+        rfic_args_defaults = [
             ('rx_lo_source', 'internal'),
             ('tx_lo_source', 'internal'),
+        ]
+        rf_cal_args_defaults = [
             ('init_cals', 'DEFAULT'),
             ('tracking_cals', 'DEFAULT'),
             ('init_cals_timeout', str(self.mykonos.DEFAULT_INIT_CALS_TIMEOUT)),
         ]
-        if fast_reinit:
-            for arg_key, arg_default in args_that_must_not_change:
-                old_value = old_args.get(arg_key, arg_default)
-                new_value = args.get(arg_key, arg_default)
-                if old_value != new_value:
-                    self.log.debug(
-                        "The following init arg changed and caused "
-                        "a full re-init sequence: {}".format(arg_key))
-                    fast_reinit = False
-            # TODO: Maybe we can switch to digital loopback without running the
-            # initialization. For now, force init when rfic_digital_loopback is
-            # set because we're being conservative.
-            if bool(args.get('rfic_digital_loopback')):
-                self.log.debug("Using rfic_digital_loopback causes a full "
-                               "re-init sequence.")
-                fast_reinit = False
-        # If we can't do fast re-init, start from scratch:
+        rfic_inputs = {
+            arg_key: args.get(arg_key, arg_default)
+            for arg_key, arg_default in rfic_args_defaults
+        }
+        rfic_inputs['master_clock_rate'] = self.mg_class.master_clock_rate
+        rfic_inputs['rfic_digital_loopback'] = \
+            bool(args.get('rfic_digital_loopback'))
+        return {
+            'clocking': {
+                'clock_fingerprint': self.mg_class.clock_fingerprint,
+                'ref_clock_freq': self.mg_class.ref_clock_freq,
+                'master_clock_rate': self.mg_class.master_clock_rate,
+                'time_source': args.get(
+                    'time_source', self.mg_class.default_time_source),
+            },
+            'rfic': rfic_inputs,
+            'rf_cal': {
+                arg_key: args.get(arg_key, arg_default)
+                for arg_key, arg_default in rf_cal_args_defaults
+            },
+        }
+
+
+    def _check_clocking(self):
+        """
+        Returns True if the clocking from the previous init is still good,
+        i.e., the LMK PLLs and the Radio Clock MMCM are still locked.
+        """
+        if self.mg_class.lmk is None \
+                or not self.mg_class.lmk.check_plls_locked():
+            return False
+        with open_uio(
+            label="dboard-regs-{}".format(self.slot_idx),
+            read_only=True
+        ) as dboard_ctrl_regs:
+            return DboardClockControl(dboard_ctrl_regs, self.log) \
+                .check_mmcm_locked()
+
+
+    def _check_rfic(self):
+        """
+        Returns True if the JESD204B links from the previous init are still
+        up, in both directions.
+        """
+        with open_uio(
+            label="dboard-regs-{}".format(self.slot_idx),
+            read_only=True
+        ) as dboard_ctrl_regs:
+            jesdcore = nijesdcore.NIMgJESDCore(dboard_ctrl_regs, self.slot_idx)
+            return jesdcore.get_framer_status() \
+                and jesdcore.get_deframer_status() \
+                and self.check_mykonos_framer_status() \
+                and self.check_mykonos_deframer_status()
+
+
+    def _get_temperature(self):
+        """
+        Returns the daughterboard temperature in deg C. It's read from the
+        dboard thermal zone, or from the AD9371 if that's not available.
+        """
+        try:
+            return read_thermal_sensor_value(
+                'magnesium-db{}-zone'.format(self.slot_idx), 'temp') / 1000
+        except (IndexError, KeyError, ValueError):
+            self.log.trace("Can't read dboard thermal zone, reading AD9371 "
+                           "temperature instead.")
+            return self.mykonos.get_temperature()
+
+
+    def _get_cal_cache_key(self, temp):
+        " Returns the calibration cache key for the current conditions "
+        return self.mg_class.cal_cache.get_key(
+            self.mykonos.get_freq('RX'),
+            self.mykonos.get_freq('TX'),
+            self.mg_class.master_clock_rate,
+            temp,
+        )
+
+
+    def _check_rf_cal(self, args):
+        """
+        Returns True if the calibrations the AD9371 currently holds are still
+        valid (see MagnesiumCalCache).
+        """
+        temp = self._get_temperature()
+        return self.mg_class.cal_cache.lookup(
+            self._get_cal_cache_key(temp),
+            temp,
+            float(args.get('cal_cache_max_age', CAL_CACHE_DEFAULT_MAX_AGE)),
+            float(args.get('cal_cache_max_temp_drift',
+                           CAL_CACHE_DEFAULT_MAX_TEMP_DRIFT)),
+        )
+
+
+    def init(self, args, fast_reinit):
+        """
+        Runs the actual initialization.
+
+        The initialization is split into three stages:
+        - clocking: LMK, Radio Clock MMCM, and clock synchronization
+        - rfic: JESD204B link and AD9371 initialization
+        - rf_cal: AD9371 init and tracking calibrations
+        A stage is skipped if it was run before with the same inputs (see
+        _get_stage_inputs()), and a quick status readback shows its result is
+        still valid. For rf_cal, that means the calibration cache has a valid
+        entry for the current conditions. If a stage is re-run, all following
+        stages are re-run, too.
+
+        Arguments:
+        args -- Dictionary with user-specified args
+        fast_reinit -- If False, all stages are re-run, even if nothing
+                       changed.
+        """
+        init_stages = self.mg_class.init_stages
         if not fast_reinit:
+            init_stages.invalidate()
+        stage_inputs = self._get_stage_inputs(args)
+        # TODO: Maybe we can switch to digital loopback without running the
+        # initialization. For now, always re-run the RFIC stage when
+        # rfic_digital_loopback is set because we're being conservative.
+        first_stage = init_stages.get_first_stage(stage_inputs, {
+            'clocking': self._check_clocking,
+            'rfic': lambda: not stage_inputs['rfic']['rfic_digital_loopback'] \
+                    and self._check_rfic(),
+            'rf_cal': lambda: self._check_rf_cal(args),
+        })
+        if first_stage is None:
+            self.log.debug("Running fast re-init with the following settings:")
+            for stage in ('rfic', 'rf_cal'):
+                for arg_key, arg_value in iteritems(stage_inputs[stage]):
+                    self.log.debug("{}={}".format(arg_key, arg_value))
+            return True
+        # If this fails halfway, we need to start from scratch next time
+        init_stages.invalidate(first_stage)
+        if first_stage == 'rf_cal':
+            # The JESD link is still up, so we can keep the AD9371 running
+            # and only redo its calibrations
+            self.log.debug("Re-running RF calibrations only...")
+            self.mykonos.stop_radio()
+        else:
+            # This resets the AD9371, which loses its calibrations
+            self.mg_class.cal_cache.clear()
             if not self._full_init(
                     self.mg_class.slot_idx,
                     self.mg_class.master_clock_rate,
                     self.mg_class.ref_clock_freq,
-                    args
+                    args,
+                    init_clocking=(first_stage == 'clocking'),
                 ):
                 return False
-        else:
-            self.log.debug("Running fast re-init with the following settings:")
-            for arg_key, arg_default in args_that_must_not_change:
-                self.log.debug(
-                    "{}={}".format(arg_key, args.get(arg_key, arg_default)))
-            return True
-        if bool(args.get('rfic_digital_loopback')):
-            self.log.warning(
-                "RF Functionality Disabled: JESD204b digital loopback "
-                "enabled inside Mykonos!")
-            self.mykonos.enable_jesd_loopback(1)
-        else:
-            # Now initialize calibrations:
-            # TODO: This also takes a long time. It might be faster to somehow
-            # just reset the calibrations, but one thing at a time.
-            self.init_rf_cal(args)
-            self.mykonos.start_radio()
+            init_stages.set_done('clocking', stage_inputs['clocking'])
+            init_stages.set_done('rfic', stage_inputs['rfic'])
+            if bool(args.get('rfic_digital_loopback')):
+                self.log.warning(
+                    "RF Functionality Disabled: JESD204b digital loopback "
+                    "enabled inside Mykonos!")
+                self.mykonos.enable_jesd_loopback(1)
+                return True
+        # Now initialize calibrations:
+        cal_temp = self._get_temperature()
+        cal_cache_key = self._get_cal_cache_key(cal_temp)
+        self.init_rf_cal(args)
+        self.mykonos.start_radio()
+        self.mg_class.cal_cache.store(cal_cache_key, cal_temp)
+        init_stages.set_done('rf_cal', stage_inputs['rf_cal'])
         return True
-
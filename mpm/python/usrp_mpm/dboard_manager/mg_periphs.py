@@ -93,7 +93,7 @@ class DboardClockControl(object):
         self.log.trace("Enabling FPGA Radio Clock MMCM...")
         self.poke32(self.RADIO_CLK_MMCM, 0x2)
         if not poll_with_timeout(
-                lambda: bool(self.peek32(self.RADIO_CLK_MMCM) & 0x10),
+                self.check_mmcm_locked,
                 500,
                 10,
             ):
@@ -102,6 +102,12 @@ class DboardClockControl(object):
         self.log.trace("Radio Clock MMCM locked. Enabling clocks to design...")
         self.enable_outputs(True)
 
+    def check_mmcm_locked(self):
+        """
+        Returns True if the Radio Clock MMCM is locked.
+        """
+        return bool(self.peek32(self.RADIO_CLK_MMCM) & 0x10)
+
     def check_refclk(self):
         """
         Not technically a clocking reg, but related.
@@ -9,11 +9,19 @@ Code to run the discovery port
 
 from __future__ import print_function
 from multiprocessing import Process
+import errno
+import select
 import socket
+import time
 from builtins import bytes
+from builtins import object
+import netaddr
+from usrp_mpm.gevent_compat import get_original
 from usrp_mpm.mpmtypes import MPM_DISCOVERY_PORT
 from usrp_mpm.mpmlog import get_main_logger
 from usrp_mpm.mpmutils import to_binary_str
+from usrp_mpm.sys_utils import net
+from usrp_mpm.timeline import STARTUP_TIMELINE
 
 RESPONSE_PREAMBLE = b"USRP-MPM"
 RESPONSE_SEP = b";"
@@ -24,6 +32,272 @@ MAX_MTU = 8000
 # For setsockopt
 IP_MTU_DISCOVER = 10
 IP_PMTUDISC_DO = 2
+SO_BINDTODEVICE = 25
+# Seconds after which the list of local networks and interfaces is re-read,
+# in case they changed
+NETWORK_REFRESH_INTERVAL = 10.0
+# Max. number of packets read from one socket before serving the next one
+MAX_BATCH = 64
+# Max. number of discovery responses per source address and time window
+RATE_LIMIT_MAX_RESPONSES = 20
+RATE_LIMIT_WINDOW = 1.0 # Seconds
+# The discovery process doesn't use greenlets, but it may get forked
+# with gevent monkey patching in effect (see rpc_server), which replaces the
+# socket module and removes select.epoll. Use the original versions.
+_socket = get_original('socket', 'socket')
+_epoll = get_original('select', 'epoll')
+
+class ResponseCache(object):
+    """
+    Stores the discovery response, and only rebuilds it when the shared state
+    has changed (i.e., its version has moved on).
+    """
+    def __init__(self, state):
+        self._state = state
+        self._version = None
+        self._response = None
+
+    @staticmethod
+    def _create_response_string(snapshot):
+        " Generate the string that gets sent back to the requester. "
+        return RESPONSE_SEP.join(
+            [RESPONSE_PREAMBLE] + \
+            [b"type="+snapshot.dev_type] + \
+            [b"product="+snapshot.dev_product] + \
+            [b"serial="+snapshot.dev_serial] + \
+            [RESPONSE_CLAIMED_KEY+to_binary_str("={}".format(snapshot.claim_status))]
+        )
+
+    def get(self):
+        """
+        Return the current discovery response.
+        """
+        if self._state.get_version() != self._version:
+            snapshot = self._state.get_snapshot()
+            self._response = self._create_response_string(snapshot)
+            self._version = snapshot.seq
+        return self._response
+
+
+class SubnetFilter(object):
+    """
+    Decides which senders get a discovery response.
+
+    If discovery_addr is '0.0.0.0', everyone gets one. Otherwise, only
+    senders on the same network as discovery_addr get a response. The
+    network is looked up from the local interfaces. If there is no local
+    interface on that network, discovery_addr is used as a /24 network if it's
+    a broadcast address (e.g., 192.168.10.255), or as a single address if
+    not.
+    """
+    def __init__(self, discovery_addr, log):
+        self.log = log
+        self._discovery_addr = None
+        if discovery_addr != '0.0.0.0':
+            self._discovery_addr = netaddr.IPAddress(discovery_addr)
+        # List of (first, last) IP address ranges, as integers
+        self._ranges = []
+        self._next_refresh = 0
+
+    def _refresh(self):
+        " Re-read the local networks and rebuild the list of address ranges "
+        networks = [
+            netaddr.IPNetwork(network)
+            for iface_networks in net.get_iface_networks().values()
+            for network in iface_networks
+        ]
+        networks = [x for x in networks if self._discovery_addr in x]
+        if not networks:
+            prefixlen = 24 if self._discovery_addr.words[-1] == 255 else 32
+            networks = [
+                netaddr.IPNetwork("{}/{}".format(
+                    self._discovery_addr, prefixlen))
+            ]
+        self.log.debug("Answering discovery requests from: %s",
+                       ", ".join(str(x.cidr) for x in networks))
+        self._ranges = [(x.first, x.last) for x in networks]
+        self._next_refresh = time.monotonic() + NETWORK_REFRESH_INTERVAL
+
+    def is_allowed(self, sender_addr):
+        """
+        Returns True if sender_addr (an IPv4 address string) should get a
+        discovery response.
+        """
+        if self._discovery_addr is None:
+            return True
+        if time.monotonic() >= self._next_refresh:
+            self._refresh()
+        sender_addr = int(netaddr.IPAddress(sender_addr))
+        for first, last in self._ranges:
+            if first <= sender_addr <= last:
+                return True
+        return False
+
+
+class SourceRateLimiter(object):
+    """
+    Limits the number of discovery responses per source address. Counts
+    are kept per time window and are reset at the start of every window, so
+    memory usage is bounded even when requests come from many sources.
+    """
+    def __init__(self):
+        self._counts = {}
+        self._window_start = 0
+        self.num_dropped = 0
+
+    def is_allowed(self, sender_addr):
+        """
+        Returns True if sender_addr may get another response in the current
+        window.
+        """
+        now = time.monotonic()
+        if now - self._window_start >= RATE_LIMIT_WINDOW:
+            self._counts.clear()
+            self._window_start = now
+        count = self._counts.get(sender_addr, 0)
+        if count >= RATE_LIMIT_MAX_RESPONSES:
+            self.num_dropped += 1
+            return False
+        self._counts[sender_addr] = count + 1
+        return True
+
+
+class DiscoveryResponder(object):
+    """
+    Answers discovery and echo requests.
+
+    There is one socket per network interface (using SO_BINDTODEVICE), so
+    every request is answered on the interface it came in on. All sockets
+    are served from a single epoll loop, which reads up to MAX_BATCH packets
+    from a socket before moving on to the next one. If the sockets can't be
+    bound to interfaces, a single socket bound to all interfaces is used
+    instead.
+    """
+    def __init__(self, state, discovery_addr, log):
+        self.log = log
+        self._response_cache = ResponseCache(state)
+        self._subnet_filter = SubnetFilter(discovery_addr, log)
+        self._rate_limiter = SourceRateLimiter()
+        self._epoll = _epoll()
+        # Maps file descriptor -> socket
+        self._socks = {}
+        # Maps interface name -> socket. The interface name is None if we
+        # couldn't bind to individual interfaces.
+        self._iface_socks = {}
+        self._bind_to_iface = True
+        self._next_refresh = 0
+
+    def _open_socket(self, iface):
+        """
+        Open a non-blocking discovery socket on iface, or on all interfaces
+        if iface is None.
+        """
+        sock = _socket(socket.AF_INET, socket.SOCK_DGRAM)
+        try:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            if iface is not None:
+                sock.setsockopt(
+                    socket.SOL_SOCKET, SO_BINDTODEVICE, to_binary_str(iface))
+            sock.setsockopt(socket.IPPROTO_IP, IP_MTU_DISCOVER, IP_PMTUDISC_DO)
+            sock.bind(("0.0.0.0", MPM_DISCOVERY_PORT))
+            sock.setblocking(False)
+        except Exception:
+            sock.close()
+            raise
+        self._iface_socks[iface] = sock
+        self._socks[sock.fileno()] = sock
+        self._epoll.register(sock.fileno(), select.EPOLLIN)
+
+    def _close_socket(self, iface):
+        " Close the socket for iface "
+        sock = self._iface_socks.pop(iface)
+        self._epoll.unregister(sock.fileno())
+        self._socks.pop(sock.fileno())
+        sock.close()
+
+    def _refresh_sockets(self):
+        """
+        Open sockets for new interfaces, and close the ones for interfaces
+        that went away.
+        """
+        self._next_refresh = time.monotonic() + NETWORK_REFRESH_INTERVAL
+        if self._rate_limiter.num_dropped:
+            self.log.debug("Dropped %d discovery requests because of rate "
+                           "limiting.", self._rate_limiter.num_dropped)
+            self._rate_limiter.num_dropped = 0
+        if not self._bind_to_iface:
+            return
+        # Aliases are labeled like `eth0:1'
+        ifaces = {
+            label.split(':')[0] for label in net.get_iface_networks().keys()
+        }
+        for iface in set(self._iface_socks.keys()) - ifaces:
+            self.log.debug("Closing discovery socket on %s", iface)
+            self._close_socket(iface)
+        for iface in ifaces - set(self._iface_socks.keys()):
+            self.log.debug("Opening discovery socket on %s", iface)
+            try:
+                self._open_socket(iface)
+            except (IOError, OSError) as ex:
+                if ex.errno != errno.EPERM:
+                    self.log.warning("Could not open discovery socket on %s: "
+                                     "%s", iface, str(ex))
+                    continue
+                self.log.warning("Not allowed to bind to interfaces, "
+                                 "listening on all interfaces instead.")
+                for open_iface in list(self._iface_socks.keys()):
+                    self._close_socket(open_iface)
+                self._open_socket(None)
+                self._bind_to_iface = False
+                return
+
+    def _handle_request(self, sock, data, sender):
+        " Handle a single request packet "
+        self.log.trace("Got poked by: %s", sender[0])
+        if not self._subnet_filter.is_allowed(sender[0]):
+            return
+        request = data.strip(b"\0")
+        if request == b"MPM-DISC":
+            if not self._rate_limiter.is_allowed(sender[0]):
+                return
+            send_data = self._response_cache.get()
+            self.log.trace("Sending discovery response to %s port: %d",
+                           sender[0], sender[1])
+        elif request.startswith(b"MPM-ECHO"):
+            self.log.trace("Received echo request from %s", sender[0])
+            send_data = data
+        else:
+            return
+        try:
+            sock.sendto(send_data, sender)
+        except (IOError, OSError) as ex:
+            self.log.debug("Send error to %s: %s", sender[0], str(ex))
+
+    def _drain(self, sock):
+        " Handle up to MAX_BATCH packets that are waiting on sock "
+        for _ in range(MAX_BATCH):
+            try:
+                data, sender = sock.recvfrom(MAX_MTU)
+            except (IOError, OSError) as ex:
+                if ex.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    return
+                raise
+            self._handle_request(sock, data, sender)
+
+    def run(self):
+        """
+        Serve requests forever.
+        """
+        self._refresh_sockets()
+        self.log.info("Discovery ready, %.3f s after startup.",
+                      STARTUP_TIMELINE.get_time())
+        while True:
+            if time.monotonic() >= self._next_refresh:
+                self._refresh_sockets()
+            timeout = max(self._next_refresh - time.monotonic(), 0)
+            for fileno, _ in self._epoll.poll(timeout):
+                self._drain(self._socks[fileno])
+
 
 def spawn_discovery_process(shared_state, discovery_addr):
     """
@@ -50,52 +324,8 @@ def _discovery_process(state, discovery_addr):
     spawn_discovery_process().
     """
     log = get_main_logger().getChild('discovery')
-    def create_response_string(state):
-        " Generate the string that gets sent back to the requester. "
-        return RESPONSE_SEP.join(
-            [RESPONSE_PREAMBLE] + \
-            [b"type="+state.dev_type.value] + \
-            [b"product="+state.dev_product.value] + \
-            [b"serial="+state.dev_serial.value] + \
-            [RESPONSE_CLAIMED_KEY+to_binary_str("={}".format(state.claim_status.value))]
-        )
-
-    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-    # FIXME really, we should only bind to the subnet but I haven't gotten that
-    # working yet
-    sock.bind((("0.0.0.0", MPM_DISCOVERY_PORT)))
-    send_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-    send_sock.setsockopt(socket.IPPROTO_IP, IP_MTU_DISCOVER, IP_PMTUDISC_DO)
-
-    # TODO yeah I know that's not how you do this
-    discovery_addr_prefix = discovery_addr.replace('.255', '')
-    if discovery_addr == '0.0.0.0':
-        discovery_addr_prefix = ''
-
     try:
-        while True:
-            data, sender = sock.recvfrom(MAX_MTU)
-            log.debug("Got poked by: %s", sender[0])
-            # TODO this is still part of the awful subnet identification
-            if not sender[0].startswith(discovery_addr_prefix):
-                continue
-            if data.strip(b"\0") == b"MPM-DISC":
-                log.debug("Sending discovery response to %s port: %d",
-                          sender[0], sender[1])
-                resp_str = create_response_string(state)
-                send_data = resp_str
-                log.trace("Return data: %s", send_data)
-                send_sock.sendto(send_data, sender)
-            elif data.strip(b"\0").startswith(b"MPM-ECHO"):
-                log.debug("Received echo request from {sender}"
-                          .format(sender=sender[0]))
-                send_data = data
-                try:
-                    send_sock.sendto(send_data, sender)
-                except OSError as ex:
-                    log.warning("ECHO send error: %s", str(ex))
+        DiscoveryResponder(state, discovery_addr, log).run()
     except Exception as err:
         log.error("Unexpected error: `%s' Type: `%s'", str(err), type(err))
-        sock.close()
-        send_sock.close()
         exit(1)
@@ -12,7 +12,7 @@ from builtins import object
 import netaddr
 from usrp_mpm.mpmlog import get_logger
 from usrp_mpm.sys_utils.uio import UIO
-from usrp_mpm.sys_utils.net import get_mac_addr
+from usrp_mpm.sys_utils.net import get_mac_addr, get_iface_cache
 
 
 class EthDispatcherTable(object):
@@ -73,48 +73,56 @@ class EthDispatcherTable(object):
                     address. String format, ("aa:bb:cc:dd:ee:ff"), case does
                     not matter.
         """
-        udp_port = int(udp_port)
-        if mac_addr is None:
-            mac_addr = get_mac_addr(ip_addr)
-        if mac_addr is None:
-            self.log.error(
-                "Could not resolve a MAC address for IP address `{}'".format(ip_addr)
-            )
-        dst_ep = sid.dst_ep
-        self.log.debug(
-            "Routing SID `{sid}' (endpoint `{ep}') to IP address `{ip}', " \
-            "MAC address `{mac}', port `{port}'".format(
-                sid=str(sid),
-                ep=dst_ep,
-                ip=ip_addr,
-                mac=mac_addr,
-                port=udp_port
-            )
-        )
-        ip_addr_int = int(netaddr.IPAddress(ip_addr))
-        mac_addr_int = int(netaddr.EUI(mac_addr))
-        sid_offset = 4 * dst_ep
+        self.set_routes([(sid, ip_addr, udp_port, mac_addr)])
 
-        def poke_and_trace(addr, data):
-            " Do a poke32() and log.trace() "
-            self.log.trace("Writing to address 0x{:04X}: 0x{:04X}".format(
-                addr, data
-            ))
-            self.poke32(addr, data)
+    def set_routes(self, routes):
+        """
+        Like set_route(), but for many routes at once. MAC addresses are
+        looked up from one read of the neighbour table, and the registers for
+        all routes are written while the UIO is opened once.
 
-        with self._regs.open():
-            poke_and_trace(
-                self.SID_IP_OFFSET + sid_offset,
-                ip_addr_int
-            )
-            poke_and_trace(
-                self.SID_MAC_LO_OFFSET + sid_offset,
-                mac_addr_int & 0xFFFFFFFF,
-            )
-            poke_and_trace(
-                self.SID_PORT_MAC_HI_OFFSET + sid_offset,
-                (udp_port << 16) | (mac_addr_int >> 32)
+        routes -- List of (sid, ip_addr, udp_port, mac_addr) tuples. See
+                  set_route() for the meaning of the individual values.
+                  mac_addr may be None.
+        """
+        neighbours = get_iface_cache().get_neighbours()
+        reg_writes = []
+        for sid, ip_addr, udp_port, mac_addr in routes:
+            udp_port = int(udp_port)
+            if mac_addr is None:
+                mac_addr = neighbours.get(ip_addr) or get_mac_addr(ip_addr)
+            if mac_addr is None:
+                self.log.error(
+                    "Could not resolve a MAC address for IP address `{}'".format(ip_addr)
+                )
+            dst_ep = sid.dst_ep
+            self.log.debug(
+                "Routing SID `{sid}' (endpoint `{ep}') to IP address `{ip}', " \
+                "MAC address `{mac}', port `{port}'".format(
+                    sid=str(sid),
+                    ep=dst_ep,
+                    ip=ip_addr,
+                    mac=mac_addr,
+                    port=udp_port
+                )
             )
+            ip_addr_int = int(netaddr.IPAddress(ip_addr))
+            mac_addr_int = int(netaddr.EUI(mac_addr))
+            sid_offset = 4 * dst_ep
+            reg_writes += [
+                (self.SID_IP_OFFSET + sid_offset, ip_addr_int),
+                (self.SID_MAC_LO_OFFSET + sid_offset,
+                 mac_addr_int & 0xFFFFFFFF),
+                (self.SID_PORT_MAC_HI_OFFSET + sid_offset,
+                 (udp_port << 16) | (mac_addr_int >> 32)),
+            ]
+
+        with self._regs.open():
+            for addr, data in reg_writes:
+                self.log.trace("Writing to address 0x{:04X}: 0x{:04X}".format(
+                    addr, data
+                ))
+                self.poke32(addr, data)
 
     def set_forward_policy(self, forward_eth, forward_bcast):
         """
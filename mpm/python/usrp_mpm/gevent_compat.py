@@ -0,0 +1,33 @@
+#
+# Copyright 2018 Ettus Research, a National Instruments Company
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+#
+"""
+Access to the original (not gevent monkey patched) standard library
+
+Code that runs in native threads, or that shares objects between them, needs
+the original thread, lock, socket, and select() implementations, even if
+gevent monkey patching is active (see the notes on threads in rpc_server).
+This module doesn't import gevent, so it can be used by modules that don't
+otherwise depend on it.
+"""
+
+import importlib
+import sys
+
+def get_original(module_name, item_name):
+    """
+    Return item_name from the module module_name, as it was before gevent
+    monkey patching. Like gevent.monkey.get_original(), but if gevent.monkey
+    was never imported, nothing can be patched yet, and the item is taken
+    straight from the module.
+
+    Arguments:
+    module_name -- Name of the module, e.g. '_thread'
+    item_name -- Name of the item in that module, e.g. 'allocate_lock'
+    """
+    monkey = sys.modules.get('gevent.monkey')
+    if monkey is not None:
+        return monkey.get_original(module_name, item_name)
+    return getattr(importlib.import_module(module_name), item_name)
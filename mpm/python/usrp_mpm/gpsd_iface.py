@@ -11,10 +11,28 @@ from __future__ import print_function
 import socket
 import json
 import time
-import select
 import datetime
+from usrp_mpm.gevent_compat import get_original
 from usrp_mpm.mpmlog import get_logger
 
+# GPSDIfaceExtension reads from GPSd in a native thread, so it needs the
+# original thread, socket, select() and sleep() implementations, even if
+# gevent monkey patching is active. It's a plain thread rather than part of a
+# gevent ThreadPool, because close() may be called from any thread.
+_start_new_thread = get_original('_thread', 'start_new_thread')
+_socket = get_original('socket', 'socket')
+_select = get_original('select', 'select')
+_sleep = get_original('time', 'sleep')
+
+# Max. number of bytes read from the GPSd socket at once
+GPSD_READ_SIZE = 4096
+# The reader thread checks if it should stop at least this often (seconds)
+GPSD_READ_TIMEOUT = 1.0
+# Time between attempts to (re-)connect to GPSd (seconds)
+GPSD_RECONNECT_INTERVAL = 5.0
+# If the latest TPV report is older than this (seconds), there is no GPS time
+GPSD_MAX_TPV_AGE = 5.0
+
 
 class GPSDIface(object):
     """
@@ -25,12 +43,8 @@ class GPSDIface(object):
     (resp_class) and return that class message. If no filter is provided, this function will return
     the first response (not counting the VERSION message).
 
-    The MPM SKY sensors returns the first available response- there shouldn't be anything tricky
-    about this. The MPM TPV sensor, however, returns an interesting value in the shortest time
-    possible. If the GPSD has received a TPV report since we connected (and sent the start
-    command), this function should return immediately. However, if no report is ready, the function
-    waits until an interesting result is ready and returns that. This is achieved by discarding
-    `mode=0` responses.
+    A socket can only be connected once, so a new GPSDIface object is required to reconnect after
+    calling close().
     """
     def __init__(self):
         # Make a logger
@@ -40,7 +54,9 @@ class GPSDIface(object):
             from usrp_mpm.mpmlog import get_main_logger
             self.log = get_main_logger('GPSDIface')
         # Make a socket to connect to GPSD
-        self.gpsd_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.gpsd_socket = _socket(socket.AF_INET, socket.SOCK_STREAM)
+        # Data that was received, but not returned by socket_read_line() yet
+        self._read_buffer = b''
 
     def __enter__(self):
         self.open()
@@ -80,23 +96,27 @@ class GPSDIface(object):
         self.gpsd_socket.sendall(query_cmd)
         self.log.trace("Sent query: {}".format(query_cmd))
 
-    def socket_read_line(self, timeout=60, interval=0.1):
+    def socket_read_line(self, timeout=60):
         """
         Read from a socket until newline. If there was no newline until the timeout
         occurs, raise an error. Otherwise, return the line.
+
+        Data is read in blocks, anything after the newline is kept for the next call. If GPSd
+        closed the connection, an IOError is raised.
         """
-        line = b''
         end_time = time.time() + timeout
-        while time.time() < end_time:
-            socket_ready = select.select([self.gpsd_socket], [], [], 0)[0]
-            if socket_ready:
-                next_char = self.gpsd_socket.recv(1)
-                if next_char == b'\n':
-                    return line.decode('ascii')
-                line += next_char
-            else:
-                time.sleep(interval)
-        raise RuntimeError("socket_read_line() exceeded read timeout!")
+        while b'\n' not in self._read_buffer:
+            time_left = end_time - time.time()
+            if time_left <= 0:
+                raise RuntimeError("socket_read_line() exceeded read timeout!")
+            if not _select([self.gpsd_socket], [], [], time_left)[0]:
+                continue
+            data = self.gpsd_socket.recv(GPSD_READ_SIZE)
+            if not data:
+                raise IOError("GPSd closed the connection")
+            self._read_buffer += data
+        line, self._read_buffer = self._read_buffer.split(b'\n', 1)
+        return line.decode('ascii')
 
     def get_gps_info(self, resp_class='', timeout=60):
         """Convenience function for getting a response which contains a response class"""
@@ -145,47 +165,119 @@ class GPSDIfaceExtension(object):
             # The GPSDIfaceExtension methods are now registered with foo, so
             # we can call `get_gps_time`
             print(self.get_gps_time())
+
+    A background thread keeps a connection to GPSd open, and stores the
+    latest TPV and SKY reports as they arrive. The GPS sensors return these
+    stored reports, so they never have to wait for GPSd. If the connection
+    fails, the thread keeps trying to reconnect. Call close() to stop it.
     """
     def __init__(self):
         self._gpsd_iface = GPSDIface()
-        self._gpsd_iface.open()
         self._log = self._gpsd_iface.log
+        # Maps report class -> (time.monotonic() when received, report).
+        # Only the reader thread writes to this.
+        self._reports = {}
+        self._stop_reader = False
+        _start_new_thread(self._read_reports, ())
 
-    def __del__(self):
-        self._gpsd_iface.close()
+    def close(self):
+        """
+        Stop the reader thread. It closes the connection to GPSd within
+        GPSD_READ_TIMEOUT seconds (or GPSD_RECONNECT_INTERVAL seconds, if it's
+        not connected), and then exits. This doesn't wait for it.
+        """
+        self._stop_reader = True
 
     def extend(self, context):
         """Register the GSPDIfaceExtension object's public function with `context`"""
         new_methods = [method_name for method_name in dir(self)
                        if not method_name.startswith('_') \
                        and callable(getattr(self, method_name)) \
-                       and method_name != "extend"]
+                       and method_name not in ("extend", "close")]
         for method_name in new_methods:
             new_method = getattr(self, method_name)
             self._log.trace("%s: Adding %s method", context, method_name)
             setattr(context, method_name, new_method)
         return new_methods
 
+    def _read_reports(self):
+        """
+        Body of the reader thread: Watch GPSd and store the reports it sends,
+        and reconnect if the connection fails.
+        """
+        # Only the first of a series of failed connection attempts is a warning
+        log_failure = self._log.warning
+        while not self._stop_reader:
+            try:
+                self._gpsd_iface.open()
+                self._gpsd_iface.watch_query()
+                log_failure = self._log.warning
+                while not self._stop_reader:
+                    try:
+                        self._store_report(self._gpsd_iface.socket_read_line(
+                            timeout=GPSD_READ_TIMEOUT))
+                    except RuntimeError:
+                        # No data within the timeout, that's fine
+                        continue
+            except (IOError, OSError) as ex:
+                log_failure(
+                    "Connection to GPSd failed: %s. Retrying in %.1f s.",
+                    str(ex), GPSD_RECONNECT_INTERVAL)
+                log_failure = self._log.debug
+            self._gpsd_iface.close()
+            if self._stop_reader:
+                break
+            _sleep(GPSD_RECONNECT_INTERVAL)
+            self._gpsd_iface = GPSDIface()
+
+    def _store_report(self, json_report):
+        """
+        Parse a report from GPSd, and store it if it's a TPV or SKY report.
+        TPV reports without a mode (mode=0) are discarded.
+        """
+        try:
+            report = json.loads(json_report)
+        except ValueError:
+            self._log.trace("Ignoring invalid JSON from GPSd: %s", json_report)
+            return
+        report_class = report.get("class")
+        if report_class not in ("TPV", "SKY"):
+            return
+        if report_class == "TPV" and report.get("mode", 0) == 0:
+            return
+        self._reports[report_class] = (time.monotonic(), report)
+
+    def _get_report(self, report_class):
+        """
+        Return the latest stored report of class report_class, and its age in
+        seconds, as a tuple. Throws if there is none.
+        """
+        try:
+            receive_time, report = self._reports[report_class]
+        except KeyError:
+            raise RuntimeError(
+                "No {} report received from GPSd yet.".format(report_class))
+        return report, time.monotonic() - receive_time
+
     def get_gps_time_sensor(self):
         """
         Retrieve the GPS time using a TPV response from GPSd, and returns as a sensor dict
         This time is not high accuracy.
+
+        The time of the latest TPV report is advanced by the time that passed since it was
+        received.
         """
-        self._log.trace("Polling GPS time results from GPSD")
-        # Read responses from GPSD until we get a non-trivial mode
-        self._gpsd_iface.watch_query()
-        while True:
-            gps_info = self._gpsd_iface.get_gps_info(resp_class='tpv', timeout=15)
-            self._log.trace("GPS info: {}".format(gps_info))
-            if gps_info.get("mode", 0) > 0:
-                break
-        self._gpsd_iface.stop_query()
+        gps_info, age = self._get_report("TPV")
+        self._log.trace("GPS info: {} (age: {:.3f} s)".format(gps_info, age))
+        if age > GPSD_MAX_TPV_AGE:
+            raise RuntimeError(
+                "Latest TPV report from GPSd is {:.1f} s old.".format(age))
         time_str = gps_info.get("time", "")
         self._log.trace("GPS time string: {}".format(time_str))
         time_dt = datetime.datetime.strptime(time_str, "%Y-%m-%dT%H:%M:%S.%fZ")
         self._log.trace("GPS datetime: {}".format(time_dt))
         epoch_dt = datetime.datetime(1970, 1, 1)
-        gps_time = int((time_dt - epoch_dt).total_seconds())
+        gps_time = int((time_dt - epoch_dt).total_seconds() + age)
         return {
             'name': 'gps_time',
             'type': 'INTEGER',
@@ -194,18 +286,13 @@ class GPSDIfaceExtension(object):
         }
 
     def get_gps_tpv_sensor(self):
-        """Get a TPV response from GPSd as a sensor dict"""
-        self._log.trace("Polling GPS TPV results from GPSD")
-        # Read responses from GPSD until we get a non-trivial mode
-        self._gpsd_iface.watch_query()
-        while True:
-            gps_info = self._gpsd_iface.get_gps_info(resp_class='tpv', timeout=15)
-            self._log.trace("GPS info: {}".format(gps_info))
-            if gps_info.get("mode", 0) > 0:
-                break
-        self._gpsd_iface.stop_query()
+        """
+        Get the latest TPV response from GPSd as a sensor dict. The key 'age' is added to the
+        response, it's the time in seconds since the response was received.
+        """
+        gps_info, age = self._get_report("TPV")
         # Return the JSON'd results
-        gps_tpv = json.dumps(gps_info)
+        gps_tpv = json.dumps(dict(gps_info, age=age))
         return {
             'name': 'gps_tpv',
             'type': 'STRING',
@@ -214,14 +301,13 @@ class GPSDIfaceExtension(object):
         }
 
     def get_gps_sky_sensor(self):
-        """Get a SKY response from GPSd as a sensor dict"""
-        self._log.trace("Polling GPS SKY results from GPSD")
-        # Just get the first SKY result
-        self._gpsd_iface.watch_query()
-        gps_info = self._gpsd_iface.get_gps_info(resp_class='sky', timeout=15)
-        self._gpsd_iface.stop_query()
+        """
+        Get the latest SKY response from GPSd as a sensor dict. The key 'age' is added to the
+        response, it's the time in seconds since the response was received.
+        """
+        gps_info, age = self._get_report("SKY")
         # Return the JSON'd results
-        gps_sky = json.dumps(gps_info)
+        gps_sky = json.dumps(dict(gps_info, age=age))
         return {
             'name': 'gps_sky',
             'type': 'STRING',
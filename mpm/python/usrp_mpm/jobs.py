@@ -0,0 +1,211 @@
+#
+# Copyright 2018 Ettus Research, a National Instruments Company
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+#
+"""
+Asynchronous jobs for long-running RPC calls
+"""
+
+import itertools
+import threading
+import time
+from collections import OrderedDict
+from builtins import object
+
+# Number of finished jobs that we keep around so their results can still be
+# queried. Running jobs are never dropped.
+MAX_FINISHED_JOBS = 32
+
+# Stores the job that is executing in the current thread/greenlet
+_CURRENT_JOB = threading.local()
+
+def report_progress(stage):
+    """
+    Report progress of the job which is currently running. stage is a short,
+    human-readable string describing what's happening right now (e.g.,
+    "Initializing daughterboards").
+
+    If the caller is not running as part of a job, this does nothing. It is
+    thus always safe to call this function.
+    """
+    job = getattr(_CURRENT_JOB, 'job', None)
+    if job is not None:
+        job.set_stage(stage)
+
+
+def propagate_job(function):
+    """
+    Return a callable that runs function as part of the job that is running
+    in the current thread or greenlet. Use this when handing off work to
+    another thread, so that report_progress() calls from that thread still
+    reach the job.
+
+    If no job is running, function is returned unchanged.
+    """
+    job = getattr(_CURRENT_JOB, 'job', None)
+    if job is None:
+        return function
+    def job_function(*args):
+        " Run function with the current job set "
+        _CURRENT_JOB.job = job
+        try:
+            return function(*args)
+        finally:
+            _CURRENT_JOB.job = None
+    return job_function
+
+
+class Job(object):
+    """
+    Represents a single call that is executed asynchronously.
+    """
+    STATE_PENDING = 'pending'
+    STATE_RUNNING = 'running'
+    STATE_DONE = 'done'
+    STATE_FAILED = 'failed'
+
+    def __init__(self, job_id, name, function, args, log):
+        self.job_id = job_id
+        self.name = name
+        self.state = self.STATE_PENDING
+        self.result = None
+        self.error = ""
+        self.handle = None
+        self._function = function
+        self._args = args
+        self._log = log
+        self._start_time = None
+        self._end_time = None
+        # List of (seconds since start, stage) tuples
+        self._stages = []
+
+    def set_stage(self, stage):
+        """
+        Update the current stage of this job.
+        """
+        self._log.trace("Job %d (%s): %s", self.job_id, self.name, stage)
+        self._stages.append((self.get_duration(), stage))
+
+    def is_finished(self):
+        """
+        Returns True if this job is done or failed.
+        """
+        return self.state in (self.STATE_DONE, self.STATE_FAILED)
+
+    def get_duration(self):
+        """
+        Returns the number of seconds this job has been running (or took to
+        run, if it's finished).
+        """
+        if self._start_time is None:
+            return 0.0
+        return (self._end_time or time.time()) - self._start_time
+
+    def run(self):
+        """
+        Execute the job. This is what gets spawned by the JobManager.
+        """
+        _CURRENT_JOB.job = self
+        self._start_time = time.time()
+        self.state = self.STATE_RUNNING
+        try:
+            self.result = self._function(*self._args)
+            self.state = self.STATE_DONE
+        except Exception as ex:
+            self._log.error("Job %d (%s) failed: %s",
+                            self.job_id, self.name, str(ex))
+            self.error = str(ex)
+            self.state = self.STATE_FAILED
+        finally:
+            self._end_time = time.time()
+            _CURRENT_JOB.job = None
+        self._log.debug("Job %d (%s) finished after %.02f s, state: %s",
+                        self.job_id, self.name, self.get_duration(),
+                        self.state)
+        return self.result
+
+    def get_status(self):
+        """
+        Return the status of this job as a dictionary with the following
+        keys:
+        - id: The job ID
+        - name: Name of the call this job is running
+        - state: One of 'pending', 'running', 'done', 'failed'
+        - stage: The most recently reported stage, or an empty string
+        - stages: List of all reported stages as (time, stage) tuples,
+                  where time is the number of seconds since job start
+        - duration: Seconds since job start, or total run time if finished
+        - result: The return value of the call (None if not done)
+        - error: The error string if the job failed, or an empty string
+        """
+        return {
+            'id': self.job_id,
+            'name': self.name,
+            'state': self.state,
+            'stage': self._stages[-1][1] if self._stages else "",
+            'stages': list(self._stages),
+            'duration': self.get_duration(),
+            'result': self.result,
+            'error': self.error,
+        }
+
+
+class JobManager(object):
+    """
+    Spawns and keeps track of jobs.
+
+    Arguments:
+    spawn -- Callable that takes a function, executes it asynchronously, and
+             returns a handle that has a join(timeout) method (e.g.,
+             gevent.spawn).
+    log -- Logger object
+    """
+    def __init__(self, spawn, log):
+        self._spawn = spawn
+        self.log = log
+        self._jobs = OrderedDict()
+        self._job_ids = itertools.count(1)
+
+    def start(self, name, function, *args):
+        """
+        Spawn function(*args) as a new job. Returns the job ID.
+        """
+        job = Job(next(self._job_ids), name, function, args, self.log)
+        self.log.debug("Starting job %d (%s)", job.job_id, name)
+        self._jobs[job.job_id] = job
+        job.handle = self._spawn(job.run)
+        self._prune()
+        return job.job_id
+
+    def _prune(self):
+        """
+        Remove the oldest finished jobs if we're tracking too many.
+        """
+        finished_jobs = [
+            job_id for job_id, job in self._jobs.items() if job.is_finished()
+        ]
+        for job_id in finished_jobs[:-MAX_FINISHED_JOBS]:
+            self._jobs.pop(job_id)
+
+    def _get_job(self, job_id):
+        " Return a job object or throw "
+        if job_id not in self._jobs:
+            raise RuntimeError("Unknown job ID: {}".format(job_id))
+        return self._jobs[job_id]
+
+    def get_status(self, job_id):
+        """
+        Return the status dictionary of a job. See Job.get_status().
+        """
+        return self._get_job(job_id).get_status()
+
+    def wait(self, job_id, timeout):
+        """
+        Wait for up to timeout seconds for a job to finish, then return its
+        status. If the job is already finished, returns immediately.
+        """
+        job = self._get_job(job_id)
+        if not job.is_finished():
+            job.handle.join(timeout)
+        return job.get_status()
@@ -24,6 +24,8 @@ class LiberioDispatcherTable(object):
         self._regs = UIO(label=label, read_only=False)
         self.poke32 = self._regs.poke32
         self.peek32 = self._regs.peek32
+        # Routes we've programmed: destination endpoint -> DMA channel
+        self._routes = {}
 
     def set_route(self, sid, dma_channel):
         """
@@ -33,7 +35,17 @@ class LiberioDispatcherTable(object):
 
         sid -- Full SID, but only destination part matters.
         dma_channel -- The DMA channel to which these packets should get routed.
+
+        Returns True if the table was written, or False if the route was
+        already programmed.
         """
+        if self._routes.get(sid.dst_ep) == dma_channel:
+            self.log.trace(
+                "SID `{sid}' is already routed to DMA channel `{chan}'.".format(
+                    sid=str(sid), chan=dma_channel
+                )
+            )
+            return False
         self.log.debug(
             "Routing SID `{sid}' to DMA channel `{chan}'.".format(
                 sid=str(sid), chan=dma_channel
@@ -53,8 +65,11 @@ class LiberioDispatcherTable(object):
                     dma_channel,
                 )
         except Exception as ex:
+            self._routes.pop(sid.dst_ep, None)
             self.log.error(
                 "Unexpected exception while setting route: %s",
                 str(ex),
             )
             raise
+        self._routes[sid.dst_ep] = dma_channel
+        return True
@@ -9,11 +9,18 @@ MPM Logging
 
 from __future__ import print_function
 import copy
+import itertools
+from bisect import bisect_left
 import logging
 from logging import CRITICAL, ERROR, WARNING, INFO, DEBUG
 from logging import handlers
 import collections
 from builtins import str
+from usrp_mpm.gevent_compat import get_original
+
+# Log handlers are shared by all threads, so they need original (not gevent)
+# locks. See the notes on threads in rpc_server.
+_RLock = get_original('_thread', 'RLock')
 
 # Colors
 BOLD = str('\033[1m')
@@ -59,12 +66,26 @@ class LossyQueueHandler(handlers.QueueHandler):
     """
     Like QueueHandler, except it'll try and keep the youngest, not oldest,
     entries.
+
+    The queue needs to be a deque with a maxlen. Records are stored in a
+    compact form, as (seq, created, levelno, name, message) tuples, where seq
+    is a sequence number that increments by one for every record.
     """
+    def __init__(self, queue):
+        handlers.QueueHandler.__init__(self, queue)
+        self._seq = itertools.count()
+
     def enqueue(self, record):
         """
         Replaces logging.handlers.QueueHandler.enqueue()
         """
-        self.queue.appendleft(record)
+        self.queue.append((
+            next(self._seq),
+            record.created,
+            record.levelno,
+            record.name,
+            record.message,
+        ))
 
 class MPMLogger(logging.getLoggerClass()):
     """
@@ -82,31 +103,73 @@ class MPMLogger(logging.getLoggerClass()):
         self.py_log_buf = collections.deque(
             maxlen=prefs.get_prefs().getint('mpm', 'log_buf_size')
         )
+        # Cursor for get_log_buf()
+        self._log_buf_cursor = 0
 
     def trace(self, *args, **kwargs):
         """ Extends logging for super-high verbosity """
         self.log(TRACE, *args, **kwargs)
 
-    def get_log_buf(self):
+    def get_logs_since(self, cursor, max_n, min_level=0):
         """
-        Return the contents of the logging queue, formatted as a list of
-        dictionaries.
+        Return log records from the logging queue, starting at sequence
+        number cursor. This does not remove records from the queue, so any
+        number of readers can use this call at the same time.
+
+        Arguments:
+        cursor -- Sequence number of the first record to return. Start with
+                  0 to get all records in the queue, or with -1 to skip all
+                  records that are currently in the queue.
+        max_n -- Return no more than this many records
+        min_level -- Skip records below this log level
+
+        Returns a tuple (next_cursor, num_lost, records):
+        - next_cursor: Pass this as cursor to the next call
+        - num_lost: Number of records that were dropped from the queue
+          before they could be read
+        - records: List of (seq, created, levelno, name, message) tuples,
+          oldest first. created is a Unix timestamp.
         """
+        # Loggers on other threads may append to the queue at any time, so
+        # everything is computed from a single copy of it. Copying runs
+        # entirely in C, so it can't collide with appends.
+        snapshot = list(self.py_log_buf)
+        if not snapshot:
+            return max(cursor, 0), 0, []
+        first_seq = snapshot[0][0]
+        last_seq = snapshot[-1][0]
+        if cursor < 0 or cursor > last_seq + 1:
+            cursor = last_seq + 1
+        num_lost = max(first_seq - cursor, 0)
+        # Records are sorted by seq, and (cursor,) sorts before any record
+        # with seq == cursor
+        new_records = snapshot[bisect_left(snapshot, (cursor,)):]
+        if not new_records:
+            return cursor, 0, []
         records = []
-        # Note: This loop does not guarantee that all log items will be
-        # returned. The while loop is set up to be bounded, and to return as
-        # soon as is sensible.
-        while len(records) < self.py_log_buf.maxlen:
-            try:
-                records.append(self.py_log_buf.pop())
-            except IndexError:
+        next_cursor = new_records[-1][0] + 1
+        for record in new_records:
+            if record[2] < min_level:
+                continue
+            if len(records) >= max_n:
+                next_cursor = record[0]
                 break
+            records.append(record)
+        return next_cursor, num_lost, records
+
+    def get_log_buf(self):
+        """
+        Return the records from the logging queue that weren't returned by
+        the previous call, formatted as a list of dictionaries.
+        """
+        self._log_buf_cursor, _, records = self.get_logs_since(
+            self._log_buf_cursor, self.py_log_buf.maxlen)
         return [{
-            'name': record.name,
-            'message': record.message,
-            'levelname': record.levelname,
-            'msecs': int(record.msecs),
-        } for record in records]
+            'name': name,
+            'message': message,
+            'levelname': logging.getLevelName(levelno),
+            'msecs': int((created - int(created)) * 1000),
+        } for _, created, levelno, name, message in records]
 
 
 LOGGER = None # Logger singleton
@@ -141,6 +204,8 @@ def get_main_logger(
     if use_logbuf:
         queue_handler = LossyQueueHandler(LOGGER.py_log_buf)
         LOGGER.addHandler(queue_handler)
+    for handler in LOGGER.handlers:
+        handler.lock = _RLock()
     # Set default level:
     from usrp_mpm import prefs
     mpm_prefs = prefs.get_prefs()
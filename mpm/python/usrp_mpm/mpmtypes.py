@@ -8,28 +8,118 @@ MPM types
 """
 
 import ctypes
-from multiprocessing import Value
-from multiprocessing import Array
+import time
+from multiprocessing import RawValue
 from multiprocessing import RLock
 from builtins import object
+from six import iteritems
 
 MPM_RPC_PORT = 49601
 MPM_DISCOVERY_PORT = 49600
 MPM_DISCOVERY_MESSAGE = "MPM-DISC"
+# UDP heartbeats are sent to MPM_RPC_PORT
+MPM_HEARTBEAT_MESSAGE = "MPM-HB"
+
+class _SharedStateStruct(ctypes.Structure):
+    " Memory layout of SharedState "
+    _fields_ = [
+        # Sequence number for the seqlock. Odd while a write is in progress.
+        ('seq', ctypes.c_uint32),
+        ('claim_status', ctypes.c_bool),
+        ('system_ready', ctypes.c_bool),
+        ('claim_token', ctypes.c_char * 256),
+        ('dev_type', ctypes.c_char * 16),
+        ('dev_serial', ctypes.c_char * 8),
+        ('dev_product', ctypes.c_char * 16),
+    ]
+
+
+class _SharedField(object):
+    """
+    Gives access to a single field of a SharedState, like a
+    multiprocessing.Value (i.e., through its .value attribute).
+    """
+    def __init__(self, state, name):
+        self._state = state
+        self._name = name
+
+    @property
+    def value(self):
+        " Read this field "
+        return getattr(self._state.get_snapshot(), self._name)
+
+    @value.setter
+    def value(self, value):
+        " Write this field "
+        self._state.update(**{self._name: value})
+
 
 class SharedState(object):
     """
     Holds information which should be shared between processes.
+
+    All values live in a single struct in shared memory, which is protected
+    by a seqlock: Writers serialize on a lock and increment a sequence number
+    before and after writing. Readers don't take any locks. They copy the
+    struct, and retry if the sequence number was odd or changed in the
+    meantime. This means readers always see a consistent snapshot, and never
+    wait for a writer that holds the lock, or for each other. The sequence
+    number also serves as a version of the values.
+
+    The individual values can be accessed like multiprocessing.Value objects,
+    e.g. state.claim_status.value. Use get_snapshot() to read several values
+    that need to be consistent with each other, and update() to write several
+    values at once.
     """
     def __init__(self):
+        # Serializes writers. Readers don't need it, but callers may also hold
+        # it to make a read-modify-write sequence atomic.
         self.lock = RLock()
-        self.claim_status = Value(ctypes.c_bool, False, lock=self.lock)
-        self.system_ready = Value(ctypes.c_bool, False, lock=self.lock)
+        self._raw = RawValue(_SharedStateStruct)
+        self.claim_status = _SharedField(self, 'claim_status')
+        self.system_ready = _SharedField(self, 'system_ready')
         # String with max length of 256:
-        self.claim_token = Array(ctypes.c_char, 256, lock=self.lock)
-        self.dev_type = Array(ctypes.c_char, 16, lock=self.lock)
-        self.dev_serial = Array(ctypes.c_char, 8, lock=self.lock)
-        self.dev_product = Array(ctypes.c_char, 16, lock=self.lock)
+        self.claim_token = _SharedField(self, 'claim_token')
+        self.dev_type = _SharedField(self, 'dev_type')
+        self.dev_serial = _SharedField(self, 'dev_serial')
+        self.dev_product = _SharedField(self, 'dev_product')
+
+    def get_version(self):
+        """
+        Return the current sequence number. It changes whenever any of the
+        values change, so it can be used to check if data derived from an
+        earlier snapshot is still valid.
+        """
+        return self._raw.seq
+
+    def get_snapshot(self):
+        """
+        Return a consistent copy of all values. The return value has one
+        attribute per value (e.g., snapshot.claim_status), and seq, which is
+        the version (see get_version()) of the snapshot.
+        """
+        while True:
+            seq = self._raw.seq
+            if seq & 1:
+                # A write is in progress
+                time.sleep(0)
+                continue
+            snapshot = _SharedStateStruct.from_buffer_copy(self._raw)
+            if self._raw.seq == seq:
+                return snapshot
+
+    def update(self, **kwargs):
+        """
+        Write one or more values, e.g. update(claim_status=True). Readers will
+        see either all or none of the new values.
+        """
+        with self.lock:
+            self._raw.seq += 1
+            try:
+                for name, value in iteritems(kwargs):
+                    setattr(self._raw, name, value)
+            finally:
+                self._raw.seq += 1
 
 class SID(object):
     """
@@ -8,6 +8,15 @@ Miscellaneous utilities for MPM
 """
 
 import time
+from concurrent import futures
+from usrp_mpm.gevent_compat import get_original
+
+# Serializes access to the hardware (SPI, I2C, UIO, and the C++ drivers)
+# between native threads. This is an original lock, not a gevent one, since
+# it's shared between threads (see the notes on threads in rpc_server). Never
+# wait for it on the gevent hub, that would stall the RPC server.
+HW_LOCK = get_original('_thread', 'RLock')()
+_allocate_lock = get_original('_thread', 'allocate_lock')
 
 def poll_with_timeout(state_check, timeout_ms, interval_ms):
     """
@@ -163,3 +172,201 @@ def async_exec(parent, method_name, *args):
     while not awaitable_method():
         time.sleep(0.1)
 
+
+def run_task_graph(tasks, serialize=False, timeline=None):
+    """
+    Run a set of tasks that may depend on each other, and return their
+    results as a dictionary task name -> return value.
+
+    tasks -- List of (name, func, dependencies) tuples. dependencies is a
+             list of task names, and func gets called with the results of
+             those tasks as positional arguments. A task must come after all
+             of its dependencies in the list.
+    serialize -- If True, run the tasks one at a time, in the order of the
+                 list. Otherwise, every task runs in its own thread, and
+                 starts as soon as its dependencies have finished.
+    timeline -- If given, every task is recorded as a span in this Timeline
+                object, using the task name.
+
+    If a task throws, the tasks depending on it throw the same exception.
+    The first exception (in list order) is re-raised once all tasks have
+    finished.
+
+    Because dependencies must come first, the graph can't have any cycles. A
+    RuntimeError is raised before running anything if a dependency is
+    missing, comes later in the list (which is the case for every cycle), or
+    if a name is used twice.
+    """
+    task_names = set()
+    for name, _, deps in tasks:
+        for dep in deps:
+            if dep not in task_names:
+                raise RuntimeError(
+                    "Task `{}' depends on `{}', which is not listed before "
+                    "it. Task graphs can't have any cycles.".format(name, dep))
+        if name in task_names:
+            raise RuntimeError("Duplicate task name: `{}'".format(name))
+        task_names.add(name)
+    if timeline is not None:
+        def timed(name, func):
+            " Wrap func so it records a span "
+            def timed_func(*args):
+                " Run func in a span "
+                with timeline.span(name):
+                    return func(*args)
+            return timed_func
+        tasks = [(name, timed(name, func), deps) for name, func, deps in tasks]
+    if serialize:
+        results = {}
+        for name, func, deps in tasks:
+            results[name] = func(*[results[dep] for dep in deps])
+        return results
+    def run_task(func, dep_futures):
+        " Wait for the dependencies, then run func "
+        return func(*[dep_future.result() for dep_future in dep_futures])
+    task_futures = []
+    # There's one worker per task, so a task can never block a worker that
+    # one of its dependencies needs
+    with futures.ThreadPoolExecutor(max_workers=max(len(tasks), 1)) \
+            as executor:
+        future_map = {}
+        for name, func, deps in tasks:
+            future_map[name] = executor.submit(
+                run_task, func, [future_map[dep] for dep in deps])
+            task_futures.append((name, future_map[name]))
+    return {name: task_future.result() for name, task_future in task_futures}
+
+
+class InitStages(object):
+    """
+    Remembers which init stages were run, and with which inputs, so they can
+    be skipped on the next init (e.g., in the next UHD session) if nothing
+    changed.
+
+    The stages are run in order, and every stage depends on all the stages
+    before it: If a stage needs to be re-run, all the following stages need
+    to be re-run, too.
+
+    Arguments:
+    stages -- List of stage names, in the order they're run
+    log -- Logger object
+    """
+    def __init__(self, stages, log):
+        self.stages = list(stages)
+        self.log = log
+        # Maps stage name -> inputs of the last successful run
+        self._inputs = {}
+
+    def get_first_stage(self, inputs, checks=None):
+        """
+        Return the name of the first stage that needs to be run, or None if
+        all stages can be skipped.
+
+        A stage can be skipped if it was run successfully before, its inputs
+        haven't changed since, and its status check (if any) passes.
+
+        Arguments:
+        inputs -- Dictionary stage name -> inputs of that stage. Inputs can be
+                  anything that can be compared, usually a dictionary.
+        checks -- Dictionary stage name -> callable. The callable returns True
+                  if the result of that stage is still valid (e.g., a PLL is
+                  still locked). It's only called when the stage's inputs did
+                  not change, so it should be cheap.
+        """
+        checks = checks or {}
+        for stage in self.stages:
+            if stage not in self._inputs:
+                self.log.debug("Init stage `%s' needs to run.", stage)
+                return stage
+            if self._inputs[stage] != inputs.get(stage):
+                self.log.debug(
+                    "Inputs of init stage `%s' changed from `%s' to `%s'.",
+                    stage, self._inputs[stage], inputs.get(stage))
+                return stage
+            if stage in checks and not checks[stage]():
+                self.log.debug(
+                    "Status check of init stage `%s' failed.", stage)
+                return stage
+            self.log.debug("Skipping init stage `%s', nothing changed.",
+                           stage)
+        return None
+
+    def set_done(self, stage, inputs):
+        """
+        Store that stage was run successfully with the given inputs.
+        """
+        self._inputs[stage] = inputs
+
+    def invalidate(self, stage=None):
+        """
+        Forget that stage and all the stages following it were run. If stage
+        is None, all stages are forgotten.
+        """
+        first_idx = 0 if stage is None else self.stages.index(stage)
+        for invalid_stage in self.stages[first_idx:]:
+            self._inputs.pop(invalid_stage, None)
+
+
+def get_sensor_callback(callback_entry):
+    """
+    Split an entry of a sensor callback map (see
+    PeriphManagerBase.mboard_sensor_callback_map) into a tuple
+    (method name, TTL). The entry is either a method name, or a tuple
+    (method name, TTL). The TTL is None if the entry doesn't have one.
+    """
+    if isinstance(callback_entry, tuple):
+        return callback_entry
+    return callback_entry, None
+
+
+class TTLCache(object):
+    """
+    Stores values for a limited time (their time to live, TTL), e.g. sensor
+    values that are expensive to read, but don't change quickly.
+
+    The cache can be shared between native threads. Its lock only protects
+    the stored values, and is never held while a value is produced: If two
+    threads ask for the same expired value at the same time, both of them
+    produce it, which is fine for the read-only functions this is meant for.
+    A value that was being produced while invalidate() was called is
+    returned, but not stored, so it can't undo the invalidation.
+    """
+    def __init__(self):
+        self._lock = _allocate_lock()
+        # Maps key -> (time stored, value)
+        self._values = {}
+        # Incremented by every invalidate()
+        self._generation = 0
+
+    def get(self, key, ttl, func, *args):
+        """
+        Return the value stored for key, if it's younger than ttl seconds.
+        Otherwise, call func(*args), store its return value for key, and
+        return it. If ttl is None or zero, func is always called, and nothing
+        is stored.
+        """
+        if not ttl:
+            return func(*args)
+        with self._lock:
+            entry = self._values.get(key)
+            generation = self._generation
+        now = time.monotonic()
+        if entry is not None and now - entry[0] < ttl:
+            return entry[1]
+        value = func(*args)
+        with self._lock:
+            if self._generation == generation:
+                self._values[key] = (now, value)
+        return value
+
+    def invalidate(self, key=None):
+        """
+        Drop the value stored for key, or all values if key is None. Values
+        that are currently being produced won't be stored.
+        """
+        with self._lock:
+            self._generation += 1
+            if key is None:
+                self._values.clear()
+            else:
+                self._values.pop(key, None)
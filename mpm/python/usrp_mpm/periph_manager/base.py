@@ -9,8 +9,10 @@ Mboard implementation base class
 
 from __future__ import print_function
 import os
-from hashlib import md5
+import json
+from hashlib import md5, sha256
 from time import sleep
+from functools import partial
 from concurrent import futures
 from builtins import str
 from builtins import object
@@ -21,8 +23,12 @@ from usrp_mpm.sys_utils.udev import get_spidev_nodes
 from usrp_mpm.sys_utils import dtoverlay
 from usrp_mpm.sys_utils import net
 from usrp_mpm import eeprom
-from usrp_mpm.rpc_server import no_claim, no_rpc
+from usrp_mpm.jobs import report_progress
+from usrp_mpm.rpc_server import no_claim, no_rpc, no_hw
 from usrp_mpm import prefs
+from usrp_mpm.timeline import STARTUP_TIMELINE, INIT_TIMELINE
+from usrp_mpm.mpmutils import run_task_graph, str2bool
+from usrp_mpm.mpmutils import get_sensor_callback, TTLCache
 
 def get_dboard_class_from_pid(pid):
     """
@@ -87,7 +93,10 @@ class PeriphManagerBase(object):
     # check.
     mboard_max_rev = None
     # A list of available sensors on the motherboard. This dictionary is a map
-    # of the form sensor_name -> method name
+    # of the form sensor_name -> method name. Instead of the method name, an
+    # entry can also be a tuple (method name, TTL): The value of the sensor
+    # is then cached for TTL seconds, and repeated reads within that time
+    # don't touch the hardware.
     mboard_sensor_callback_map = {}
     # This is a sanity check value to see if the correct number of
     # daughterboards are detected. If somewhere along the line more than
@@ -131,6 +140,11 @@ class PeriphManagerBase(object):
     # specific implementation. Each PeriphManagerBase-derived class should list
     # information required to update the component, like a callback function
     updateable_components = {}
+    # Path to a JSON file which stores the checksums of the components that
+    # were installed with update_component(). The product name is substituted
+    # for '{}'. Components that are already installed are not updated again.
+    # If this is None, components are always updated.
+    component_manifest_path = None
 
     @staticmethod
     def generate_device_info(eeprom_md, mboard_info, dboard_infos):
@@ -168,34 +182,24 @@ class PeriphManagerBase(object):
         # Set up logging
         self.log = get_logger('PeriphManager')
         self.claimed = False
+        # Clock domain fingerprint of the last successful init()
+        self._clock_fingerprint = None
+        # Cached sensor values, see mboard_sensor_callback_map
+        self._sensor_cache = TTLCache()
         try:
-            self._eeprom_head, self._eeprom_rawdata = \
-                self._read_mboard_eeprom()
-            self.mboard_info = self._get_mboard_info(self._eeprom_head)
-            self.log.info("Device serial number: {}"
-                          .format(self.mboard_info.get('serial', 'n/a')))
-            dboard_infos = self._get_dboard_eeprom_info()
-            self.device_info = \
-                    self.generate_device_info(
-                        self._eeprom_head,
-                        self.mboard_info,
-                        dboard_infos
-                    )
-            self._default_args = self._update_default_args(args)
-            self.log.debug("Using default args: {}".format(self._default_args))
-            self._init_mboard_overlays()
-            override_db_pids_str = self._default_args.get('override_db_pids')
-            if override_db_pids_str:
-                override_db_pids = [
-                    int(x, 0) for x in override_db_pids_str.split(",")
-                ]
-            else:
-                override_db_pids = []
-            self._init_dboards(
-                dboard_infos,
-                override_db_pids,
-                self._default_args
+            # The steps of the initialization run in parallel as far as they
+            # don't depend on each other, unless serialize_init is given
+            results = run_task_graph(
+                self._get_init_tasks(args),
+                serialize=str2bool(args.get('serialize_init', False)),
+                timeline=STARTUP_TIMELINE,
             )
+            self.dboards = [
+                results['dboard_{}'.format(dboard_idx)]
+                for dboard_idx in range(self.max_num_dboards)
+                if results['dboard_{}'.format(dboard_idx)] is not None
+            ]
+            self.log.info("Initialized %d daughterboard(s).", len(self.dboards))
             self._device_initialized = True
             self._initialization_status = "No errors."
         except Exception as ex:
@@ -278,9 +282,61 @@ class PeriphManagerBase(object):
             raise RuntimeError("No revision found in EEPROM.")
         return mboard_info
 
-    def _get_dboard_eeprom_info(self):
+    def _get_init_tasks(self, args):
+        """
+        Return the tasks that initialize the device, for run_task_graph().
+        Their dependencies look like this:
+
+        mboard_eeprom -------------------------+
+        dboard_eeprom_paths -> dboard_eeprom_N +-> device_info -> overlays
+        overlays -> eth_settle
+        overlays -> spi_nodes_N -> dboard_N (also needs device_info)
+
+        where N is the dboard slot index. dboard_N returns the dboard object,
+        or None if there's no dboard in that slot.
+        """
+        dboard_slots = range(self.max_num_dboards)
+        tasks = [
+            ('mboard_eeprom', self._read_mboard_eeprom, []),
+            ('dboard_eeprom_paths', self._get_dboard_eeprom_paths, []),
+        ]
+        tasks += [
+            ('dboard_eeprom_{}'.format(dboard_idx),
+             partial(self._read_dboard_eeprom, dboard_idx),
+             ['dboard_eeprom_paths'])
+            for dboard_idx in dboard_slots
+        ]
+        tasks += [
+            ('device_info',
+             lambda mboard_eeprom, *dboard_infos:
+             self._init_device_info(args, mboard_eeprom, dboard_infos),
+             ['mboard_eeprom'] + [
+                 'dboard_eeprom_{}'.format(dboard_idx)
+                 for dboard_idx in dboard_slots
+             ]),
+            ('overlays', lambda _: self._init_mboard_overlays(),
+             ['device_info']),
+            # Need to wait here a second to make sure the ethernet interfaces
+            # are up. Nothing else depends on this, so the dboards are
+            # initialized in the meantime.
+            # TODO: Fine-tune this number, or wait for some smarter signal.
+            ('eth_settle', lambda _: sleep(1), ['overlays']),
+        ]
+        for dboard_idx in dboard_slots:
+            tasks += [
+                ('spi_nodes_{}'.format(dboard_idx),
+                 lambda _, dboard_idx=dboard_idx:
+                 self._get_dboard_spi_nodes(dboard_idx),
+                 ['overlays']),
+                ('dboard_{}'.format(dboard_idx),
+                 partial(self._init_dboard, dboard_idx),
+                 ['device_info', 'spi_nodes_{}'.format(dboard_idx)]),
+            ]
+        return tasks
+
+    def _get_dboard_eeprom_paths(self):
         """
-        Read back EEPROM info from the daughterboards
+        Return the list of dboard EEPROM paths, one per dboard.
         """
         if self.dboard_eeprom_addr is None:
             self.log.debug("No dboard EEPROM addresses given.")
@@ -300,33 +356,76 @@ class PeriphManagerBase(object):
             self.log.warning("Found more EEPROM paths than daughterboards. "
                              "Ignoring some of them.")
             dboard_eeprom_paths = dboard_eeprom_paths[:self.max_num_dboards]
-        dboard_info = []
-        for dboard_idx, dboard_eeprom_path in enumerate(dboard_eeprom_paths):
-            self.log.debug("Reading EEPROM info for dboard %d...", dboard_idx)
-            dboard_eeprom_md, dboard_eeprom_rawdata = eeprom.read_eeprom(
-                dboard_eeprom_path,
-                self.dboard_eeprom_offset,
-                eeprom.DboardEEPROM.eeprom_header_format,
-                eeprom.DboardEEPROM.eeprom_header_keys,
-                self.dboard_eeprom_magic,
-                self.dboard_eeprom_max_len,
-            )
-            self.log.trace("Found dboard EEPROM metadata: `{}'"
-                           .format(str(dboard_eeprom_md)))
-            self.log.trace("Read %d bytes of dboard EEPROM data.",
-                           len(dboard_eeprom_rawdata))
-            db_pid = dboard_eeprom_md.get('pid')
-            if db_pid is None:
-                self.log.warning("No dboard PID found in dboard EEPROM!")
-            else:
-                self.log.debug("Found dboard PID in EEPROM: 0x{:04X}"
-                               .format(db_pid))
-            dboard_info.append({
-                'eeprom_md': dboard_eeprom_md,
-                'eeprom_rawdata': dboard_eeprom_rawdata,
-                'pid': db_pid,
-            })
-        return dboard_info
+        return dboard_eeprom_paths
+
+    def _read_dboard_eeprom(self, dboard_idx, dboard_eeprom_paths):
+        """
+        Read back EEPROM info from a daughterboard. Returns None if there's
+        no EEPROM path for this dboard.
+        """
+        if dboard_idx >= len(dboard_eeprom_paths):
+            return None
+        self.log.debug("Reading EEPROM info for dboard %d...", dboard_idx)
+        dboard_eeprom_md, dboard_eeprom_rawdata = eeprom.read_eeprom(
+            dboard_eeprom_paths[dboard_idx],
+            self.dboard_eeprom_offset,
+            eeprom.DboardEEPROM.eeprom_header_format,
+            eeprom.DboardEEPROM.eeprom_header_keys,
+            self.dboard_eeprom_magic,
+            self.dboard_eeprom_max_len,
+        )
+        self.log.trace("Found dboard EEPROM metadata: `{}'"
+                       .format(str(dboard_eeprom_md)))
+        self.log.trace("Read %d bytes of dboard EEPROM data.",
+                       len(dboard_eeprom_rawdata))
+        db_pid = dboard_eeprom_md.get('pid')
+        if db_pid is None:
+            self.log.warning("No dboard PID found in dboard EEPROM!")
+        else:
+            self.log.debug("Found dboard PID in EEPROM: 0x{:04X}"
+                           .format(db_pid))
+        return {
+            'eeprom_md': dboard_eeprom_md,
+            'eeprom_rawdata': dboard_eeprom_rawdata,
+            'pid': db_pid,
+        }
+
+    def _init_device_info(self, args, mboard_eeprom, dboard_infos):
+        """
+        Generate the device info and the default args from the EEPROM
+        contents.
+
+        mboard_eeprom -- Return value of _read_mboard_eeprom()
+        dboard_infos -- List with one return value of _read_dboard_eeprom()
+                        per dboard slot
+
+        Returns the list of dboard infos for the dboards that will be
+        initialized. The list index is the dboard slot.
+        """
+        self._eeprom_head, self._eeprom_rawdata = mboard_eeprom
+        self.mboard_info = self._get_mboard_info(self._eeprom_head)
+        self.log.info("Device serial number: {}"
+                      .format(self.mboard_info.get('serial', 'n/a')))
+        dboard_infos = [x for x in dboard_infos if x is not None]
+        self.device_info = \
+                self.generate_device_info(
+                    self._eeprom_head,
+                    self.mboard_info,
+                    dboard_infos
+                )
+        self._default_args = self._update_default_args(args)
+        self.log.debug("Using default args: {}".format(self._default_args))
+        override_db_pids_str = self._default_args.get('override_db_pids')
+        if override_db_pids_str:
+            override_db_pids = [
+                int(x, 0) for x in override_db_pids_str.split(",")
+            ]
+            self.log.warning("Overriding daughterboard PIDs with: {}"
+                             .format(override_db_pids_str))
+            if len(override_db_pids) < len(dboard_infos):
+                self.log.warning("--override-db-pids is going to skip dboards.")
+                dboard_infos = dboard_infos[:len(override_db_pids)]
+        return dboard_infos
 
     def _update_default_args(self, default_args):
         """
@@ -358,49 +457,47 @@ class PeriphManagerBase(object):
         ))
         for overlay in requested_overlays:
             dtoverlay.apply_overlay_safe(overlay)
-        # Need to wait here a second to make sure the ethernet interfaces are up
-        # TODO: Fine-tune this number, or wait for some smarter signal.
-        sleep(1)
 
-    def _init_dboards(self, dboard_infos, override_dboard_pids, default_args):
+    def _get_dboard_spi_nodes(self, dboard_idx):
+        """
+        Return the list of spidev nodes for a dboard slot
+        """
+        if len(self.dboard_spimaster_addrs) > dboard_idx:
+            spi_nodes = sorted(get_spidev_nodes(
+                self.dboard_spimaster_addrs[dboard_idx]))
+            self.log.trace("Found spidev nodes: {0}".format(spi_nodes))
+        else:
+            spi_nodes = []
+            self.log.warning("No SPI nodes for dboard %d.", dboard_idx)
+        return spi_nodes
+
+    def _init_dboard(self, dboard_idx, dboard_infos, spi_nodes):
         """
-        Initialize all the daughterboards
+        Initialize a daughterboard, and return the dboard object. Returns
+        None if there's no daughterboard in this slot, or if it can't be
+        identified.
 
         dboard_infos -- List of dictionaries as returned from
-                       _get_dboard_eeprom_info()
-        override_dboard_pids -- List of dboard PIDs to force
-        default_args -- Default args
+                        _init_device_info()
+        spi_nodes -- List of spidev nodes for this dboard
         """
-        if override_dboard_pids:
-            self.log.warning("Overriding daughterboard PIDs with: {}"
-                             .format(",".join(override_dboard_pids)))
         assert len(dboard_infos) <= self.max_num_dboards
-        if len(override_dboard_pids) and \
-                len(override_dboard_pids) < len(dboard_infos):
-            self.log.warning("--override-db-pids is going to skip dboards.")
-            dboard_infos = dboard_infos[:len(override_dboard_pids)]
-        for dboard_idx, dboard_info in enumerate(dboard_infos):
-            self.log.debug("Initializing dboard %d...", dboard_idx)
-            db_pid = dboard_info.get('pid')
-            db_class = get_dboard_class_from_pid(db_pid)
-            if db_class is None:
-                self.log.warning("Could not identify daughterboard class "
-                                 "for PID {:04X}! Skipping.".format(db_pid))
-                continue
-            if len(self.dboard_spimaster_addrs) > dboard_idx:
-                spi_nodes = sorted(get_spidev_nodes(
-                    self.dboard_spimaster_addrs[dboard_idx]))
-                self.log.trace("Found spidev nodes: {0}".format(spi_nodes))
-            else:
-                spi_nodes = []
-                self.log.warning("No SPI nodes for dboard %d.", dboard_idx)
-            dboard_info.update({
-                'spi_nodes': spi_nodes,
-                'default_args': default_args,
-            })
-            # This will actually instantiate the dboard class:
-            self.dboards.append(db_class(dboard_idx, **dboard_info))
-        self.log.info("Initialized %d daughterboard(s).", len(self.dboards))
+        if dboard_idx >= len(dboard_infos):
+            return None
+        self.log.debug("Initializing dboard %d...", dboard_idx)
+        dboard_info = dboard_infos[dboard_idx]
+        db_pid = dboard_info.get('pid')
+        db_class = get_dboard_class_from_pid(db_pid)
+        if db_class is None:
+            self.log.warning("Could not identify daughterboard class "
+                             "for PID {:04X}! Skipping.".format(db_pid))
+            return None
+        dboard_info.update({
+            'spi_nodes': spi_nodes,
+            'default_args': self._default_args,
+        })
+        # This will actually instantiate the dboard class:
+        return db_class(dboard_idx, **dboard_info)
 
     ###########################################################################
     # Session (de-)initialization (at UHD startup)
@@ -430,22 +527,61 @@ class PeriphManagerBase(object):
             self.log.error(
                 "Cannot run init(), device was never fully initialized!")
             return False
+        # Sensor values from before the init() are stale
+        self.invalidate_sensor_cache()
+        for dboard in self.dboards:
+            dboard.invalidate_sensor_cache()
         if len(self.dboards) == 0:
             return True
+        # Daughterboards use the fingerprint to decide if they can skip
+        # re-initializing their clocking
+        clock_fingerprint = self.get_clock_fingerprint()
+        if clock_fingerprint == self._clock_fingerprint:
+            self.log.debug("Clock domain unchanged since last init().")
+        else:
+            self.log.debug("Clock domain state: %s", clock_fingerprint)
+        self._clock_fingerprint = None
+        for dboard in self.dboards:
+            dboard.update_clock_fingerprint(clock_fingerprint)
         if args.get("serialize_init", False):
             self.log.debug("Initializing dboards serially...")
-            return all((dboard.init(args) for dboard in self.dboards))
-        self.log.debug("Initializing dboards in parallel...")
-        num_workers = len(self.dboards)
-        with futures.ThreadPoolExecutor(max_workers=num_workers) as executor:
-            init_futures = [
-                executor.submit(dboard.init, args)
-                for dboard in self.dboards
-            ]
-            return all([
-                x.result()
-                for x in futures.as_completed(init_futures)
-            ])
+            results = []
+            for dboard_idx, dboard in enumerate(self.dboards):
+                report_progress(
+                    "Initializing dboard {}".format(dboard_idx))
+                results.append(dboard.init(args))
+        else:
+            self.log.debug("Initializing dboards in parallel...")
+            report_progress("Initializing {} dboard(s) in parallel".format(
+                len(self.dboards)))
+            num_workers = len(self.dboards)
+            with futures.ThreadPoolExecutor(max_workers=num_workers) \
+                    as executor:
+                init_futures = [
+                    executor.submit(dboard.init, args)
+                    for dboard in self.dboards
+                ]
+                results = []
+                for init_future in futures.as_completed(init_futures):
+                    results.append(init_future.result())
+                    report_progress("Initialized {} of {} dboard(s)".format(
+                        len(results), len(self.dboards)))
+        if all(results):
+            self._clock_fingerprint = clock_fingerprint
+        return all(results)
+
+    def get_clock_fingerprint(self):
+        """
+        Return a dictionary that describes the state of the clock domain that
+        is shared by all daughterboards, e.g. the reference clock source and
+        frequency, the time source, and the FPGA image. It's handed to the
+        daughterboards before every init(), so they can skip re-initializing
+        their clocking when it didn't change since the previous session.
+
+        The values must be comparable. Should be overridden, the default is
+        an empty dictionary.
+        """
+        return {}
 
     def deinit(self):
         """
@@ -461,6 +597,17 @@ class PeriphManagerBase(object):
         for dboard in self.dboards:
             dboard.deinit()
 
+    @no_rpc
+    def start_background_tasks(self):
+        """
+        Start threads that run for the lifetime of the periph manager (e.g.,
+        status monitors). The RPC server calls this once the periph manager is
+        fully constructed, while holding HW_LOCK. tear_down() stops them.
+
+        The default implementation does nothing.
+        """
+        pass
+
     def tear_down(self):
         """
         Tear down all members that need to be specially handled before
@@ -488,6 +635,7 @@ class PeriphManagerBase(object):
         ]
 
     @no_claim
+    @no_hw
     def list_available_overlays(self):
         """
         Returns a list of available device tree overlays
@@ -495,6 +643,7 @@ class PeriphManagerBase(object):
         return dtoverlay.list_available_overlays()
 
     @no_claim
+    @no_hw
     def list_active_overlays(self):
         """
         Returns a list of currently loaded device tree overlays
@@ -545,16 +694,30 @@ class PeriphManagerBase(object):
             self.device_info['rpc_connection'] = conn_type
 
     @no_claim
+    @no_hw
     def get_dboard_info(self):
         """
         Returns a list of dicts. One dict per dboard.
         """
         return [dboard.device_info for dboard in self.dboards]
 
+    @no_claim
+    @no_hw
+    def get_init_timeline(self):
+        """
+        Returns the timeline of the most recent call to init(), as a
+        dictionary with the keys session, origin, and spans. Every span is a
+        dictionary with the keys name, start, end, thread, and slot (the
+        slot is None if the span isn't specific to a daughterboard). Times
+        are in seconds relative to origin.
+        """
+        return INIT_TIMELINE.get_last_session()
+
     ###########################################################################
     # Component updating
     ###########################################################################
     @no_claim
+    @no_hw
     def list_updateable_components(self):
         """
         return list of updateable components
@@ -567,13 +730,16 @@ class PeriphManagerBase(object):
         Updates the device component specified by comp_dict
         :param metadata_l: List of dictionary of strings containing metadata
         :param data_l: List of binary string with the file contents to be written
+        :return: List of the metadata of the components that were actually
+                 updated, i.e., without the ones that were already installed.
+                 Components that can't be updated raise an exception.
         """
         # We need a 'metadata' and a 'data' for each file we want to update
         assert (len(metadata_l) == len(data_l)),\
             "update_component arguments must be the same length"
-        # TODO: Update the manifest file
 
         # Iterate through the components, updating each in turn
+        updated_l = []
         for metadata, data in zip(metadata_l, data_l):
             id_str = metadata['id']
             filename = os.path.basename(metadata['filename'])
@@ -583,11 +749,18 @@ class PeriphManagerBase(object):
                 ))
                 raise KeyError("Update component not implemented for {}".format(id_str))
             self.log.trace("Updating component: {}".format(id_str))
-            if 'md5' in metadata:
-                given_hash = metadata['md5']
-                comp_hash = md5()
-                comp_hash.update(data)
-                comp_hash = comp_hash.hexdigest()
+            report_progress("Verifying component `{}'".format(id_str))
+            if 'md5' not in metadata and 'sha256' not in metadata:
+                self.log.trace("Loading unverified {} image.".format(
+                    id_str
+                ))
+            for hash_key, hash_func in (('md5', md5), ('sha256', sha256)):
+                comp_hash = hash_func(data).hexdigest()
+                if hash_key not in metadata:
+                    # Store the hash for the manifest
+                    metadata[hash_key] = comp_hash
+                    continue
+                given_hash = metadata[hash_key]
                 if comp_hash == given_hash:
                     self.log.trace("Component file hash matched: {}".format(
                         comp_hash
@@ -598,10 +771,8 @@ class PeriphManagerBase(object):
                                    "Given      {}\n".format(
                                        comp_hash, given_hash))
                     raise RuntimeError("Component file hash mismatch")
-            else:
-                self.log.trace("Loading unverified {} image.".format(
-                    id_str
-                ))
+            if self.is_component_installed(metadata):
+                continue
             basepath = os.path.join(os.sep, "tmp", "uploads")
             filepath = os.path.join(basepath, filename)
             if not os.path.isdir(basepath):
@@ -610,21 +781,148 @@ class PeriphManagerBase(object):
             self.log.trace("Writing data to {}".format(filepath))
             with open(filepath, 'wb') as f:
                 f.write(data)
-            update_func = \
-                getattr(self, self.updateable_components[id_str]['callback'])
-            self.log.info("Updating component `%s'", id_str)
-            update_func(filepath, metadata)
+            self.install_component(metadata, filepath)
+            updated_l.append(metadata)
+        return updated_l
+
+    @no_rpc
+    def install_component(self, metadata, filepath):
+        """
+        Install a component from a file that was already uploaded and
+        verified, by calling its update callback.
+        :param metadata: Dictionary of strings containing metadata. If it
+                         contains the verified 'sha256' checksum of the file,
+                         the component is recorded in the manifest.
+        :param filepath: Path to the uploaded file
+        Raises a RuntimeError if the update callback reports a failure.
+        """
+        id_str = metadata['id']
+        if id_str not in self.updateable_components:
+            self.log.error("{0} not an updateable component ({1})".format(
+                id_str, self.updateable_components.keys()
+            ))
+            raise KeyError("Update component not implemented for {}".format(id_str))
+        update_func = \
+            getattr(self, self.updateable_components[id_str]['callback'])
+        self.log.info("Updating component `%s'", id_str)
+        report_progress("Updating component `{}'".format(id_str))
+        if update_func(filepath, metadata) is False:
+            self.log.error("Update of component `%s' reported a failure.",
+                           id_str)
+            self._set_installed_component(id_str, None)
+            raise RuntimeError(
+                "Failed to update component `{}'".format(id_str))
+        if 'sha256' in metadata:
+            self._set_installed_component(id_str, {
+                'filename': os.path.basename(metadata['filename']),
+                'md5': metadata.get('md5', ''),
+                'sha256': metadata['sha256'],
+                'files': self._get_component_files(id_str),
+            })
+
+    def _get_component_files(self, id_str):
+        """
+        Returns the size and modification time of the files that component
+        id_str is installed to (its 'path' and, if given, 'output') as a
+        dictionary path -> [size, mtime in ns]. Files that don't exist are
+        left out.
+        """
+        files = {}
+        for path_key in ('path', 'output'):
+            path = self.updateable_components[id_str].get(path_key)
+            if path is None:
+                continue
+            path = path.format(self.device_info.get('product'))
+            try:
+                file_stat = os.stat(path)
+            except OSError:
+                continue
+            files[path] = [file_stat.st_size, file_stat.st_mtime_ns]
+        return files
+
+    def _get_component_manifest(self):
+        """
+        Returns the contents of the component manifest as a dictionary
+        component ID -> dictionary of installed file info. Returns an empty
+        dictionary if there's no manifest.
+        """
+        if self.component_manifest_path is None:
+            return {}
+        manifest_path = self.component_manifest_path.format(
+            self.device_info.get('product'))
+        try:
+            with open(manifest_path, 'r') as manifest_file:
+                return json.load(manifest_file)
+        except (IOError, OSError):
+            return {}
+        except ValueError as ex:
+            self.log.warning("Ignoring corrupt component manifest %s: %s",
+                             manifest_path, str(ex))
+            return {}
+
+    def _set_installed_component(self, id_str, info):
+        """
+        Record info as the installed version of component id_str in the
+        manifest. If info is None, the component is removed from the manifest.
+        """
+        if self.component_manifest_path is None:
+            return
+        manifest_path = self.component_manifest_path.format(
+            self.device_info.get('product'))
+        manifest = self._get_component_manifest()
+        if info is None:
+            manifest.pop(id_str, None)
+        else:
+            manifest[id_str] = info
+        self.log.trace("Updating component manifest %s", manifest_path)
+        # Write to a temporary file first, so a power loss can't leave us
+        # with a half-written manifest
+        with open(manifest_path + '.tmp', 'w') as manifest_file:
+            json.dump(manifest, manifest_file)
+        os.rename(manifest_path + '.tmp', manifest_path)
+
+    @no_rpc
+    def is_component_installed(self, metadata):
+        """
+        Returns True if the component described by metadata is already
+        installed, i.e., its 'sha256' (or, if not given, 'md5') checksum matches
+        the one in the component manifest, and the installed files still have
+        the size and modification time they had after the installation. If
+        they were replaced outside of MPM, the component is installed again.
+        """
+        id_str = metadata['id']
+        installed = self._get_component_manifest().get(id_str)
+        if installed is None:
+            return False
+        hash_key = 'sha256' if 'sha256' in metadata else 'md5'
+        if not metadata.get(hash_key) \
+                or metadata[hash_key] != installed.get(hash_key):
+            return False
+        if installed.get('files') != self._get_component_files(id_str):
+            self.log.debug("Installed files of component `%s' were changed "
+                           "since the last update.", id_str)
+            return False
+        self.log.info("Component `%s' is already installed (%s %s), "
+                      "skipping update.", id_str, hash_key, metadata[hash_key])
         return True
 
     @no_claim
+    @no_hw
     def get_component_info(self, component_name):
         """
-        Returns the metadata for the requested component
+        Returns the metadata for the requested component. If the component
+        was installed with update_component(), this also includes the
+        'filename', 'md5', and 'sha256' of the installed file.
         :param component_name: string name of the component
         :return: Dictionary of strings containg metadata
         """
         if component_name in self.updateable_components:
-            metadata = self.updateable_components.get(component_name)
+            metadata = dict(self.updateable_components.get(component_name))
+            metadata.update({
+                key: value for key, value in iteritems(
+                    self._get_component_manifest().get(component_name, {}))
+                if key != 'files'
+            })
             metadata['id'] = component_name
             self.log.trace("Component info: {}".format(metadata))
             # Convert all values to str
@@ -638,6 +936,7 @@ class PeriphManagerBase(object):
     # Crossbar control
     ###########################################################################
     @no_claim
+    @no_hw
     def get_num_xbars(self):
         """
         Returns the number of crossbars instantiated in the current design
@@ -660,6 +959,7 @@ class PeriphManagerBase(object):
                 self.get_base_port(xbar_index)
 
     @no_claim
+    @no_hw
     def get_base_port(self, xbar_index):
         """
         Returns the index of the first port which is connected to an RFNoC
@@ -722,9 +1022,55 @@ class PeriphManagerBase(object):
             )
             self.log.error(error_msg)
             raise RuntimeError(error_msg)
-        return getattr(
-            self, self.mboard_sensor_callback_map.get(sensor_name)
-        )()
+        method_name, ttl = get_sensor_callback(
+            self.mboard_sensor_callback_map.get(sensor_name))
+        return self._sensor_cache.get(
+            sensor_name, ttl, getattr(self, method_name))
+
+    def get_all_sensors(self):
+        """
+        Return the values of all motherboard and daughterboard sensors. This
+        is the same as calling get_mb_sensor() and the daughterboards'
+        get_sensor() for every sensor, but takes only a single call. The
+        daughterboards are read in parallel, while the motherboard sensors
+        are being read.
+
+        The return value is a dictionary with the keys 'mboard' (a dictionary
+        sensor name -> sensor value) and 'dboards' (a list with one entry per
+        daughterboard, see DboardManagerBase.get_all_sensors()). If a sensor
+        can't be read, its value is a dictionary with an 'error' key instead.
+        """
+        def read_mb_sensors():
+            " Read all motherboard sensors "
+            values = {}
+            for sensor_name in self.get_mb_sensors():
+                try:
+                    values[sensor_name] = self.get_mb_sensor(sensor_name)
+                except Exception as ex:
+                    values[sensor_name] = {'error': str(ex)}
+            return values
+        if not self.dboards:
+            return {'mboard': read_mb_sensors(), 'dboards': []}
+        with futures.ThreadPoolExecutor(max_workers=len(self.dboards)) \
+                as executor:
+            db_futures = [
+                executor.submit(dboard.get_all_sensors)
+                for dboard in self.dboards
+            ]
+            mb_values = read_mb_sensors()
+            return {
+                'mboard': mb_values,
+                'dboards': [db_future.result() for db_future in db_futures],
+            }
+
+    @no_rpc
+    def invalidate_sensor_cache(self, sensor_name=None):
+        """
+        Drop the cached value of a motherboard sensor (or of all of them, if
+        sensor_name is None), so the next read goes to the hardware. Call
+        this when a sensor is known to have changed.
+        """
+        self._sensor_cache.invalidate(sensor_name)
 
     ##########################################################################
     # EEPROMS
@@ -787,6 +1133,7 @@ class PeriphManagerBase(object):
             dst_address,
             suggested_src_address,
             xport_type,
+            xport_args=None,
         ):
         """
         When setting up a CHDR connection, this is the first call to be
@@ -815,6 +1162,13 @@ class PeriphManagerBase(object):
                              0x0001.
         xport_type -- One of the following strings: CTRL, ASYNC_MSG,
                       TX_DATA, RX_DATA. See also xports_type_t in UHD.
+        xport_args -- Optional dictionary describing the stream, so the
+                      bandwidth it needs can be taken into account when
+                      choosing a transport. Recognized keys are 'rate'
+                      (samples/s), 'otw_format', 'nchans', and 'mtu'. UHD
+                      sends the rate and OTW format of the stream, if it
+                      knows them. See the transport managers for how streams
+                      without a rate are counted.
 
         The return value is a list of dictionaries. Every dictionary has
         the following key/value pairs:
@@ -824,18 +1178,16 @@ class PeriphManagerBase(object):
         - send_sid: String version of the SID used for this transport. This is
                     the definitive version of the SID, the suggested_src_address
                     can be ignored at this point.
-        - allocation: This is an integer value which represents a score of
-                      how much bandwidth is used. Note: Currently does not
-                      have any unit, is just a counter. Higher numbers mean
-                      higher utilization. RX means device to UHD, for
-                      example, committing an RX streamer would increase this
-                      value.
+        - allocation: The bandwidth (in bytes/s) that is already committed on
+                      this transport's link in the direction of xport_type.
+                      RX means device to UHD, for example, committing an RX
+                      streamer would increase this value.
                       This key is optional, MPM does not have to provide it.
-                      If the allocation affects the preference, it will be
-                      factored into the order of the results, meaning the
-                      caller does not strictly have to check its value even if
-                      the transport option with the smallest allocation is
-                      preferred.
+                      The allocation is already factored into the order of
+                      the results, so the caller does not have to check its
+                      value.
+        - bandwidth: The estimated bandwidth (in bytes/s) of the requested
+                     stream. Optional.
 
         Note: The dictionary may include other keys which should be ignored,
         or at the very least, kept intact. commit_xport() might be requiring
@@ -863,6 +1215,19 @@ class PeriphManagerBase(object):
         """
         raise NotImplementedError("commit_xport() not implemented.")
 
+    def release_xport(self, xport_info):
+        """
+        Call this when a CHDR connection is closed before the session ends.
+        Resources that were allocated in commit_xport() (e.g., DMA channels)
+        are returned, so they can be used by other connections. All
+        connections are released when the session ends, so calling this is
+        optional.
+
+        Arguments:
+        xport_info -- The dictionary that was passed to commit_xport().
+        """
+        raise NotImplementedError("release_xport() not implemented.")
+
     #######################################################################
     # Claimer API
     #######################################################################
@@ -9,18 +9,24 @@ N3xx implementation module
 
 from __future__ import print_function
 import copy
+import os
 import re
-import threading
+import select
+import time
 from six import iteritems, itervalues
 from usrp_mpm.cores import WhiteRabbitRegsControl
 from usrp_mpm.components import ZynqComponents
+from usrp_mpm.gevent_compat import get_original
 from usrp_mpm.gpsd_iface import GPSDIfaceExtension
+from usrp_mpm.jobs import report_progress
 from usrp_mpm.periph_manager import PeriphManagerBase
 from usrp_mpm.mpmtypes import SID
 from usrp_mpm.mpmutils import assert_compat_number, str2bool, poll_with_timeout
-from usrp_mpm.rpc_server import no_rpc
+from usrp_mpm.mpmutils import HW_LOCK
+from usrp_mpm.rpc_server import no_claim, no_rpc
 from usrp_mpm.sys_utils import dtoverlay
 from usrp_mpm.sys_utils.sysfs_thermal import read_thermal_sensor_value
+from usrp_mpm.timeline import INIT_TIMELINE
 from usrp_mpm.xports import XportMgrUDP, XportMgrLiberio
 from usrp_mpm.periph_manager.n3xx_periphs import TCA6424
 from usrp_mpm.periph_manager.n3xx_periphs import BackpanelGPIO
@@ -36,6 +42,31 @@ N3XX_DEFAULT_ENABLE_FPGPIO = True
 N3XX_DEFAULT_ENABLE_PPS_EXPORT = True
 N3XX_FPGA_COMPAT = (5, 2)
 N3XX_MONITOR_THREAD_INTERVAL = 1.0 # seconds
+# The ref lock is polled every N3XX_MONITOR_THREAD_INTERVAL seconds after it
+# changed, or after the clocking was reconfigured. Every time it's unchanged,
+# the interval doubles, up to this value.
+N3XX_MONITOR_MAX_REF_LOCK_INTERVAL = 8.0 # seconds
+# When GPS lock changes are picked up from GPIO edge events, the GPS lock is
+# still polled this often, in case an edge was missed.
+N3XX_MONITOR_GPS_FALLBACK_INTERVAL = 10 * N3XX_MONITOR_THREAD_INTERVAL
+# Sensor values are cached for this long. The lock sensors are also dropped
+# from the cache when the status monitor sees them change.
+N3XX_LOCK_SENSOR_TTL = 1.0 # seconds
+N3XX_THERMAL_SENSOR_TTL = 2.0 # seconds
+# Names of the monitored status values and their back-panel LEDs
+N3XX_MONITOR_LEDS = {
+    'gps_locked': BackpanelGPIO.LED_GPS,
+    'ref_locked': BackpanelGPIO.LED_REF,
+}
+
+# The status monitor runs in a native thread (see start_background_tasks()), so
+# it can block in poll() without stalling the RPC server. It's joined from an
+# RPC worker thread in tear_down(), so it's a plain thread and not part of a
+# gevent ThreadPool, whose results can only be waited for on the spawning
+# thread.
+_poll = get_original('select', 'poll')
+_start_new_thread = get_original('_thread', 'start_new_thread')
+_allocate_lock = get_original('_thread', 'allocate_lock')
 
 # Import daughterboard PIDs from their respective classes
 MG_PID = Magnesium.pids[0]
@@ -114,10 +145,10 @@ class n3xx(ZynqComponents, PeriphManagerBase):
     mboard_info = {"type": "n3xx"}
     mboard_max_rev = 5 # 5 == RevF
     mboard_sensor_callback_map = {
-        'ref_locked': 'get_ref_lock_sensor',
-        'gps_locked': 'get_gps_lock_sensor',
-        'temp': 'get_temp_sensor',
-        'fan': 'get_fan_sensor',
+        'ref_locked': ('get_ref_lock_sensor', N3XX_LOCK_SENSOR_TTL),
+        'gps_locked': ('get_gps_lock_sensor', N3XX_LOCK_SENSOR_TTL),
+        'temp': ('get_temp_sensor', N3XX_THERMAL_SENSOR_TTL),
+        'fan': ('get_fan_sensor', N3XX_THERMAL_SENSOR_TTL),
     }
     crossbar_base_port = 3  # It's 3 because 0,1,2 are SFP,SFP,DMA
     dboard_eeprom_addr = "e0004000.i2c"
@@ -146,6 +177,7 @@ class n3xx(ZynqComponents, PeriphManagerBase):
             'reset': False,
         },
     }
+    component_manifest_path = '/lib/firmware/{}_components.json'
 
     @classmethod
     def generate_device_info(cls, eeprom_md, mboard_info, dboard_infos):
@@ -180,7 +212,11 @@ class n3xx(ZynqComponents, PeriphManagerBase):
     ###########################################################################
     def __init__(self, args):
         self._tear_down = False
-        self._status_monitor_thread = None
+        # Held while the status monitor thread is running
+        self._status_monitor_done = None
+        # Pipe to wake up the status monitor thread
+        self._status_monitor_wakeup = None
+        self._status_subscribers = []
         self._ext_clock_freq = None
         self._clock_source = None
         self._time_source = None
@@ -255,23 +291,124 @@ class n3xx(ZynqComponents, PeriphManagerBase):
 
         - GPS lock (update back-panel GPS LED)
         - REF lock (update back-panel REF LED)
+
+        GPS lock changes are picked up from GPIO edge events, if the GPIO
+        expander supports them, and polled otherwise. With edge events, it's
+        still polled at a slow rate, so a missed edge doesn't leave the GPS
+        status stale for good. The REF lock requires
+        SPI accesses to all dboards, so it is polled at an interval that
+        grows while it doesn't change (see wake_status_monitor()). LEDs are
+        only written, and subscribers only notified, on changes.
+
+        All hardware accesses hold HW_LOCK, so they never run concurrently
+        with RPC calls (e.g., while init() is configuring the clocking). If
+        the lock is busy, the checks are postponed.
         """
+        try:
+            self._monitor_status_loop()
+        except Exception as ex:
+            self.log.error("Status monitor failed: %s", str(ex))
+        finally:
+            self._status_monitor_done.release()
+
+    def _monitor_status_loop(self):
+        " Main loop of the status monitor, see _monitor_status() "
         self.log.trace("Launching monitor loop...")
-        cond = threading.Condition()
-        cond.acquire()
+        wakeup_fd = self._status_monitor_wakeup[0]
+        poller = _poll()
+        poller.register(wakeup_fd, select.POLLIN)
+        try:
+            gps_file = self._gpios.get_edge_file('GPS-LOCKOK')
+            poller.register(gps_file, select.POLLPRI | select.POLLERR)
+        except (IOError, OSError) as ex:
+            self.log.debug("No edge events for GPS lock, polling instead: %s",
+                           str(ex))
+            gps_file = None
+        status = {}
+        ref_lock_interval = N3XX_MONITOR_THREAD_INTERVAL
+        next_gps_check = 0
+        next_ref_check = 0
         while not self._tear_down:
-            gps_locked = bool(self._gpios.get("GPS-LOCKOK"))
-            self._bp_leds.set(self._bp_leds.LED_GPS, int(gps_locked))
-            ref_locked = self.get_ref_lock_sensor()['value'] == 'true'
-            self._bp_leds.set(self._bp_leds.LED_REF, int(ref_locked))
+            # Don't block forever, so we notice when we're being torn down
+            if not HW_LOCK.acquire(timeout=N3XX_MONITOR_THREAD_INTERVAL):
+                continue
+            try:
+                now = time.monotonic()
+                if now >= next_gps_check:
+                    if gps_file is None:
+                        gps_locked = bool(self._gpios.get("GPS-LOCKOK"))
+                        next_gps_check = now + N3XX_MONITOR_THREAD_INTERVAL
+                    else:
+                        gps_file.seek(0)
+                        gps_locked = bool(int(gps_file.read().strip()))
+                        next_gps_check = \
+                                now + N3XX_MONITOR_GPS_FALLBACK_INTERVAL
+                    self._update_status(status, 'gps_locked', gps_locked)
+                if now >= next_ref_check:
+                    ref_locked = self.get_ref_lock_sensor()['value'] == 'true'
+                    if self._update_status(status, 'ref_locked', ref_locked):
+                        ref_lock_interval = N3XX_MONITOR_THREAD_INTERVAL
+                    else:
+                        ref_lock_interval = min(
+                            2 * ref_lock_interval,
+                            N3XX_MONITOR_MAX_REF_LOCK_INTERVAL)
+                    next_ref_check = now + ref_lock_interval
+            finally:
+                HW_LOCK.release()
             # Now wait
-            if cond.wait_for(
-                    lambda: self._tear_down,
-                    N3XX_MONITOR_THREAD_INTERVAL):
-                break
-        cond.release()
+            timeout = min(next_gps_check, next_ref_check) - time.monotonic()
+            for fileno, _ in poller.poll(max(timeout, 0) * 1000):
+                if fileno == wakeup_fd:
+                    os.read(wakeup_fd, 64)
+                    ref_lock_interval = N3XX_MONITOR_THREAD_INTERVAL
+                    next_ref_check = 0
+                else:
+                    next_gps_check = 0
+        if gps_file is not None:
+            gps_file.close()
         self.log.trace("Terminating monitor loop.")
 
+    def _update_status(self, status, name, value):
+        """
+        Store a new value for a monitored status. If it changed, update the
+        according LED and notify the subscribers. Returns True if the value
+        changed.
+        """
+        if status.get(name) == value:
+            return False
+        self.log.debug("Status change: %s=%s", name, value)
+        status[name] = value
+        self._bp_leds.set(N3XX_MONITOR_LEDS[name], int(value))
+        for callback in self._status_subscribers:
+            try:
+                callback(name, value)
+            except Exception as ex:
+                self.log.error("Status subscriber failed: %s", str(ex))
+        return True
+
+    @no_rpc
+    def subscribe_status(self, callback):
+        """
+        Register a callback that gets called as callback(name, value)
+        whenever a monitored status changes. name is 'gps_locked' or
+        'ref_locked', value is a bool. The current values are reported right
+        after the monitor starts.
+
+        Callbacks are called from the status monitor thread, which is a
+        native thread, while it holds HW_LOCK. They need to be thread-safe,
+        and return quickly.
+        """
+        self._status_subscribers.append(callback)
+
+    @no_rpc
+    def wake_status_monitor(self):
+        """
+        Make the status monitor check the REF lock right away, and poll it
+        at the fastest rate again. Call this when the clocking changes.
+        """
+        if self._status_monitor_wakeup is not None:
+            os.write(self._status_monitor_wakeup[1], b'\0')
+
     def _init_peripherals(self, args):
         """
         Turn on all peripherals. This may throw an error on failure, so make
@@ -324,17 +461,26 @@ class n3xx(ZynqComponents, PeriphManagerBase):
             'udp': N3xxXportMgrUDP(self.log.getChild('UDP')),
             'liberio': N3xxXportMgrLiberio(self.log.getChild('liberio')),
         }
-        # Spawn status monitoring thread
-        self.log.trace("Spawning status monitor thread...")
-        self._status_monitor_thread = threading.Thread(
-            target=self._monitor_status,
-            name="N3xxStatusMonitorThread",
-            daemon=True,
-        )
-        self._status_monitor_thread.start()
+        # The status monitor is spawned in start_background_tasks()
+        self.subscribe_status(
+            lambda name, _: self.invalidate_sensor_cache(name))
         # Init complete.
         self.log.debug("Device info: {}".format(self.device_info))
 
+    @no_rpc
+    def start_background_tasks(self):
+        """
+        Spawn the status monitor thread (see _monitor_status()). We're called
+        with HW_LOCK held, so it can't access the hardware before we return.
+        """
+        if not self._device_initialized:
+            return
+        self.log.trace("Spawning status monitor thread...")
+        self._status_monitor_wakeup = os.pipe()
+        self._status_monitor_done = _allocate_lock()
+        self._status_monitor_done.acquire()
+        _start_new_thread(self._monitor_status, ())
+
     def _init_gps_sensors(self):
         "Init and register the GPSd Iface and related sensor functions"
         self.log.trace("Initializing GPSd interface")
@@ -354,6 +500,7 @@ class n3xx(ZynqComponents, PeriphManagerBase):
     ###########################################################################
     # Session init and deinit
     ###########################################################################
+    @INIT_TIMELINE.timed('n3xx.init', new_session=True)
     def init(self, args):
         """
         Calls init() on the parent class, and then programs the Ethernet
@@ -370,6 +517,7 @@ class n3xx(ZynqComponents, PeriphManagerBase):
             N3XX_DEFAULT_ENABLE_PPS_EXPORT
         )
         self.enable_pps_out(False)
+        report_progress("Configuring clock and time sources")
         if "clock_source" in args:
             self.set_clock_source(args.get("clock_source"))
         if "clock_source" in args or "time_source" in args:
@@ -390,6 +538,9 @@ class n3xx(ZynqComponents, PeriphManagerBase):
         # Now the clocks are all enabled, we can also re-enable PPS export if
         # it was turned off:
         self.enable_pps_out(enable_pps_out_state)
+        # The dboards may have re-locked to the reference
+        self.wake_status_monitor()
+        report_progress("Initializing transports")
         for xport_mgr in itervalues(self._xport_mgrs):
             xport_mgr.init(args)
         return result
@@ -416,11 +567,21 @@ class n3xx(ZynqComponents, PeriphManagerBase):
         """
         self.log.trace("Tearing down N3xx device...")
         self._tear_down = True
-        if self._device_initialized:
-            self._status_monitor_thread.join(3 * N3XX_MONITOR_THREAD_INTERVAL)
-            if self._status_monitor_thread.is_alive():
+        if self._status_monitor_done is not None:
+            self.wake_status_monitor()
+            # We're usually called with HW_LOCK held, so the monitor might
+            # need a full interval to notice
+            if not self._status_monitor_done.acquire(
+                    timeout=3 * N3XX_MONITOR_THREAD_INTERVAL):
                 self.log.error("Could not terminate monitor thread! "
                                "This could result in resource leaks.")
+            else:
+                for pipe_fd in self._status_monitor_wakeup:
+                    os.close(pipe_fd)
+                self._status_monitor_wakeup = None
+        if self._gpsd is not None:
+            self._gpsd.close()
+            self._gpsd = None
         active_overlays = self.list_active_overlays()
         self.log.trace("N3xx has active device tree overlays: {}".format(
             active_overlays
@@ -435,7 +596,8 @@ class n3xx(ZynqComponents, PeriphManagerBase):
             self,
             dst_address,
             suggested_src_address,
-            xport_type
+            xport_type,
+            xport_args=None,
         ):
         """
         See PeriphManagerBase.request_xport() for docs.
@@ -460,11 +622,13 @@ class n3xx(ZynqComponents, PeriphManagerBase):
             return self._xport_mgrs['udp'].request_xport(
                 sid,
                 xport_type,
+                xport_args,
             )
         elif self.device_info['rpc_connection'] == 'local':
             return self._xport_mgrs['liberio'].request_xport(
                 sid,
                 xport_type,
+                xport_args,
             )
 
     def commit_xport(self, xport_info):
@@ -487,6 +651,39 @@ class n3xx(ZynqComponents, PeriphManagerBase):
         elif self.device_info['rpc_connection'] == 'local':
             return self._xport_mgrs['liberio'].commit_xport(sid, xport_info)
 
+    def release_xport(self, xport_info):
+        """
+        See PeriphManagerBase.release_xport() for docs.
+        """
+        assert self.device_info['rpc_connection'] in ('remote', 'local')
+        sid = SID(xport_info['send_sid'])
+        self.log.debug("Releasing transport for SID %s", str(sid))
+        if self.device_info['rpc_connection'] == 'remote':
+            self._xport_mgrs['udp'].release_xport(sid)
+        elif self.device_info['rpc_connection'] == 'local':
+            self._xport_mgrs['liberio'].release_xport(sid)
+        return True
+
+    @no_claim
+    def get_xport_utilization(self):
+        """
+        Return the bandwidth that is currently committed on every Ethernet
+        interface. See XportMgrUDP.get_utilization() for the format.
+        """
+        if not self._device_initialized:
+            return {}
+        return self._xport_mgrs['udp'].get_utilization()
+
+    @no_claim
+    def get_dma_utilization(self):
+        """
+        Return the occupancy of every Liberio DMA channel. See
+        XportMgrLiberio.get_utilization() for the format.
+        """
+        if not self._device_initialized:
+            return {}
+        return self._xport_mgrs['liberio'].get_utilization()
+
     ###########################################################################
     # Device info
     ###########################################################################
@@ -553,6 +750,8 @@ class n3xx(ZynqComponents, PeriphManagerBase):
                     slot, ref_clk_freq/1e6
                 )
                 dboard.update_ref_clock_freq(ref_clk_freq)
+        self.invalidate_sensor_cache('ref_locked')
+        self.wake_status_monitor()
 
     def set_ref_clock_freq(self, freq):
         """
@@ -628,6 +827,19 @@ class n3xx(ZynqComponents, PeriphManagerBase):
                                .format(time_source, wr_regs_control.get_time_lock_status()))
                 raise RuntimeError("Failed to lock SFP timebase.")
 
+    def get_clock_fingerprint(self):
+        """
+        Returns the state of the clock domain shared by the daughterboards:
+        Reference clock source and frequency, time source, and the FPGA build
+        (in case the FPGA was reloaded).
+        """
+        git_hash, dirtiness = self.mboard_regs_control.get_git_hash()
+        return {
+            'clock_source': self.get_clock_source(),
+            'ref_clock_freq': self.get_ref_clock_freq(),
+            'time_source': self.get_time_source(),
+            'fpga_hash': "{:07x}-{}".format(git_hash, dirtiness),
+        }
 
     def set_fp_gpio_master(self, value):
         """set driver for front panel GPIO
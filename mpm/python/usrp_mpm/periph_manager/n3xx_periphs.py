@@ -121,6 +121,14 @@ class TCA6424(object):
         assert name in self.pins
         return self._gpios.get(self.pins.index(name))
 
+    def get_edge_file(self, name, edge='both'):
+        """
+        Return a file object that reports edges on a pin by name. See
+        SysFSGPIO.get_edge_file().
+        """
+        assert name in self.pins
+        return self._gpios.get_edge_file(self.pins.index(name), edge)
+
 
 class FrontpanelGPIO(GPIOBank):
     """
@@ -5,34 +5,75 @@
 #
 """
 Implemented RPC Servers
+
+Notes on threads: The RPC server runs on the gevent hub, and all modules are
+monkey patched. All calls into the periph manager and the daughterboards run
+in a pool of native worker threads, while holding mpmutils.HW_LOCK (see
+MPMServer._run_in_worker()). The only exception are calls that don't touch
+the hardware (see no_hw()), which run right on the hub, so they don't have to
+wait for long-running calls like init(). Some components also run native threads of their
+own (e.g., the N3xx status monitor); those have to take HW_LOCK as well before
+touching the hardware.
+
+Every native thread gets its own gevent hub, so the patched primitives
+(threading.Lock and Event, queue.Queue, sockets, time.sleep(), and
+concurrent.futures, which builds on them) work as usual, as long as every
+object is only used from the native thread that created it. Objects that are
+shared between native threads need the original primitives (see
+gevent.monkey.get_original()), and must not be waited on from the hub. The
+MPM log handlers use original locks for that reason.
 """
 
 from __future__ import print_function
+import logging
+import time
 import traceback
-import copy
+from bisect import bisect_left
 from random import choice
 from string import ascii_letters, digits
 from multiprocessing import Process
 from gevent.server import StreamServer
+from gevent.server import DatagramServer
 from gevent.pool import Pool
 from gevent import signal
-from gevent import spawn_later
-from gevent import Greenlet
+from gevent import spawn
+from gevent import sleep
 from gevent import monkey
+from gevent.threadpool import ThreadPool
 monkey.patch_all()
 from builtins import str, bytes
 from builtins import range
 from six import iteritems
 from mprpc import RPCServer
 from usrp_mpm.mpmlog import get_main_logger
-from usrp_mpm.mpmutils import to_binary_str
+from usrp_mpm.jobs import JobManager, report_progress, propagate_job
+from usrp_mpm.sensor_subscriptions import SensorSubscriptionManager
+from usrp_mpm.mpmutils import to_binary_str, to_native_str, HW_LOCK
+from usrp_mpm.mpmtypes import MPM_HEARTBEAT_MESSAGE
 from usrp_mpm.sys_utils import watchdog
+from usrp_mpm.timeline import STARTUP_TIMELINE
 from usrp_mpm.sys_utils import net
 
 TIMEOUT_INTERVAL = 5.0 # Seconds before claim expires (default value)
 TOKEN_LEN = 16 # Length of the token string
+# Number of native threads that execute calls into the periph manager
+# (default value). They're executed in these threads to keep the RPC server
+# responsive. Calls hold HW_LOCK, so they're always executed one at a time,
+# which is what the periph managers expect, no matter how many threads there
+# are.
+RPC_NUM_WORKER_THREADS = 1
 # Compatibility number for MPM
-MPM_COMPAT_NUM = (1, 2)
+MPM_COMPAT_NUM = (1, 3)
+# Maximum number of chunked component uploads that can be in progress
+MAX_COMPONENT_UPLOADS = 4
+# Seconds after which an unfinished component upload without any activity is
+# dropped
+COMPONENT_UPLOAD_TIMEOUT = 600
+
+# Upper limits (in seconds) of the latency histogram bins for RPC call
+# statistics. They increase in powers of two, from 10 us to about 21 s. Calls
+# that take longer than that go into an additional overflow bin.
+RPC_STATS_BINS = tuple(10e-6 * 2**x for x in range(22))
 
 def no_claim(func):
     " Decorator for functions that require no token check "
@@ -44,13 +85,124 @@ def no_rpc(func):
     func._norpc = True
     return func
 
+def no_hw(func):
+    """
+    Decorator for functions that don't access the hardware. They're executed
+    without taking HW_LOCK, so they don't wait for other calls to finish.
+    They must not block, either.
+    """
+    func._nohw = True
+    return func
+
+class RPCStats(object):
+    """
+    Per-method call statistics for the RPC server.
+
+    For every method, we count calls and errors, and store call durations in
+    a fixed-size histogram (see RPC_STATS_BINS). This is cheap enough to be
+    always on, at the expense of percentiles being only accurate to within a
+    factor of two.
+    """
+    def __init__(self):
+        self._stats = {}
+        self._start_time = time.time()
+
+    def record(self, method_name, duration, error=False):
+        """
+        Record a single call to method_name that took duration seconds.
+        """
+        stats = self._stats.get(method_name)
+        if stats is None:
+            # Format: [num_calls, num_errors, total time, max time, histogram]
+            stats = [0, 0, 0.0, 0.0, [0] * (len(RPC_STATS_BINS) + 1)]
+            self._stats[method_name] = stats
+        stats[0] += 1
+        stats[1] += int(bool(error))
+        stats[2] += duration
+        stats[3] = max(stats[3], duration)
+        stats[4][bisect_left(RPC_STATS_BINS, duration)] += 1
+
+    def reset(self):
+        """
+        Clear all statistics.
+        """
+        self._stats = {}
+        self._start_time = time.time()
+
+    @staticmethod
+    def _get_percentile(histogram, num_calls, max_time, percentile):
+        """
+        Return the upper limit of the histogram bin that contains the given
+        percentile (0.0 through 1.0). For the overflow bin, returns max_time.
+        """
+        threshold = percentile * num_calls
+        count = 0
+        for bin_idx, bin_count in enumerate(histogram):
+            count += bin_count
+            if count >= threshold and count > 0:
+                if bin_idx < len(RPC_STATS_BINS):
+                    return min(RPC_STATS_BINS[bin_idx], max_time)
+                break
+        return max_time
+
+    def get(self):
+        """
+        Return the statistics as a dictionary method_name -> stats, where
+        stats is a dictionary with the following keys:
+        - calls: Number of calls
+        - errors: Number of calls that raised an exception
+        - mean: Mean call duration in seconds
+        - p50, p99: Median and 99th percentile of the call duration in
+                    seconds (upper limit of the corresponding histogram bin)
+        - max: Longest call duration in seconds
+        - histogram: List of call counts per bin (see RPC_STATS_BINS)
+        """
+        return {
+            method_name: {
+                'calls': num_calls,
+                'errors': num_errors,
+                'mean': total_time / num_calls,
+                'p50': self._get_percentile(
+                    histogram, num_calls, max_time, 0.5),
+                'p99': self._get_percentile(
+                    histogram, num_calls, max_time, 0.99),
+                'max': max_time,
+                'histogram': list(histogram),
+            }
+            for method_name, (
+                num_calls, num_errors, total_time, max_time, histogram
+            ) in iteritems(self._stats)
+        }
+
+    def get_age(self):
+        """
+        Return the number of seconds since statistics were last reset.
+        """
+        return time.time() - self._start_time
+
+
 class MPMServer(RPCServer):
     """
     Main MPM RPC class which holds the periph_manager object and translates
     RPC calls to appropiate calls in the periph_manager and dboard_managers.
     """
     # This is a list of methods in this class which require a claim
-    default_claimed_methods = ['init', 'update_component', 'reclaim', 'unclaim']
+    default_claimed_methods = [
+        'init', 'update_component', 'reclaim', 'unclaim',
+        'start_job', 'get_job_status', 'wait_job',
+        'begin_component_upload', 'append_component_chunk',
+        'commit_component_upload', 'abort_component_upload',
+        'subscribe_sensors', 'unsubscribe_sensors', 'get_sensor_updates',
+    ]
+    # These methods of this class can be run with start_job(). Methods from
+    # the periph manager and dboards that require a claim can always be run
+    # as jobs.
+    job_methods = ['init', 'update_component', 'commit_component_upload']
+    # These methods can't be run from within call_batch()
+    batch_excluded_methods = [
+        'call_batch', 'claim', 'unclaim', 'update_component', 'reset_mgr',
+        'commit_component_upload', 'get_sensor_updates',
+    ]
 
     ###########################################################################
     # RPC Server Initialization
@@ -60,7 +212,10 @@ class MPMServer(RPCServer):
         self.log.trace("Launching RPC server with compat num %d.%d",
                        MPM_COMPAT_NUM[0], MPM_COMPAT_NUM[1])
         self._state = state
-        self._timer = Greenlet()
+        # Monotonic time at which the current claim expires, or None if
+        # there's no claim. Claimed calls push it out; the claim watchdog
+        # unclaims once it has passed.
+        self._claim_deadline = None
         # Setting this to True will disable an unclaim on timeout. Use with
         # care, and make sure to set it to False again when finished.
         self._disable_timeouts = False
@@ -68,7 +223,16 @@ class MPMServer(RPCServer):
             "rpc_timeout_interval",
             TIMEOUT_INTERVAL
         ))
+        self._claim_watchdog = spawn(self._run_claim_watchdog)
         self.session_id = None
+        # Calls into the periph manager usually access hardware and can block
+        # for a long time without yielding to other greenlets. They get
+        # executed in this pool of native threads, while the RPC server itself
+        # stays responsive.
+        self._worker_pool = ThreadPool(int(default_args.get(
+            "rpc_num_worker_threads",
+            RPC_NUM_WORKER_THREADS
+        )))
         # Create the periph_manager for this device
         # This call will be forwarded to the device specific implementation
         # e.g. in periph_manager/n3xx.py
@@ -76,19 +240,38 @@ class MPMServer(RPCServer):
         # configuration with cmake (-DMPM_DEVICE).
         # mgr is thus derived from PeriphManagerBase
         # (see periph_manager/base.py)
-        from usrp_mpm.periph_manager import periph_manager
+        with STARTUP_TIMELINE.span('periph_manager_import'):
+            from usrp_mpm.periph_manager import periph_manager
         self._mgr_generator = lambda: periph_manager(default_args)
-        self.periph_manager = self._mgr_generator()
-        device_info = self.periph_manager.get_device_info()
-        self._state.dev_type.value = \
-                to_binary_str(device_info.get("type", "n/a"))
-        self._state.dev_product.value = \
-                to_binary_str(device_info.get("product", "n/a"))
-        self._state.dev_serial.value = \
-                to_binary_str(device_info.get("serial", "n/a"))
-        self._db_methods = []
-        self._mb_methods = []
-        self.claimed_methods = copy.copy(self.default_claimed_methods)
+        with STARTUP_TIMELINE.span('periph_manager_ctor'):
+            self.periph_manager = self._mgr_generator()
+        # Device info doesn't change while the periph manager is running, so
+        # get_device_info() can answer from here without touching the
+        # hardware
+        self._device_info = self.periph_manager.get_device_info()
+        self._run_in_worker(self.periph_manager.start_background_tasks)
+        # True while reset_mgr() replaces the periph manager. Calls into the
+        # periph manager fail in the meantime (see _check_mgr_ready()).
+        self._resetting_mgr = False
+        self._state.update(
+            dev_type=to_binary_str(self._device_info.get("type", "n/a")),
+            dev_product=to_binary_str(self._device_info.get("product", "n/a")),
+            dev_serial=to_binary_str(self._device_info.get("serial", "n/a")),
+        )
+        # The RPC dispatch table. Maps command name -> (function,
+        # requires_claim, docstring) for all periph manager and dboard
+        # commands. It's shared between dispatching, call_batch() and
+        # list_methods().
+        self._rpc_table = {}
+        # Cached return value of list_methods()
+        self._method_list = None
+        self._rpc_stats = RPCStats()
+        # Chunked component uploads that are in progress. Maps upload ID ->
+        # ComponentUpload. These survive claim loss so uploads can be resumed.
+        self._component_uploads = {}
+        self._sensor_subs = SensorSubscriptionManager(
+            self._read_sensors, self.log.getChild('sensors'))
+        self._job_mgr = JobManager(spawn, self.log.getChild('jobs'))
         self._last_error = ""
         self._init_rpc_calls(self.periph_manager)
         # We call the server __init__ function here, and not earlier, because
@@ -109,111 +292,177 @@ class MPMServer(RPCServer):
         """
         Register all RPC calls for the motherboard and daughterboards.
 
-        First clears out all previously registered RPC calls.
+        Replaces all previously registered RPC calls. Commands that were
+        registered before and still exist keep their dispatcher, only the
+        entry in the dispatch table is updated.
         """
-        # Clear old calls:
-        for meth_list in (self._db_methods, self._mb_methods):
-            for method in meth_list:
-                if hasattr(self, method):
-                    delattr(self, method)
-                else:
-                    self.log.warning(
-                        "Attempted to remove non-existant method: %s",
-                        method
-                    )
-        self._db_methods = []
-        self._mb_methods = []
-        # Register new ones:
-        self._update_component_commands(mgr, '', '_mb_methods')
+        rpc_table = {}
+        num_mb_methods = self._update_component_commands(mgr, '', rpc_table)
         for db_slot, dboard in enumerate(mgr.dboards):
             cmd_prefix = 'db_' + str(db_slot) + '_'
-            self._update_component_commands(dboard, cmd_prefix, '_db_methods')
+            self._update_component_commands(dboard, cmd_prefix, rpc_table)
+        # Clear old calls:
+        for command in self._rpc_table:
+            if command not in rpc_table:
+                delattr(self, command)
+        # Register new ones:
+        for command in rpc_table:
+            if command not in self._rpc_table:
+                setattr(self, command, self._make_dispatcher(command))
+        self._rpc_table = rpc_table
+        self._method_list = None
         self.log.debug(
             "Registered %d motherboard methods, %d daughterboard methods.",
-            len(self._mb_methods),
-            len(self._db_methods),
+            num_mb_methods,
+            len(rpc_table) - num_mb_methods,
         )
 
-    def _update_component_commands(self, component, namespace, storage):
+    def _is_reserved_name(self, name):
+        """
+        Returns True if name is taken by the RPC server itself, i.e., it can't
+        be used as a command name for components.
+        """
+        return hasattr(type(self), name) or \
+                (name in self.__dict__ and name not in self._rpc_table)
+
+    def _update_component_commands(self, component, namespace, rpc_table):
         """
-        Detect available methods for an object and add them to the RPC server.
+        Detect available methods for an object and add them to rpc_table.
 
         We skip all private methods, and all methods that use the @no_rpc
         decorator.
+
+        Returns the number of commands that were added.
         """
-        for method_name in (
-                m for m in dir(component)
-                if not m.startswith('_') \
-                    and callable(getattr(component, m)) \
-                    and not hasattr(self, m) \
-                    and not getattr(getattr(component, m), '_norpc', False)
-            ):
+        num_commands = 0
+        for method_name in dir(component):
+            if method_name.startswith('_') \
+                    or self._is_reserved_name(method_name) \
+                    or method_name in rpc_table:
+                continue
             new_rpc_method = getattr(component, method_name)
+            if not callable(new_rpc_method) \
+                    or getattr(new_rpc_method, '_norpc', False):
+                continue
             command_name = namespace + method_name
             if getattr(new_rpc_method, '_notok', False):
-                self._add_safe_command(new_rpc_method, command_name)
+                self._add_safe_command(new_rpc_method, command_name, rpc_table)
             else:
-                self._add_claimed_command(new_rpc_method, command_name)
-                self.claimed_methods.append(command_name)
-            getattr(self, storage).append(command_name)
-
+                self._add_claimed_command(
+                    new_rpc_method, command_name, rpc_table)
+            num_commands += 1
+        return num_commands
 
-    def _add_claimed_command(self, function, command):
+    def _add_claimed_command(self, function, command, rpc_table):
         """
-        Adds a method with the name command to the RPC server
+        Adds a method with the name command to the dispatch table.
         This command will require an acquired claim on the device, and a valid
         token needs to be passed in for it to not fail.
 
         If the method does not require a token, use _add_safe_command().
         """
         self.log.trace("adding command %s pointing to %s", command, function)
-        def new_claimed_function(token, *args):
-            " Define a function that requires a claim token check "
-            if not self._check_token_valid(token):
-                self.log.warning(
-                    "Thwarted attempt to access function `{}' with invalid " \
-                    "token `{}'.".format(command, token)
-                )
-                raise RuntimeError("Invalid token!")
-            try:
-                # Because we can only reach this point with a valid claim,
-                # there's no harm in resetting the timer
-                self._reset_timer()
-                return function(*args)
-            except Exception as ex:
-                self.log.error(
-                    "Uncaught exception in method %s :%s \n %s ",
-                    command, str(ex), traceback.format_exc()
-                )
-                self._last_error = str(ex)
-                raise
-            finally:
-                if not self._state.claim_status.value:
-                    self.log.error("Lost claim during API call to `%s'!",
-                                   command)
-        new_claimed_function.__doc__ = function.__doc__
-        setattr(self, command, new_claimed_function)
+        rpc_table[command] = (function, True, function.__doc__)
 
-    def _add_safe_command(self, function, command):
+    def _add_safe_command(self, function, command, rpc_table):
         """
         Add a safe method which does not require a claim on the device.
         If the method should only be called by claimers, use
         _add_claimed_command().
         """
         self.log.trace("adding safe command %s pointing to %s", command, function)
-        def new_unclaimed_function(*args):
-            " Define a function that does not require a claim token check "
-            try:
-                return function(*args)
-            except Exception as ex:
-                self.log.error(
-                    "Uncaught exception in method %s :%s\n %s ",
-                    command, str(ex), traceback.format_exc()
+        rpc_table[command] = (function, False, function.__doc__)
+
+    def _make_dispatcher(self, command):
+        """
+        Return a callable that the RPC server can call for command. It will
+        look up the actual function in the dispatch table on every call, so
+        it stays valid when the dispatch table is updated.
+        """
+        def dispatcher(*args):
+            " Forward a call to the dispatch table "
+            return self._dispatch(command, args)
+        return dispatcher
+
+    def _dispatch(self, command, args):
+        """
+        Execute a call from the dispatch table. If the command requires a
+        claim, the first argument must be a valid token.
+        """
+        self._check_mgr_ready(command)
+        try:
+            function, requires_claim, _ = self._rpc_table[command]
+        except KeyError:
+            raise RuntimeError("Method not found: {}".format(command))
+        if requires_claim:
+            if not args or not self._check_token_valid(args[0]):
+                self.log.warning(
+                    "Thwarted attempt to access function `{}' with invalid " \
+                    "token `{}'.".format(command, args[0] if args else None)
                 )
-                self._last_error = str(ex)
-                raise
-        new_unclaimed_function.__doc__ = function.__doc__
-        setattr(self, command, new_unclaimed_function)
+                raise RuntimeError("Invalid token!")
+            args = args[1:]
+            # Because we can only reach this point with a valid claim,
+            # there's no harm in resetting the timer
+            self._reset_timer()
+        start_time = time.perf_counter()
+        error = False
+        try:
+            return self._run_table_function(function, *args)
+        except Exception as ex:
+            error = True
+            self.log.error(
+                "Uncaught exception in method %s :%s \n %s ",
+                command, str(ex), traceback.format_exc()
+            )
+            self._last_error = str(ex)
+            raise
+        finally:
+            self._rpc_stats.record(
+                command, time.perf_counter() - start_time, error)
+            if requires_claim and not self._state.claim_status.value:
+                self.log.error("Lost claim during API call to `%s'!",
+                               command)
+
+    def _run_in_worker(self, function, *args):
+        """
+        Execute function(*args) in a worker thread and return its return value.
+        The calling greenlet is suspended until the call is complete, but the
+        RPC server can process other calls in the meantime. Exceptions are
+        propagated to the caller.
+
+        function is executed while holding HW_LOCK, so it never runs in
+        parallel with other calls or other threads that access the hardware.
+        Every call into the periph manager or the daughterboards must go
+        through here.
+
+        When called from a worker thread, function is executed immediately.
+        """
+        function = propagate_job(function)
+        def locked_function(*args):
+            " Run function while holding the hardware lock "
+            with HW_LOCK:
+                return function(*args)
+        return self._worker_pool.apply(locked_function, args)
+
+    def _check_mgr_ready(self, method_name):
+        " Throw if the periph manager is being reset "
+        if self._resetting_mgr:
+            self._last_error = \
+                "{}() called while resetting the periph manager.".format(
+                    method_name)
+            self.log.warning(self._last_error)
+            raise RuntimeError(self._last_error)
+
+    def _run_table_function(self, function, *args):
+        """
+        Execute function(*args), where function is from the dispatch table.
+        Functions that don't access the hardware (see no_hw()) are executed
+        right away, all others go through _run_in_worker().
+        """
+        if getattr(function, '_nohw', False):
+            return function(*args)
+        return self._run_in_worker(function, *args)
 
     ###########################################################################
     # Diagnostics and introspection
@@ -224,16 +473,102 @@ class MPMServer(RPCServer):
 
         Every tuple represents one call that's available over RPC.
         """
-        return [
-            (
-                method,
-                getattr(self, method).__doc__,
-                method in self.claimed_methods
+        if self._method_list is None:
+            server_methods = [
+                (method, getattr(self, method).__doc__,
+                 method in self.default_claimed_methods)
+                for method in dir(type(self))
+                if not method.startswith('_') \
+                        and callable(getattr(type(self), method))
+            ]
+            table_methods = [
+                (command, docstring, requires_claim)
+                for command, (_, requires_claim, docstring)
+                in iteritems(self._rpc_table)
+            ]
+            self._method_list = sorted(
+                server_methods + table_methods,
+                key=lambda method: method[0]
             )
-            for method in dir(self)
-            if not method.startswith('_') \
-                    and callable(getattr(self, method))
-        ]
+        return self._method_list
+
+    def call_batch(self, token, calls):
+        """
+        Execute multiple RPC calls in a single round-trip.
+
+        The token is checked once, and the claim timer is reset once for the
+        entire batch. Calls are executed in order. A failing call does not
+        abort the batch.
+
+        Arguments:
+        token -- The claim token. Only required to be valid if any of the
+                 calls requires a claim.
+        calls -- A list of (method_name, args) pairs. args is a list of
+                 positional arguments for that method, but without the token:
+                 The token given to call_batch() is used for all calls that
+                 require a claim.
+
+        Returns a list of (success, value) pairs, one per call. On success,
+        value is the return value of the call, otherwise, it is the error
+        string.
+        """
+        token_valid = self._check_token_valid(token)
+        if token_valid:
+            self._reset_timer()
+        results = []
+        for method_name, args in calls:
+            start_time = time.perf_counter()
+            try:
+                results.append(
+                    (True, self._call_from_batch(
+                        method_name, args, token, token_valid)))
+                self._rpc_stats.record(
+                    method_name, time.perf_counter() - start_time)
+            except Exception as ex:
+                self._rpc_stats.record(
+                    method_name, time.perf_counter() - start_time, True)
+                self.log.error(
+                    "Uncaught exception in batched method %s: %s",
+                    method_name, str(ex)
+                )
+                self._last_error = str(ex)
+                results.append((False, str(ex)))
+        if token_valid and not self._state.claim_status.value:
+            self.log.error("Lost claim during batched API call!")
+        self.log.trace("Executed batch of %d calls.", len(results))
+        return results
+
+    def _call_from_batch(self, method_name, args, token, token_valid):
+        """
+        Execute a single call on behalf of call_batch(). Will raise on failure.
+        """
+        method_name = to_native_str(method_name)
+        if method_name in self._rpc_table:
+            function, requires_claim, _ = self._rpc_table[method_name]
+        else:
+            function = None
+            requires_claim = method_name in self.default_claimed_methods
+        if method_name in self.batch_excluded_methods \
+                or method_name.startswith('_'):
+            raise RuntimeError(
+                "Method `{}' can't be called from call_batch()".format(
+                    method_name))
+        if requires_claim and not token_valid:
+            self.log.warning(
+                "Thwarted attempt to access function `{}' with invalid " \
+                "token `{}'.".format(method_name, token)
+            )
+            raise RuntimeError("Invalid token!")
+        if function is not None:
+            self._check_mgr_ready(method_name)
+            # Skip the dispatcher, we've already done its work
+            return self._run_table_function(function, *args)
+        method = getattr(self, method_name, None)
+        if method is None or not callable(method):
+            raise RuntimeError("Unknown method `{}'".format(method_name))
+        if requires_claim:
+            return method(token, *args)
+        return method(*args)
 
     def ping(self, data=None):
         """
@@ -243,6 +578,27 @@ class MPMServer(RPCServer):
         self.log.debug("I was pinged from: %s:%s", self.client_host, self.client_port)
         return data
 
+    def get_rpc_stats(self):
+        """
+        Return per-method call statistics for all calls that went through the
+        RPC server since the last call to reset_rpc_stats(). See
+        RPCStats.get() for the format.
+
+        The key 'stats_age' holds the number of seconds since the last reset.
+        """
+        return {
+            'stats_age': self._rpc_stats.get_age(),
+            'methods': self._rpc_stats.get(),
+        }
+
+    def reset_rpc_stats(self):
+        """
+        Clear the per-method call statistics.
+        """
+        self.log.debug("Resetting RPC call statistics.")
+        self._rpc_stats.reset()
+        return True
+
     ###########################################################################
     # Claiming logic
     ###########################################################################
@@ -253,9 +609,19 @@ class MPMServer(RPCServer):
         - The claim token matches the one passed in
         """
         token = to_binary_str(token)
-        return self._state.claim_status.value and \
+        state = self._state.get_snapshot()
+        return state.claim_status and \
                 len(token) == TOKEN_LEN and \
-                self._state.claim_token.value == token
+                state.claim_token == token
+
+    def _check_claim(self, token, method_name):
+        " Throw if token is invalid, otherwise reset the claim timer "
+        if not self._check_token_valid(token):
+            self._last_error = \
+                "{}() called without valid claim.".format(method_name)
+            self.log.error(self._last_error)
+            raise RuntimeError(self._last_error)
+        self._reset_timer()
 
     def claim(self, session_id):
         """Claim device
@@ -266,6 +632,7 @@ class MPMServer(RPCServer):
 
         Will return a token on success, or raise an Exception on failure.
         """
+        self._check_mgr_ready('claim')
         self._state.lock.acquire()
         if self._state.claim_status.value:
             self.log.warning("Someone tried to claim this device again")
@@ -277,13 +644,15 @@ class MPMServer(RPCServer):
             self.client_host,
             session_id
         )
-        self._state.claim_token.value = bytes(''.join(
-            choice(ascii_letters + digits) for _ in range(TOKEN_LEN)
-        ), 'ascii')
-        self._state.claim_status.value = True
+        self._state.update(
+            claim_token=bytes(''.join(
+                choice(ascii_letters + digits) for _ in range(TOKEN_LEN)
+            ), 'ascii'),
+            claim_status=True,
+        )
         self.periph_manager.claimed = True
-        self.periph_manager.claim()
         self._state.lock.release()
+        self._run_in_worker(self.periph_manager.claim)
         self.session_id = session_id + " ({})".format(self.client_host)
         self._reset_timer()
         self.log.debug(
@@ -304,13 +673,10 @@ class MPMServer(RPCServer):
         claimed at all.
         """
         if self._state.claim_status.value:
-            self._state.lock.acquire()
             if self._check_token_valid(token):
-                self._state.lock.release()
                 self.log.debug("reclaimed from: %s", self.client_host)
                 self._reset_timer()
                 return True
-            self._state.lock.release()
             self.log.debug(
                 "reclaim failed from: %s  Invalid token: %s",
                 self.client_host, token[:TOKEN_LEN]
@@ -331,31 +697,45 @@ class MPMServer(RPCServer):
         self.log.debug("Releasing claim on session `{}'".format(
             self.session_id
         ))
-        self._state.claim_status.value = False
-        self._state.claim_token.value = b''
+        self._state.update(claim_status=False, claim_token=b'')
         self.session_id = None
         try:
             self.periph_manager.claimed = False
-            self.periph_manager.unclaim()
+            self._run_in_worker(self.periph_manager.unclaim)
             self.periph_manager.set_connection_type(None)
-            self.periph_manager.deinit()
+            self._run_in_worker(self.periph_manager.deinit)
         except Exception as ex:
             self._last_error = str(ex)
             self.log.error("deinit() failed: %s", str(ex))
             # Don't want to propagate this failure -- the session is over
-        self._timer.kill()
+        self._sensor_subs.clear()
+        self._claim_deadline = None
 
     def unclaim(self, token):
         """
         unclaim `token` - unclaims the MPM device if it is claimed with this
         token
         """
+        self._check_mgr_ready('unclaim')
         if self._check_token_valid(token):
             self._unclaim()
             return True
         self.log.warning("Attempt to unclaim session with invalid token!")
         return False
 
+    def _heartbeat(self, token):
+        """
+        Handle a UDP heartbeat: Same as reclaim(), but not an RPC call. Hosts
+        can send these instead of calling reclaim() to keep their claim
+        alive without holding an RPC connection.
+
+        Returns True if the claim was renewed.
+        """
+        if self._check_token_valid(token):
+            self._reset_timer()
+            return True
+        return False
+
     def _timeout_event(self):
         " Callback for the claim timeout. "
         if self._disable_timeouts:
@@ -365,13 +745,33 @@ class MPMServer(RPCServer):
             self.log.warning("A timeout event occured!")
             self._unclaim()
 
+    def _run_claim_watchdog(self):
+        """
+        Watchdog greenlet for the claim. It runs for the lifetime of the
+        server, sleeps until the claim deadline, and then calls
+        _timeout_event() if the deadline wasn't pushed out in the meantime.
+        """
+        while True:
+            deadline = self._claim_deadline
+            if deadline is None:
+                sleep(self._timeout_interval)
+                continue
+            now = time.monotonic()
+            if now < deadline:
+                sleep(deadline - now)
+                continue
+            try:
+                self._timeout_event()
+            except Exception as ex:
+                self.log.error("Error handling claim timeout: %s", str(ex))
+                self._claim_deadline = None
+
     def _reset_timer(self):
         """
         Reset unclaim timer. After calling this, call this function again
         within 'timeout' seconds to avoid a timeout event.
         """
-        self._timer.kill()
-        self._timer = spawn_later(self._timeout_interval, self._timeout_event)
+        self._claim_deadline = time.monotonic() + self._timeout_interval
 
     ###########################################################################
     # Status queries
@@ -385,7 +785,8 @@ class MPMServer(RPCServer):
         get device information
         This is as safe method which can be called without a claim on the device
         """
-        info = self.periph_manager.get_device_info()
+        info = dict(self._device_info)
+        info["claimed"] = str(bool(self._state.claim_status.value))
         info["mpm_version"] = "{}.{}".format(*MPM_COMPAT_NUM)
         if self.client_host in net.get_local_ip_addrs():
             info["connection"] = "local"
@@ -420,6 +821,32 @@ class MPMServer(RPCServer):
             for record in log_records
         ]
 
+    def get_logs_since(self, cursor, max_n, min_level):
+        """
+        Return up to max_n log records, starting at sequence number cursor.
+        Unlike get_log_buf(), this doesn't consume the records, so it needs no
+        claim, and multiple clients can tail the logs at the same time.
+
+        Arguments:
+        cursor -- Sequence number of the first record to return. Use 0 to
+                  start with the oldest buffered record, and -1 to start
+                  with the next new record.
+        max_n -- Maximum number of records to return
+        min_level -- Only return records of at least this level. Can be a
+                     number, or a level name (e.g. 'WARNING').
+
+        Returns a tuple (next_cursor, num_lost, records). See
+        MPMLogger.get_logs_since() for details.
+        """
+        if isinstance(min_level, (str, bytes)):
+            level_name = to_native_str(min_level).upper()
+            min_level = logging.getLevelName(level_name)
+            if not isinstance(min_level, int):
+                self._last_error = "Invalid log level: {}".format(level_name)
+                raise RuntimeError(self._last_error)
+        return get_main_logger().get_logs_since(
+            int(cursor), int(max_n), int(min_level))
+
     ###########################################################################
     # Session initialization
     ###########################################################################
@@ -436,27 +863,213 @@ class MPMServer(RPCServer):
             )
             self._last_error = "init() called without valid claim."
             raise RuntimeError("init() called without valid claim.")
+        self._check_mgr_ready('init')
+        result = False
+        start_time = time.perf_counter()
         try:
-            result = self.periph_manager.init(args)
+            result = self._run_in_worker(self.periph_manager.init, args)
         except Exception as ex:
             self._last_error = str(ex)
             self.log.error("init() failed with error: %s", str(ex))
         finally:
+            self._rpc_stats.record(
+                'init', time.perf_counter() - start_time, not result)
             self.log.debug("init() result: {}".format(result))
         return result
 
+    ###########################################################################
+    # Asynchronous jobs
+    ###########################################################################
+    def start_job(self, token, method_name, args):
+        """
+        Run a call asynchronously, and return a job ID immediately. Use
+        get_job_status() or wait_job() to track its progress and to retrieve
+        the result.
+
+        This is useful for calls that take a long time, like init() or
+        update_component(), because it doesn't block the RPC connection
+        while the call is running.
+
+        Arguments:
+        token -- The claim token
+        method_name -- The call to run, e.g., 'init'. Can be any periph
+                       manager or dboard call that requires a claim, or any
+                       of the calls in MPMServer.job_methods.
+        args -- List of arguments for the call, without the token
+        """
+        if not self._check_token_valid(token):
+            self._last_error = "start_job() called without valid claim."
+            self.log.warning(
+                "Attempt to start job without valid claim from {}".format(
+                    self.client_host
+                )
+            )
+            raise RuntimeError(self._last_error)
+        self._reset_timer()
+        method_name = to_native_str(method_name)
+        self._check_mgr_ready(method_name)
+        if method_name in self.job_methods:
+            function = getattr(self, method_name)
+            args = [token] + list(args)
+        elif method_name in self._rpc_table \
+                and self._rpc_table[method_name][1]:
+            args = [self._rpc_table[method_name][0]] + list(args)
+            function = self._run_in_worker
+        else:
+            self._last_error = \
+                "Method `{}' can't be run as a job.".format(method_name)
+            self.log.error(self._last_error)
+            raise RuntimeError(self._last_error)
+        return self._job_mgr.start(method_name, function, *args)
+
+    def get_job_status(self, token, job_id):
+        """
+        Return the status of a job that was started with start_job(). The
+        status is a dictionary; see jobs.Job.get_status() for details.
+        """
+        if not self._check_token_valid(token):
+            self._last_error = "get_job_status() called without valid claim."
+            raise RuntimeError(self._last_error)
+        self._reset_timer()
+        return self._job_mgr.get_status(job_id)
+
+    def wait_job(self, token, job_id, timeout):
+        """
+        Wait for up to timeout seconds for a job to finish, and then return
+        its status (see get_job_status()). Returns as soon as the job is
+        finished. Calling this also keeps the claim alive, which is why the
+        timeout is limited to half the claim timeout.
+        """
+        if not self._check_token_valid(token):
+            self._last_error = "wait_job() called without valid claim."
+            raise RuntimeError(self._last_error)
+        self._reset_timer()
+        timeout = min(float(timeout), self._timeout_interval / 2)
+        status = self._job_mgr.wait(job_id, timeout)
+        self._reset_timer()
+        return status
+
+    ###########################################################################
+    # Sensor subscriptions
+    ###########################################################################
+    def _is_sensor_command(self, command):
+        " Returns True if command reads mboard or dboard sensors "
+        if command not in self._rpc_table:
+            return False
+        return command in ('get_mb_sensor', 'get_all_sensors') or \
+            (command.startswith('db_') and command.endswith('_get_sensor'))
+
+    def _read_sensors(self, sensors):
+        """
+        Read a list of (command, args) sensors in the worker thread, and
+        return their values. If a sensor can't be read, its value is a
+        dictionary with an 'error' key instead.
+        """
+        def read_sensors_blocking():
+            " Read all sensors in one go "
+            values = []
+            for command, args in sensors:
+                try:
+                    values.append(self._rpc_table[command][0](*args))
+                except Exception as ex:
+                    values.append({'error': str(ex)})
+            return values
+        return self._run_in_worker(read_sensors_blocking)
+
+    def subscribe_sensors(self, token, sensors, period, udp_port):
+        """
+        Subscribe to periodic updates of a set of sensors. Instead of calling
+        get_mb_sensor() or db_N_get_sensor() for every sensor, the client
+        receives the values of all sensors at once, every period seconds.
+
+        Arguments:
+        token -- The claim token
+        sensors -- List of sensors. Every sensor is a (command, args) pair,
+                   e.g. ('get_mb_sensor', ('temp',)),
+                   ('db_0_get_sensor', ('RX', 'lo_locked', 0)), or
+                   ('get_all_sensors', ()).
+        period -- Update period in seconds
+        udp_port -- If zero, updates are queued, and the client fetches them
+                    by calling get_sensor_updates(). Otherwise, every update
+                    is sent as a msgpack-encoded (sub_id, timestamp, values)
+                    datagram to this UDP port on the calling host.
+
+        Every update contains a timestamp, and a list with one value per
+        sensor, in the order of sensors. Subscriptions are removed when the
+        device is unclaimed. Queued subscriptions are also removed when the
+        client stops fetching their updates.
+
+        Returns the subscription ID.
+        """
+        self._check_claim(token, 'subscribe_sensors')
+        sensor_list = []
+        for command, args in sensors:
+            command = to_native_str(command)
+            if not self._is_sensor_command(command):
+                self._last_error = \
+                    "`{}' is not a sensor command.".format(command)
+                self.log.error(self._last_error)
+                raise RuntimeError(self._last_error)
+            sensor_list.append((command, tuple(args)))
+        address = (self.client_host, int(udp_port)) if udp_port else None
+        return self._sensor_subs.subscribe(sensor_list, float(period), address)
+
+    def unsubscribe_sensors(self, token, sub_id):
+        """
+        Remove a sensor subscription.
+        """
+        self._check_claim(token, 'unsubscribe_sensors')
+        self._sensor_subs.unsubscribe(sub_id)
+
+    def get_sensor_updates(self, token, sub_id, timeout):
+        """
+        Fetch the updates of a sensor subscription that were queued since the
+        last call. If there are none, wait for up to timeout seconds for the
+        next update. Calling this also keeps the claim alive, which is why
+        the timeout is limited to half the claim timeout.
+
+        Returns a tuple (num_dropped, updates), where updates is a list of
+        (timestamp, values) tuples, and num_dropped is the total number of
+        updates that were dropped because the client didn't fetch them in
+        time.
+        """
+        self._check_claim(token, 'get_sensor_updates')
+        timeout = min(float(timeout), self._timeout_interval / 2)
+        result = self._sensor_subs.get_updates(sub_id, timeout)
+        self._reset_timer()
+        return result
+
     ###########################################################################
     # Update components
     ###########################################################################
     def reset_mgr(self):
         """
         Reset the Peripheral Manager for this RPC server.
+
+        The new periph manager is fully created before it replaces the old
+        one, together with the dispatch table. Calls that need the periph
+        manager fail until then.
         """
+        self._check_mgr_ready('reset_mgr')
         self.log.info("Resetting peripheral manager.")
-        self.periph_manager.tear_down()
-        self.periph_manager = None
-        self.periph_manager = self._mgr_generator()
-        self._init_rpc_calls(self.periph_manager)
+        old_mgr = self.periph_manager
+        def reset_mgr_blocking():
+            " Replace the periph manager without letting other calls in "
+            old_mgr.tear_down()
+            new_mgr = self._mgr_generator()
+            new_mgr.start_background_tasks()
+            new_mgr.claimed = old_mgr.claimed
+            new_mgr.set_connection_type(
+                old_mgr.device_info.get('rpc_connection'))
+            return new_mgr, new_mgr.get_device_info()
+        self._resetting_mgr = True
+        try:
+            new_mgr, device_info = self._run_in_worker(reset_mgr_blocking)
+            self.periph_manager = new_mgr
+            self._device_info = device_info
+            self._init_rpc_calls(new_mgr)
+        finally:
+            self._resetting_mgr = False
 
     def update_component(self, token, file_metadata_l, data_l):
         """"
@@ -474,14 +1087,21 @@ class MPMServer(RPCServer):
                 )
             self.log.error(self._last_error)
             raise RuntimeError("Attempt to update component without valid claim.")
-        result = self.periph_manager.update_component(file_metadata_l, data_l)
-        if not result:
-            component_ids = [metadata['id'] for metadata in file_metadata_l]
-            raise RuntimeError("Failed to update components: {}".format(component_ids))
+        self._check_mgr_ready('update_component')
+        updated_metadata_l = self._run_in_worker(
+            self.periph_manager.update_component, file_metadata_l, data_l)
+        # Components that were already installed don't need a reset
+        self._reset_mgr_after_update(updated_metadata_l)
+        self.log.debug("End of update_component")
+        self._reset_timer()
 
-        # Check if we need to reset the peripheral manager
+    def _reset_mgr_after_update(self, file_metadata_l):
+        """
+        Reset the periph manager if any of the updated components require it.
+        """
+        report_progress("Checking if periph manager needs reset")
         reset_now = False
-        for metadata, data in zip(file_metadata_l, data_l):
+        for metadata in file_metadata_l:
             # Make sure the component is in the updateable_components
             component_id = metadata['id']
             if component_id in self.periph_manager.updateable_components:
@@ -495,6 +1115,7 @@ class MPMServer(RPCServer):
         try:
             self.log.trace("Reset after updating component? {}".format(reset_now))
             if reset_now:
+                report_progress("Resetting periph manager")
                 self.reset_mgr()
                 self.log.debug("Reset the periph manager")
         except Exception as ex:
@@ -504,8 +1125,147 @@ class MPMServer(RPCServer):
                 ))
             self._last_error = str(ex)
 
-        self.log.debug("End of update_component")
-        self._reset_timer()
+    def _get_component_upload(self, upload_id):
+        " Return an upload in progress or throw "
+        upload_id = to_native_str(upload_id)
+        if upload_id not in self._component_uploads:
+            self._last_error = "Unknown upload ID: {}".format(upload_id)
+            raise RuntimeError(self._last_error)
+        return self._component_uploads[upload_id]
+
+    def _prune_component_uploads(self):
+        " Drop uploads that haven't seen any activity in a while "
+        now = time.time()
+        for upload_id, upload in list(self._component_uploads.items()):
+            if now - upload.last_activity > COMPONENT_UPLOAD_TIMEOUT:
+                self.log.warning("Dropping stale upload `%s'", upload_id)
+                upload.abort()
+                self._component_uploads.pop(upload_id)
+
+    def begin_component_upload(self, token, metadata):
+        """
+        Start uploading a component file in chunks. This is an alternative to
+        update_component() for large files: The file is sent in chunks using
+        append_component_chunk(), and then installed by calling
+        commit_component_upload().
+
+        If an upload of the same file (same component ID, filename, and
+        checksum) is already in progress, it is resumed instead.
+
+        Arguments:
+        token -- The claim token
+        metadata -- Dictionary of strings containing metadata, same as for
+                    update_component(). Should contain an 'md5' or 'sha256'
+                    key to verify the file, and may contain a 'size' key
+                    (file size in bytes).
+
+        Returns a tuple (upload_id, offset), where offset is the number of
+        bytes the device already has, i.e., where the next chunk must start.
+        """
+        from usrp_mpm.components import ComponentUpload
+        self._check_claim(token, 'begin_component_upload')
+        self._check_mgr_ready('begin_component_upload')
+        metadata = {
+            to_native_str(key): to_native_str(value)
+            for key, value in iteritems(metadata)
+        }
+        if metadata['id'] not in self.periph_manager.updateable_components:
+            self._last_error = \
+                "{} not an updateable component".format(metadata['id'])
+            self.log.error(self._last_error)
+            raise RuntimeError(self._last_error)
+        upload_id = ":".join((
+            metadata['id'],
+            metadata['filename'],
+            metadata.get('sha256', metadata.get('md5', '')),
+        ))
+        self._prune_component_uploads()
+        if upload_id in self._component_uploads:
+            upload = self._component_uploads[upload_id]
+            self.log.debug("Resuming upload `%s' at offset %d",
+                           upload_id, upload.offset)
+            return upload_id, upload.offset
+        if len(self._component_uploads) >= MAX_COMPONENT_UPLOADS:
+            self._last_error = "Too many uploads in progress."
+            self.log.error(self._last_error)
+            raise RuntimeError(self._last_error)
+        self.log.debug("Starting upload `%s'", upload_id)
+        self._component_uploads[upload_id] = self._run_in_worker(
+            ComponentUpload, upload_id, metadata, self.log.getChild('upload'))
+        return upload_id, 0
+
+    def append_component_chunk(self, token, upload_id, offset, data):
+        """
+        Add a chunk of data to a component upload. offset is the position of
+        this chunk within the file. Chunks must be sent in order; chunks that
+        the device already has are ignored, so it's safe to resend data after
+        a connection loss.
+
+        Returns the offset at which the next chunk must start.
+        """
+        self._check_claim(token, 'append_component_chunk')
+        upload = self._get_component_upload(upload_id)
+        return self._run_in_worker(upload.append, int(offset), data)
+
+    def commit_component_upload(self, token, upload_id):
+        """
+        Finish a component upload: The file is verified against the checksums
+        given to begin_component_upload(), and then the component is updated
+        the same way as update_component() would.
+        """
+        self._check_claim(token, 'commit_component_upload')
+        self._check_mgr_ready('commit_component_upload')
+        upload = self._get_component_upload(upload_id)
+        self._component_uploads.pop(upload.upload_id)
+        # Stop the timer, installing the component can take some time:
+        self._disable_timeouts = True
+        try:
+            report_progress("Verifying component `{}'".format(
+                upload.metadata['id']))
+            filepath = self._run_in_worker(upload.finalize)
+            if not self._run_in_worker(
+                    self.periph_manager.is_component_installed,
+                    upload.metadata):
+                self._run_in_worker(
+                    self.periph_manager.install_component,
+                    upload.metadata, filepath)
+                self._reset_mgr_after_update([upload.metadata])
+        finally:
+            self._disable_timeouts = False
+            self._reset_timer()
+        self.log.debug("End of commit_component_upload")
+
+    def abort_component_upload(self, token, upload_id):
+        """
+        Cancel a component upload and delete the data received so far.
+        """
+        self._check_claim(token, 'abort_component_upload')
+        upload = self._get_component_upload(upload_id)
+        self._component_uploads.pop(upload.upload_id)
+        self._run_in_worker(upload.abort)
+
+
+class HeartbeatServer(DatagramServer):
+    """
+    Receives UDP claim heartbeats and forwards them to the MPMServer.
+
+    A heartbeat is a datagram containing MPM_HEARTBEAT_MESSAGE and the claim
+    token, separated by a semicolon. The reply is MPM_HEARTBEAT_MESSAGE
+    followed by ";OK" if the claim was renewed, or ";INVALID" if not.
+    """
+    def __init__(self, listener, mpm_server):
+        DatagramServer.__init__(self, listener)
+        self._mpm_server = mpm_server
+        self._preamble = to_binary_str(MPM_HEARTBEAT_MESSAGE) + b";"
+
+    def handle(self, data, address):
+        " Handle a single heartbeat "
+        data = data.strip(b"\0")
+        if not data.startswith(self._preamble):
+            return
+        token = data[len(self._preamble):]
+        result = b"OK" if self._mpm_server._heartbeat(token) else b"INVALID"
+        self.socket.sendto(self._preamble + result, address)
 
 
 ###############################################################################
@@ -515,14 +1275,27 @@ def _rpc_server_process(shared_state, port, default_args):
     """
     This is the actual process that's running the RPC server.
     """
+    STARTUP_TIMELINE.mark('rpc_process_started')
     connections = Pool(1000)
+    mpm_server = MPMServer(shared_state, default_args)
     server = StreamServer(
         ('0.0.0.0', port),
-        handle=MPMServer(shared_state, default_args),
+        handle=mpm_server,
         spawn=connections)
+    heartbeat_server = HeartbeatServer(('0.0.0.0', port), mpm_server)
+    heartbeat_server.start()
+    def stop_servers():
+        " Stop the stream server and the heartbeat server "
+        heartbeat_server.stop()
+        server.stop()
     # catch signals and stop the stream server
-    signal(signal.SIGTERM, lambda *args: server.stop())
-    signal(signal.SIGINT, lambda *args: server.stop())
+    signal(signal.SIGTERM, lambda *args: stop_servers())
+    signal(signal.SIGINT, lambda *args: stop_servers())
+    server.start()
+    STARTUP_TIMELINE.mark('rpc_server_ready')
+    # The watchdog task (if any) was spawned before this, so by the time this
+    # runs, it has notified systemd that we're ready
+    spawn(STARTUP_TIMELINE.finish, mpm_server.log.getChild('startup'))
     server.serve_forever()
 
 
@@ -0,0 +1,226 @@
+#
+# Copyright 2018 Ettus Research, a National Instruments Company
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+#
+"""
+Push-based sensor subscriptions
+"""
+
+import itertools
+import socket
+import time
+from collections import deque
+from builtins import object
+import msgpack
+from gevent import spawn
+from gevent.event import Event
+
+# Smallest update period a subscription may request, in seconds
+MIN_SUBSCRIPTION_PERIOD = 0.1
+# Maximum number of subscriptions that can be active at the same time
+MAX_SUBSCRIPTIONS = 16
+# Number of updates that are queued per subscription. If the client doesn't
+# fetch them in time, the oldest ones are dropped.
+MAX_QUEUED_UPDATES = 64
+# Queued subscriptions are removed if the client didn't fetch their updates
+# for this many seconds
+STALE_SUBSCRIPTION_TIMEOUT = 60.0
+
+class SensorSubscription(object):
+    """
+    A set of sensors which a client wants to receive periodically.
+
+    Arguments:
+    sub_id -- The subscription ID
+    sensors -- List of sensors. Every sensor is a (command, args) tuple,
+               where command is the RPC command that reads the sensor
+               (e.g. 'get_mb_sensor') and args is a tuple of arguments for
+               that command.
+    period -- Update period in seconds
+    address -- If not None, updates are sent as UDP datagrams to this
+               (host, port) tuple instead of being queued.
+    """
+    def __init__(self, sub_id, sensors, period, address):
+        self.sub_id = sub_id
+        self.sensors = sensors
+        self.period = period
+        self.address = address
+        self.next_update = time.monotonic()
+        self.last_fetch = self.next_update
+        self.num_dropped = 0
+        self._updates = deque()
+        self._update_available = Event()
+
+    def push(self, timestamp, values):
+        """
+        Queue an update. values is a list with one value per sensor, in the
+        same order as self.sensors.
+        """
+        if len(self._updates) >= MAX_QUEUED_UPDATES:
+            self._updates.popleft()
+            self.num_dropped += 1
+        self._updates.append((timestamp, values))
+        self._update_available.set()
+
+    def pop_all(self, timeout):
+        """
+        Return all queued updates as a list of (timestamp, values) tuples.
+        If there are none, wait for up to timeout seconds for the next one.
+        """
+        self.last_fetch = time.monotonic()
+        if not self._updates:
+            self._update_available.wait(timeout)
+        updates = list(self._updates)
+        self._updates.clear()
+        self._update_available.clear()
+        self.last_fetch = time.monotonic()
+        return updates
+
+    def is_stale(self, now):
+        """
+        Returns True if this is a queued subscription, and the client hasn't
+        fetched its updates for STALE_SUBSCRIPTION_TIMEOUT seconds.
+        """
+        return self.address is None and \
+            now - self.last_fetch > STALE_SUBSCRIPTION_TIMEOUT
+
+
+class SensorSubscriptionManager(object):
+    """
+    Keeps track of sensor subscriptions, and periodically reads the sensors.
+
+    A single sampler greenlet serves all subscriptions. On every update, it
+    reads each sensor only once, even if it's part of multiple subscriptions
+    that are due at the same time. Queued subscriptions that the client
+    stopped fetching are removed (see STALE_SUBSCRIPTION_TIMEOUT).
+
+    Arguments:
+    read_sensors -- Callable that takes a list of sensors (see
+                    SensorSubscription) and returns a list of their values
+    log -- Logger object
+    """
+    def __init__(self, read_sensors, log):
+        self._read_sensors = read_sensors
+        self.log = log
+        self._subscriptions = {}
+        self._sub_ids = itertools.count(1)
+        self._sampler = None
+        # Wakes up the sampler when subscriptions are added
+        self._wakeup = Event()
+        self._sock = None
+
+    def subscribe(self, sensors, period, address=None):
+        """
+        Add a new subscription and return its ID. See SensorSubscription for
+        the arguments.
+        """
+        if period < MIN_SUBSCRIPTION_PERIOD:
+            raise RuntimeError(
+                "Sensor update period must be at least {} s.".format(
+                    MIN_SUBSCRIPTION_PERIOD))
+        if len(self._subscriptions) >= MAX_SUBSCRIPTIONS:
+            raise RuntimeError("Too many sensor subscriptions.")
+        sub = SensorSubscription(
+            next(self._sub_ids), sensors, period, address)
+        self.log.debug("Adding sensor subscription %d: %d sensors every "
+                       "%.2f s", sub.sub_id, len(sensors), period)
+        self._subscriptions[sub.sub_id] = sub
+        if self._sampler is None or self._sampler.dead:
+            self._sampler = spawn(self._run_sampler)
+        else:
+            self._wakeup.set()
+        return sub.sub_id
+
+    def unsubscribe(self, sub_id):
+        """
+        Remove a subscription.
+        """
+        self.log.debug("Removing sensor subscription %d", sub_id)
+        self._get_subscription(sub_id)
+        self._subscriptions.pop(sub_id)
+
+    def clear(self):
+        """
+        Remove all subscriptions.
+        """
+        if self._subscriptions:
+            self.log.debug("Removing all sensor subscriptions.")
+        self._subscriptions.clear()
+
+    def get_updates(self, sub_id, timeout):
+        """
+        Return the queued updates of a subscription, waiting for up to
+        timeout seconds if there are none yet. The return value is a tuple
+        (num_dropped, updates), where updates is a list of
+        (timestamp, values) tuples, and num_dropped is the total number of
+        updates that were dropped because they weren't fetched in time.
+        """
+        sub = self._get_subscription(sub_id)
+        updates = sub.pop_all(timeout)
+        return sub.num_dropped, updates
+
+    def _get_subscription(self, sub_id):
+        " Return a subscription or throw "
+        if sub_id not in self._subscriptions:
+            raise RuntimeError("Unknown sensor subscription: {}".format(sub_id))
+        return self._subscriptions[sub_id]
+
+    def _send(self, sub, timestamp, values):
+        " Send an update to a UDP subscriber "
+        if self._sock is None:
+            self._sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        try:
+            self._sock.sendto(
+                msgpack.packb((sub.sub_id, timestamp, values),
+                              use_bin_type=True),
+                sub.address)
+        except (IOError, OSError) as ex:
+            self.log.warning("Failed to send sensor update to %s:%d: %s",
+                             sub.address[0], sub.address[1], str(ex))
+
+    def _update(self, subs):
+        " Read the sensors of subs once, and hand out the values "
+        sensors = list(set(itertools.chain(*[sub.sensors for sub in subs])))
+        values = dict(zip(sensors, self._read_sensors(sensors)))
+        timestamp = time.time()
+        for sub in subs:
+            sub_values = [values[sensor] for sensor in sub.sensors]
+            if sub.address is None:
+                sub.push(timestamp, sub_values)
+            else:
+                self._send(sub, timestamp, sub_values)
+
+    def _run_sampler(self):
+        """
+        Sampler greenlet. Runs while there are subscriptions.
+        """
+        while self._subscriptions:
+            now = time.monotonic()
+            for sub in list(self._subscriptions.values()):
+                if sub.is_stale(now):
+                    self.log.warning(
+                        "Removing sensor subscription %d, its updates "
+                        "weren't fetched for %.0f s.",
+                        sub.sub_id, now - sub.last_fetch)
+                    self._subscriptions.pop(sub.sub_id)
+            due_subs = [
+                sub for sub in self._subscriptions.values()
+                if sub.next_update <= now
+            ]
+            if due_subs:
+                try:
+                    self._update(due_subs)
+                except Exception as ex:
+                    self.log.error("Error reading subscribed sensors: %s",
+                                   str(ex))
+                for sub in due_subs:
+                    sub.next_update += sub.period
+                    # Don't try to catch up if reading took too long
+                    if sub.next_update < now:
+                        sub.next_update = now + sub.period
+            if self._subscriptions:
+                next_update = min(
+                    sub.next_update for sub in self._subscriptions.values())
+                self._wakeup.wait(max(next_update - time.monotonic(), 0))
+                self._wakeup.clear()
@@ -6,35 +6,181 @@
 """
 Network utilities for MPM
 """
-import itertools
+import os
 import socket
+import time
 from six import iteritems
-from pyroute2 import IPRoute, IPDB
+from pyroute2 import IPRoute
+from pyroute2.netlink.rtnl import RTMGRP_LINK, RTMGRP_NEIGH
+from pyroute2.netlink.rtnl import RTMGRP_IPV4_IFADDR, RTMGRP_IPV6_IFADDR
+from usrp_mpm.gevent_compat import get_original
 from usrp_mpm.mpmlog import get_logger
 
+# The interface cache is used from native threads (e.g., the RPC worker
+# threads), so it needs the original lock and select() implementations, even
+# if gevent monkey patching is active
+_Lock = get_original('threading', 'Lock')
+_select = get_original('select', 'select')
+
 def get_hostname():
     """Return the current device's hostname"""
     return socket.gethostname()
 
+# Seconds after which the interface cache is re-read, if we can't get change
+# notifications from netlink
+IFACE_CACHE_POLL_INTERVAL = 1.0
+
+class InterfaceCache(object):
+    """
+    Process-wide cache of the network interfaces, their addresses, and the
+    IPv4 neighbour (ARP) table. Use get_iface_cache() to get the instance for
+    the current process.
+
+    The cache subscribes to netlink change notifications. It doesn't need a
+    thread for that: Every read first checks, without blocking, if
+    notifications came in, and only then re-reads the affected tables from
+    the kernel. When nothing changed, reading costs no netlink round trips.
+    If the subscription can't be set up, the tables are re-read when they're
+    older than IFACE_CACHE_POLL_INTERVAL seconds.
+    """
+    def __init__(self):
+        self._lock = _Lock()
+        # Maps interface index -> dictionary with keys ifname, mac_addr,
+        # and operstate
+        self._links = {}
+        # List of (index, label, address, prefixlen, family) tuples
+        self._addrs = []
+        # Maps IPv4 address -> MAC address
+        self._neighbours = {}
+        self._links_valid = False
+        self._neighbours_valid = False
+        self._last_refresh = 0
+        try:
+            self._events = IPRoute()
+            self._events.bind(groups=RTMGRP_LINK | RTMGRP_NEIGH
+                              | RTMGRP_IPV4_IFADDR | RTMGRP_IPV6_IFADDR)
+        except Exception as ex:
+            get_logger('net').warning(
+                "Could not subscribe to netlink notifications, polling "
+                "interfaces instead: %s", str(ex))
+            self._events = None
+
+    def _process_events(self):
+        """
+        Invalidate the tables that netlink told us have changed.
+        """
+        if self._events is None:
+            if time.monotonic() - self._last_refresh \
+                    >= IFACE_CACHE_POLL_INTERVAL:
+                self._links_valid = False
+                self._neighbours_valid = False
+            return
+        try:
+            while _select([self._events], [], [], 0)[0]:
+                for msg in self._events.get():
+                    if 'NEIGH' in msg.get('event', ''):
+                        self._neighbours_valid = False
+                    else:
+                        self._links_valid = False
+        except Exception as ex:
+            # E.g., the kernel dropped notifications because we didn't read
+            # them in time. We don't know what changed, so re-read all.
+            get_logger('net').debug("Error reading netlink notifications: %s",
+                                    str(ex))
+            self._links_valid = False
+            self._neighbours_valid = False
+
+    def _refresh_links(self):
+        " Re-read the links and addresses "
+        with IPRoute() as ipr:
+            self._links = {
+                link['index']: {
+                    'ifname': link.get_attr('IFLA_IFNAME'),
+                    'mac_addr': link.get_attr('IFLA_ADDRESS'),
+                    'operstate': link.get_attr('IFLA_OPERSTATE'),
+                }
+                for link in ipr.get_links()
+            }
+            self._addrs = [
+                (addr['index'], addr.get_attr('IFA_LABEL'),
+                 addr.get_attr('IFA_ADDRESS'), addr['prefixlen'],
+                 addr['family'])
+                for addr in ipr.get_addr()
+            ]
+        self._links_valid = True
+        self._last_refresh = time.monotonic()
+
+    def _refresh_neighbours(self):
+        " Re-read the IPv4 neighbour table "
+        with IPRoute() as ipr:
+            self._neighbours = {
+                neigh.get_attr('NDA_DST'): neigh.get_attr('NDA_LLADDR')
+                for neigh in ipr.get_neighbours(family=socket.AF_INET)
+                if neigh.get_attr('NDA_LLADDR') is not None
+            }
+        self._neighbours_valid = True
+        self._last_refresh = time.monotonic()
+
+    def get_links(self):
+        """
+        Return a tuple (links, addrs). links is a dictionary interface index
+        -> dictionary with the keys 'ifname', 'mac_addr', and 'operstate'.
+        addrs is a list of (index, label, address, prefixlen, family) tuples.
+
+        Don't modify the return values.
+        """
+        with self._lock:
+            self._process_events()
+            if not self._links_valid:
+                self._refresh_links()
+            return self._links, self._addrs
+
+    def get_neighbours(self):
+        """
+        Return the IPv4 neighbour table as a dictionary IPv4 address -> MAC
+        address. Don't modify the return value.
+        """
+        with self._lock:
+            self._process_events()
+            if not self._neighbours_valid:
+                self._refresh_neighbours()
+            return self._neighbours
+
+_IFACE_CACHE = None
+_IFACE_CACHE_PID = None
+def get_iface_cache():
+    """
+    Return the InterfaceCache of this process.
+    """
+    global _IFACE_CACHE, _IFACE_CACHE_PID
+    # Every process needs its own netlink socket, so don't use a cache that
+    # was inherited through fork()
+    if _IFACE_CACHE is None or _IFACE_CACHE_PID != os.getpid():
+        _IFACE_CACHE = InterfaceCache()
+        _IFACE_CACHE_PID = os.getpid()
+    return _IFACE_CACHE
+
+
+def _get_ipv4_addrs(addrs, link_index):
+    " Return the IPv4 addresses of a link from an address list "
+    return [
+        address for index, _, address, _, family in addrs
+        if index == link_index and family == socket.AF_INET
+    ]
+
+
 def get_valid_interfaces(iface_list):
     """
     Given a list of interfaces (['eth1', 'eth2'] for example), return the
     subset that contains actually valid entries.
     Interfaces are checked for if they actually exist, and if so, if they're up.
     """
-    valid_ifaces = []
-    with IPRoute() as ipr:
-        for iface in iface_list:
-            valid_iface_idx = ipr.link_lookup(ifname=iface)
-            if len(valid_iface_idx) == 0:
-                continue
-            valid_iface_idx = valid_iface_idx[0]
-            link_info = ipr.get_links(valid_iface_idx)[0]
-            if link_info.get_attr('IFLA_OPERSTATE') == 'UP' \
-                    and len(get_iface_addrs(link_info.get_attr('IFLA_ADDRESS'))):
-                assert link_info.get_attr('IFLA_IFNAME') == iface
-                valid_ifaces.append(iface)
-    return valid_ifaces
+    links, addrs = get_iface_cache().get_links()
+    valid_ifaces = {
+        link['ifname'] for index, link in iteritems(links)
+        if link['operstate'] == 'UP' and _get_ipv4_addrs(addrs, index)
+    }
+    return [iface for iface in iface_list if iface in valid_ifaces]
 
 
 def get_iface_info(ifname):
@@ -47,23 +193,28 @@ def get_iface_info(ifname):
 
     All values are stored as strings.
     """
+    links, addrs = get_iface_cache().get_links()
+    for index, link in iteritems(links):
+        if link['ifname'] == ifname:
+            ip_addrs = _get_ipv4_addrs(addrs, index)
+            return {
+                'mac_addr': link['mac_addr'],
+                'ip_addr': ip_addrs[0] if ip_addrs else '',
+                'ip_addrs': ip_addrs,
+            }
+    raise LookupError("No interfaces known with name `{}'!".format(ifname))
+
+def get_link_speed(ifname):
+    """
+    Return the negotiated link speed of an interface (e.g. 'sfp0') in Mbit/s,
+    or None if the kernel doesn't know it (e.g., because the link is down).
+    """
     try:
-        with IPRoute() as ipr:
-            links = ipr.link_lookup(ifname=ifname)
-            if len(links) == 0:
-                raise LookupError("No interfaces known with name `{}'!"
-                                  .format(ifname))
-            link_info = ipr.get_links(links)[0]
-    except IndexError:
-        raise LookupError("Could not get links for interface `{}'"
-                          .format(ifname))
-    mac_addr = link_info.get_attr('IFLA_ADDRESS')
-    ip_addrs = get_iface_addrs(mac_addr)
-    return {
-        'mac_addr': mac_addr,
-        'ip_addr': ip_addrs[0] if ip_addrs else '',
-        'ip_addrs': ip_addrs,
-    }
+        with open(os.path.join('/sys/class/net', ifname, 'speed')) as speed_file:
+            speed = int(speed_file.read().strip())
+    except (IOError, OSError, ValueError):
+        return None
+    return speed if speed > 0 else None
 
 def ip_addr_to_iface(ip_addr, iface_list):
     """
@@ -90,14 +241,27 @@ def get_iface_addrs(mac_addr):
     Arguments:
     mac_addr -- A MAC address as a string, input format: "aa:bb:cc:dd:ee:ff"
     """
-    with IPRoute() as ip2:
-        [link_index] = ip2.link_lookup(address=mac_addr)
-        # Only get v4 addresses
-        addresses = [addr.get_attrs('IFA_ADDRESS')
-                     for addr in ip2.get_addr(family=socket.AF_INET)
-                     if addr.get('index', None) == link_index]
-        # flatten possibly nested list
-        return list(itertools.chain.from_iterable(addresses))
+    links, addrs = get_iface_cache().get_links()
+    [link_index] = [
+        index for index, link in iteritems(links)
+        if link['mac_addr'] == mac_addr
+    ]
+    return _get_ipv4_addrs(addrs, link_index)
+
+
+def get_iface_networks():
+    """
+    Return the IPv4 networks of all local interfaces, as a dictionary
+    interface name -> list of networks in CIDR notation, e.g.
+    {'eth1': ['192.168.10.2/24']}.
+    """
+    networks = {}
+    _, addrs = get_iface_cache().get_links()
+    for _, label, address, prefixlen, family in addrs:
+        if family == socket.AF_INET:
+            networks.setdefault(label, []).append(
+                "{}/{}".format(address, prefixlen))
+    return networks
 
 
 def byte_to_mac(byte_str):
@@ -112,6 +276,10 @@ def get_mac_addr(remote_addr):
     return MAC address of a remote host already discovered
     or None if no host entry was found
     """
+    mac_addr = get_iface_cache().get_neighbours().get(remote_addr)
+    if mac_addr is not None:
+        return mac_addr
+    # Not in the cache, ask the kernel directly
     with IPRoute() as ip2:
         addrs = ip2.get_neighbours(dst=remote_addr)
         if len(addrs) > 1:
@@ -126,12 +294,9 @@ def get_local_ip_addrs(ipv4_only=False):
     """
     Return a set of IP addresses which are bound to local interfaces.
     """
-    with IPDB() as ipdb:
-        return {
-            ip_subnet[0]
-            for ip_subnet_list
-                in [x['ipaddr'] for x in ipdb.interfaces.values()]
-                    for ip_subnet in ip_subnet_list
-            if not ipv4_only or ip_subnet[0].find(':') == -1
-        }
+    _, addrs = get_iface_cache().get_links()
+    return {
+        address for _, _, address, _, family in addrs
+        if not ipv4_only or family == socket.AF_INET
+    }
 
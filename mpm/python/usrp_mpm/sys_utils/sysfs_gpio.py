@@ -15,6 +15,7 @@ from usrp_mpm.mpmlog import get_logger
 GPIO_SYSFS_BASE_DIR = '/sys/class/gpio'
 GPIO_SYSFS_LABELFILE = 'label'
 GPIO_SYSFS_VALUEFILE = 'value'
+GPIO_SYSFS_EDGEFILE = 'edge'
 
 def get_all_gpio_devs(parent_dev=None):
     """
@@ -191,6 +192,32 @@ class SysFSGPIO(object):
         self.log.trace("Reading value {} from `{}'...".format(read_value, value_path))
         return read_value
 
+    def get_edge_file(self, gpio_idx, edge='both'):
+        """
+        Configure a GPIO input to generate interrupts on edges, and return
+        its value file, opened for reading. Use poll() with POLLPRI to wait
+        for edges on the file. After every event, seek back to the start of
+        the file and read the new value, this also re-arms the notification.
+        The caller must close the file.
+
+        Throws an IOError/OSError if the GPIO can't generate interrupts.
+
+        Arguments:
+        gpio_idx -- Index of the GPIO. Must be an input.
+        edge -- 'rising', 'falling', or 'both'
+        """
+        assert (1<<gpio_idx) & self._use_mask
+        assert (1<<gpio_idx) & (~self._ddr)
+        assert edge in ('rising', 'falling', 'both')
+        gpio_num = self._base_gpio + gpio_idx
+        gpio_path = os.path.join(GPIO_SYSFS_BASE_DIR, 'gpio{}'.format(gpio_num))
+        self.log.trace("Enabling `{}' edge events on `{}'...".format(
+            edge, gpio_path))
+        with open(os.path.join(gpio_path, GPIO_SYSFS_EDGEFILE), 'w') \
+                as edge_file:
+            edge_file.write(edge)
+        return open(os.path.join(gpio_path, GPIO_SYSFS_VALUEFILE), 'r')
+
 class GPIOBank(object):
     """
     Extension of a SysFSGPIO
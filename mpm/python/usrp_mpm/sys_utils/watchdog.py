@@ -11,6 +11,7 @@ import os
 import time
 import threading
 from systemd import daemon
+from usrp_mpm.timeline import STARTUP_TIMELINE
 
 MPM_WATCHDOG_DEFAULT_TIMEOUT = 30
 # How often per watchdog interval we send a ping
@@ -43,6 +44,7 @@ def _watchdog_task(shared_state, log):
             )) / 1e6
     watchdog_interval = watchdog_timeout / MPM_WATCHDOG_TIMEOUT_FRAC
     daemon.notify("READY=1")
+    STARTUP_TIMELINE.mark('watchdog_ready')
     log.debug("Watchdog primed, going into watchdog loop (Interval: %s s)",
               watchdog_interval)
     while shared_state.system_ready.value:
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+#
+# Copyright 2018 Ettus Research, a National Instruments Company
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+#
+"""
+Tests for component uploads
+"""
+
+import logging
+import os
+import shutil
+import tempfile
+import unittest
+from hashlib import md5
+from unittest import mock
+from gevent import monkey
+# Importing rpc_server monkey patches the entire process, which would change
+# how the other tests in the same process behave. These tests don't need it.
+with mock.patch.object(monkey, 'patch_all'):
+    from usrp_mpm import components
+    from usrp_mpm.components import ComponentUpload
+
+class TestComponentUpload(unittest.TestCase):
+    """
+    Tests for ComponentUpload
+    """
+    def setUp(self):
+        self.log = logging.getLogger('test_components')
+        self.log.trace = self.log.debug
+        self.upload_dir = tempfile.mkdtemp()
+        self._orig_upload_dir = components.COMPONENT_UPLOAD_DIR
+        components.COMPONENT_UPLOAD_DIR = self.upload_dir
+
+    def tearDown(self):
+        components.COMPONENT_UPLOAD_DIR = self._orig_upload_dir
+        shutil.rmtree(self.upload_dir)
+
+    def _make_upload(self, data, upload_id='fpga:foo.bit'):
+        " Create an upload for data "
+        return ComponentUpload(upload_id, {
+            'id': 'fpga',
+            'filename': 'foo.bit',
+            'md5': md5(data).hexdigest(),
+            'size': str(len(data)),
+        }, self.log)
+
+    def _read(self, path):
+        " Return the contents of a file "
+        with open(path, 'rb') as file_obj:
+            return file_obj.read()
+
+    def test_chunks(self):
+        " Chunks are appended, resent data is skipped, gaps are refused "
+        upload = self._make_upload(b'0123456789')
+        self.assertEqual(upload.append(0, b'0123'), 4)
+        # Resending (part of) a chunk is harmless
+        self.assertEqual(upload.append(2, b'2345'), 6)
+        self.assertEqual(upload.append(0, b'01'), 6)
+        self.assertRaises(RuntimeError, upload.append, 8, b'89')
+        self.assertEqual(upload.append(6, b'6789'), 10)
+        filepath = upload.finalize()
+        self.assertEqual(filepath, os.path.join(self.upload_dir, 'foo.bit'))
+        self.assertEqual(self._read(filepath), b'0123456789')
+        self.assertEqual(os.listdir(self.upload_dir), ['foo.bit'])
+
+    def test_size_limit(self):
+        " Uploads can't exceed their declared size, or be incomplete "
+        upload = self._make_upload(b'0123')
+        self.assertRaises(RuntimeError, upload.append, 0, b'01234')
+        upload.append(0, b'012')
+        self.assertRaises(RuntimeError, upload.finalize)
+        self.assertEqual(os.listdir(self.upload_dir), [])
+
+    def test_hash_mismatch(self):
+        " Files with the wrong checksum are deleted "
+        upload = self._make_upload(b'0123')
+        upload.append(0, b'3210')
+        self.assertRaises(RuntimeError, upload.finalize)
+        self.assertEqual(os.listdir(self.upload_dir), [])
+
+    def test_same_filename(self):
+        " Uploads of the same file don't share their staging file "
+        old_upload = self._make_upload(b'old data', 'fpga:foo.bit:old')
+        old_upload.append(0, b'old')
+        new_upload = self._make_upload(b'new data', 'fpga:foo.bit:new')
+        new_upload.append(0, b'new ')
+        old_upload.append(3, b' da')
+        # E.g., the old upload gets dropped because it's stale
+        old_upload.abort()
+        new_upload.append(4, b'data')
+        filepath = new_upload.finalize()
+        self.assertEqual(self._read(filepath), b'new data')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+#
+# Copyright 2018 Ettus Research, a National Instruments Company
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+#
+"""
+Tests for the discovery process helpers
+"""
+
+import logging
+import unittest
+from unittest import mock
+from usrp_mpm import discovery
+from usrp_mpm.discovery import ResponseCache, SubnetFilter
+from usrp_mpm.discovery import SourceRateLimiter
+from usrp_mpm.mpmtypes import SharedState
+
+class TestResponseCache(unittest.TestCase):
+    """
+    Tests for ResponseCache
+    """
+    def test_response(self):
+        " The response is only rebuilt when the state changes "
+        state = SharedState()
+        state.update(dev_type=b'n3xx', dev_product=b'n310', dev_serial=b'1234')
+        cache = ResponseCache(state)
+        response = cache.get()
+        self.assertEqual(
+            response,
+            b"USRP-MPM;type=n3xx;product=n310;serial=1234;claimed=False")
+        self.assertIs(cache.get(), response)
+        state.update(claim_status=True)
+        self.assertEqual(
+            cache.get(),
+            b"USRP-MPM;type=n3xx;product=n310;serial=1234;claimed=True")
+
+
+class TestSubnetFilter(unittest.TestCase):
+    """
+    Tests for SubnetFilter
+    """
+    def setUp(self):
+        self.log = logging.getLogger('test_discovery')
+        self.networks = {
+            'eth0': ['10.2.0.5/16'],
+            'sfp0': ['192.168.10.2/24'],
+        }
+        patcher = mock.patch.object(
+            discovery.net, 'get_iface_networks', lambda: self.networks)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_any(self):
+        " 0.0.0.0 allows everyone "
+        subnet_filter = SubnetFilter('0.0.0.0', self.log)
+        self.assertTrue(subnet_filter.is_allowed('1.2.3.4'))
+
+    def test_local_network(self):
+        " Senders on the local network of the discovery address are allowed "
+        subnet_filter = SubnetFilter('10.2.255.255', self.log)
+        self.assertTrue(subnet_filter.is_allowed('10.2.0.1'))
+        self.assertTrue(subnet_filter.is_allowed('10.2.200.7'))
+        self.assertFalse(subnet_filter.is_allowed('10.3.0.1'))
+        self.assertFalse(subnet_filter.is_allowed('192.168.10.7'))
+
+    def test_no_local_network(self):
+        " Without a matching interface, broadcast addresses are a /24 "
+        subnet_filter = SubnetFilter('172.16.4.255', self.log)
+        self.assertTrue(subnet_filter.is_allowed('172.16.4.9'))
+        self.assertFalse(subnet_filter.is_allowed('172.16.5.9'))
+        subnet_filter = SubnetFilter('172.16.4.8', self.log)
+        self.assertTrue(subnet_filter.is_allowed('172.16.4.8'))
+        self.assertFalse(subnet_filter.is_allowed('172.16.4.9'))
+
+    def test_refresh(self):
+        " Address changes are picked up after NETWORK_REFRESH_INTERVAL "
+        with mock.patch.object(discovery.time, 'monotonic') as monotonic:
+            monotonic.return_value = 1000.0
+            subnet_filter = SubnetFilter('192.168.20.255', self.log)
+            self.assertFalse(subnet_filter.is_allowed('192.168.21.7'))
+            self.networks['sfp0'] = ['192.168.20.2/23']
+            self.assertFalse(subnet_filter.is_allowed('192.168.21.7'))
+            monotonic.return_value += discovery.NETWORK_REFRESH_INTERVAL
+            self.assertTrue(subnet_filter.is_allowed('192.168.21.7'))
+
+
+class TestSourceRateLimiter(unittest.TestCase):
+    """
+    Tests for SourceRateLimiter
+    """
+    def test_limit(self):
+        " Every source gets RATE_LIMIT_MAX_RESPONSES per window "
+        with mock.patch.object(discovery.time, 'monotonic') as monotonic:
+            monotonic.return_value = 1000.0
+            limiter = SourceRateLimiter()
+            for _ in range(discovery.RATE_LIMIT_MAX_RESPONSES):
+                self.assertTrue(limiter.is_allowed('10.0.0.1'))
+            self.assertFalse(limiter.is_allowed('10.0.0.1'))
+            self.assertFalse(limiter.is_allowed('10.0.0.1'))
+            self.assertEqual(limiter.num_dropped, 2)
+            # Other sources are not affected
+            self.assertTrue(limiter.is_allowed('10.0.0.2'))
+            # The next window starts from scratch
+            monotonic.return_value += discovery.RATE_LIMIT_WINDOW
+            self.assertTrue(limiter.is_allowed('10.0.0.1'))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,38 @@
+#!/usr/bin/env python3
+#
+# Copyright 2018 Ettus Research, a National Instruments Company
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+#
+"""
+Tests for the gevent compatibility helpers
+"""
+
+import select
+import sys
+import unittest
+from unittest import mock
+from usrp_mpm.gevent_compat import get_original
+
+class TestGetOriginal(unittest.TestCase):
+    """
+    Tests for get_original()
+    """
+    def test_without_gevent(self):
+        " Without gevent.monkey, items come straight from their module "
+        with mock.patch.dict(sys.modules, {'gevent.monkey': None}):
+            self.assertIs(get_original('select', 'select'), select.select)
+            self.assertRaises(
+                AttributeError, get_original, 'select', 'no_such_item')
+
+    def test_with_gevent(self):
+        " Once gevent.monkey was imported, it's asked for the originals "
+        monkey = mock.Mock()
+        with mock.patch.dict(sys.modules, {'gevent.monkey': monkey}):
+            self.assertIs(
+                get_original('select', 'select'),
+                monkey.get_original.return_value)
+        monkey.get_original.assert_called_once_with('select', 'select')
+
+if __name__ == '__main__':
+    unittest.main()
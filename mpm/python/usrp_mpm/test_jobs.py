@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+#
+# Copyright 2018 Ettus Research, a National Instruments Company
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+#
+"""
+Tests for asynchronous jobs
+"""
+
+import logging
+import threading
+import unittest
+from usrp_mpm import jobs
+from usrp_mpm.jobs import JobManager, Job, report_progress, propagate_job
+
+def spawn_thread(function):
+    " Run function in a new thread, return the thread as the job handle "
+    thread = threading.Thread(target=function)
+    thread.start()
+    return thread
+
+class TestJobManager(unittest.TestCase):
+    """
+    Tests for JobManager and Job
+    """
+    def setUp(self):
+        self.log = logging.getLogger('test_jobs')
+        self.log.trace = self.log.debug
+
+    def test_result(self):
+        " A job stores the return value and its stages "
+        def function(arg):
+            " Report two stages, then return "
+            report_progress("stage A")
+            report_progress("stage B")
+            return arg * 2
+        job_mgr = JobManager(spawn_thread, self.log)
+        job_id = job_mgr.start('function', function, 21)
+        status = job_mgr.wait(job_id, 5.0)
+        self.assertEqual(status['state'], Job.STATE_DONE)
+        self.assertEqual(status['result'], 42)
+        self.assertEqual(status['error'], "")
+        self.assertEqual(status['stage'], "stage B")
+        self.assertEqual([stage for _, stage in status['stages']],
+                         ["stage A", "stage B"])
+
+    def test_failure(self):
+        " A failing job stores the error string "
+        def function():
+            " Always fails "
+            raise RuntimeError("boom")
+        job_mgr = JobManager(spawn_thread, self.log)
+        status = job_mgr.wait(job_mgr.start('function', function), 5.0)
+        self.assertEqual(status['state'], Job.STATE_FAILED)
+        self.assertEqual(status['error'], "boom")
+        self.assertIsNone(status['result'])
+
+    def test_wait_timeout(self):
+        " wait() returns after the timeout if the job isn't done "
+        release = threading.Event()
+        job_mgr = JobManager(spawn_thread, self.log)
+        job_id = job_mgr.start('blocking', release.wait)
+        self.assertEqual(job_mgr.wait(job_id, 0.01)['state'],
+                         Job.STATE_RUNNING)
+        release.set()
+        self.assertEqual(job_mgr.wait(job_id, 5.0)['state'], Job.STATE_DONE)
+
+    def test_unknown_job(self):
+        " Unknown job IDs raise "
+        job_mgr = JobManager(spawn_thread, self.log)
+        self.assertRaises(RuntimeError, job_mgr.get_status, 42)
+
+    def test_prune(self):
+        " Only the newest MAX_FINISHED_JOBS finished jobs are kept "
+        job_mgr = JobManager(spawn_thread, self.log)
+        job_ids = []
+        for _ in range(jobs.MAX_FINISHED_JOBS + 2):
+            job_ids.append(job_mgr.start('noop', lambda: None))
+            job_mgr.wait(job_ids[-1], 5.0)
+        # Pruning happens on start(), so the newest job is never dropped
+        job_mgr.start('noop', lambda: None)
+        self.assertRaises(RuntimeError, job_mgr.get_status, job_ids[0])
+        self.assertEqual(job_mgr.get_status(job_ids[-1])['state'],
+                         Job.STATE_DONE)
+
+    def test_propagate_job(self):
+        " Progress reported from another thread reaches the job "
+        def function():
+            " Report progress from a helper thread "
+            thread = threading.Thread(
+                target=propagate_job(lambda: report_progress("in thread")))
+            thread.start()
+            thread.join()
+        job_mgr = JobManager(spawn_thread, self.log)
+        status = job_mgr.wait(job_mgr.start('function', function), 5.0)
+        self.assertEqual(status['stage'], "in thread")
+
+    def test_report_outside_job(self):
+        " report_progress() does nothing outside of a job "
+        report_progress("nobody listens")
+        self.assertIs(propagate_job(len), len)
+
+if __name__ == '__main__':
+    unittest.main()
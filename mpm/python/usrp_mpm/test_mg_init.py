@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+#
+# Copyright 2018 Ettus Research, a National Instruments Company
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+#
+"""
+Tests for the Magnesium init helpers
+"""
+
+import logging
+import unittest
+from unittest import mock
+from usrp_mpm.dboard_manager import mg_init
+from usrp_mpm.dboard_manager.mg_init import MagnesiumCalCache
+
+MAX_AGE = 3600
+MAX_TEMP_DRIFT = 10
+
+class TestMagnesiumCalCache(unittest.TestCase):
+    """
+    Tests for MagnesiumCalCache
+    """
+    def setUp(self):
+        patcher = mock.patch.object(mg_init.time, 'monotonic')
+        self.monotonic = patcher.start()
+        self.monotonic.return_value = 1000.0
+        self.addCleanup(patcher.stop)
+        self.cache = MagnesiumCalCache(logging.getLogger('test_mg_init'))
+
+    def _lookup(self, key, temp):
+        " Look up key with the default limits "
+        return self.cache.lookup(key, temp, MAX_AGE, MAX_TEMP_DRIFT)
+
+    def test_key(self):
+        " Keys only change with the LO band, clock rate, or temperature bucket "
+        key = MagnesiumCalCache.get_key(2.4e9, 2.41e9, 125e6, 41.0)
+        self.assertEqual(
+            MagnesiumCalCache.get_key(2.45e9, 2.3e9, 125e6, 49.9), key)
+        for other_key in (
+                MagnesiumCalCache.get_key(2.6e9, 2.41e9, 125e6, 41.0),
+                MagnesiumCalCache.get_key(2.4e9, 1.0e9, 125e6, 41.0),
+                MagnesiumCalCache.get_key(2.4e9, 2.41e9, 153.6e6, 41.0),
+                MagnesiumCalCache.get_key(2.4e9, 2.41e9, 125e6, 50.0),
+        ):
+            self.assertNotEqual(other_key, key)
+
+    def test_hit(self):
+        " Stored calibrations are found until the cache is cleared "
+        key = MagnesiumCalCache.get_key(2.4e9, 2.4e9, 125e6, 41.0)
+        self.assertFalse(self._lookup(key, 41.0))
+        self.cache.store(key, 41.0)
+        self.monotonic.return_value += MAX_AGE
+        self.assertTrue(self._lookup(key, 41.0 + MAX_TEMP_DRIFT))
+        self.assertTrue(self._lookup(key, 41.0 - MAX_TEMP_DRIFT))
+        other_key = MagnesiumCalCache.get_key(1e9, 2.4e9, 125e6, 41.0)
+        self.assertFalse(self._lookup(other_key, 41.0))
+        self.cache.clear()
+        self.assertFalse(self._lookup(key, 41.0))
+
+    def test_expired(self):
+        " Old entries are dropped "
+        key = MagnesiumCalCache.get_key(2.4e9, 2.4e9, 125e6, 41.0)
+        self.cache.store(key, 41.0)
+        self.monotonic.return_value += MAX_AGE + 1
+        self.assertFalse(self._lookup(key, 41.0))
+        # The entry is gone, even for lookups with more generous limits
+        self.assertFalse(self.cache.lookup(key, 41.0, 2 * MAX_AGE, 100))
+
+    def test_temp_drift(self):
+        " Entries are dropped when the temperature drifted too far "
+        key = MagnesiumCalCache.get_key(2.4e9, 2.4e9, 125e6, 41.0)
+        self.cache.store(key, 41.0)
+        self.assertFalse(self._lookup(key, 41.0 + MAX_TEMP_DRIFT + 0.5))
+        self.assertFalse(self._lookup(key, 41.0))
+        self.cache.store(key, 49.0)
+        self.assertFalse(self._lookup(key, 49.0 - MAX_TEMP_DRIFT - 0.5))
+
+    def test_restore(self):
+        " A new calibration replaces the old entry "
+        key = MagnesiumCalCache.get_key(2.4e9, 2.4e9, 125e6, 41.0)
+        self.cache.store(key, 41.0)
+        self.monotonic.return_value += MAX_AGE
+        self.cache.store(key, 45.0)
+        self.monotonic.return_value += MAX_AGE
+        self.assertTrue(self._lookup(key, 45.0 + MAX_TEMP_DRIFT))
+        # This would still be fine for the old entry
+        self.assertFalse(self._lookup(key, 45.0 - MAX_TEMP_DRIFT - 0.5))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+#
+# Copyright 2018 Ettus Research, a National Instruments Company
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+#
+"""
+Tests for MPM logging
+"""
+
+import collections
+import logging
+import threading
+import unittest
+from usrp_mpm.mpmlog import MPMLogger, LossyQueueHandler
+
+class RacyDeque(collections.deque):
+    """
+    Deque that lets a callback append records the first time it's read, like
+    a logger on another thread would
+    """
+    def __init__(self, on_read, *args, **kwargs):
+        collections.deque.__init__(self, *args, **kwargs)
+        self._on_read = on_read
+
+    def _read(self):
+        " Call the callback once "
+        on_read, self._on_read = self._on_read, None
+        if on_read is not None:
+            on_read()
+
+    def __getitem__(self, index):
+        item = collections.deque.__getitem__(self, index)
+        self._read()
+        return item
+
+    def __iter__(self):
+        self._read()
+        return collections.deque.__iter__(self)
+
+class TestLogsSince(unittest.TestCase):
+    """
+    Tests for MPMLogger.get_logs_since()
+    """
+    def _make_logger(self, maxlen):
+        " Return a logger with a log buffer of size maxlen "
+        logger = MPMLogger('test_mpmlog_{}'.format(id(self)))
+        logger.py_log_buf = collections.deque(maxlen=maxlen)
+        logger.addHandler(LossyQueueHandler(logger.py_log_buf))
+        logger.setLevel(logging.DEBUG)
+        logger.propagate = False
+        return logger
+
+    def test_cursor(self):
+        " Records are returned once, starting at the cursor "
+        logger = self._make_logger(100)
+        for idx in range(5):
+            logger.info("msg %d", idx)
+        cursor, num_lost, records = logger.get_logs_since(0, 3)
+        self.assertEqual((cursor, num_lost), (3, 0))
+        self.assertEqual([x[4] for x in records], ["msg 0", "msg 1", "msg 2"])
+        cursor, num_lost, records = logger.get_logs_since(cursor, 10)
+        self.assertEqual((cursor, num_lost), (5, 0))
+        self.assertEqual([x[4] for x in records], ["msg 3", "msg 4"])
+        self.assertEqual(logger.get_logs_since(cursor, 10), (5, 0, []))
+        # -1 skips everything that's in the queue
+        self.assertEqual(logger.get_logs_since(-1, 10), (5, 0, []))
+
+    def test_lost(self):
+        " Records that were evicted before they were read count as lost "
+        logger = self._make_logger(4)
+        for idx in range(10):
+            logger.info("msg %d", idx)
+        cursor, num_lost, records = logger.get_logs_since(2, 10)
+        self.assertEqual((cursor, num_lost), (10, 4))
+        self.assertEqual([x[0] for x in records], [6, 7, 8, 9])
+
+    def test_min_level(self):
+        " Records below min_level are skipped, but consumed "
+        logger = self._make_logger(100)
+        logger.debug("quiet")
+        logger.warning("loud")
+        cursor, _, records = logger.get_logs_since(0, 10, logging.WARNING)
+        self.assertEqual(cursor, 2)
+        self.assertEqual([x[4] for x in records], ["loud"])
+
+    def test_append_while_reading(self):
+        " Records appended during the call don't make others count as lost "
+        logger = self._make_logger(100)
+        handler = logger.handlers[0]
+        logger.py_log_buf = RacyDeque(
+            lambda: [logger.info("late %d", idx) for idx in range(2)],
+            maxlen=100)
+        handler.queue = logger.py_log_buf
+        for idx in range(13):
+            logger.info("msg %d", idx)
+        cursor, num_lost, records = logger.get_logs_since(10, 100)
+        self.assertEqual(num_lost, 0)
+        self.assertEqual(records[0][0], 10)
+        self.assertEqual([x[0] for x in records], list(range(10, cursor)))
+
+    def test_concurrent_writer(self):
+        " A reader sees every record exactly once while another thread logs "
+        logger = self._make_logger(100000)
+        num_records = 20000
+        def write():
+            " Log lots of records "
+            for idx in range(num_records):
+                logger.info("msg %d", idx)
+        writer = threading.Thread(target=write)
+        writer.start()
+        cursor = 0
+        seqs = []
+        while writer.is_alive() or cursor < num_records:
+            cursor, num_lost, records = logger.get_logs_since(cursor, 1000)
+            self.assertEqual(num_lost, 0)
+            seqs.extend(x[0] for x in records)
+        writer.join()
+        self.assertEqual(seqs, list(range(num_records)))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+#
+# Copyright 2018 Ettus Research, a National Instruments Company
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+#
+"""
+Tests for MPM types
+"""
+
+import threading
+import unittest
+from multiprocessing import Process
+from usrp_mpm.mpmtypes import SharedState
+
+def write_pairs(state, num_writes):
+    " Keep writing values where dev_type and dev_serial always match "
+    for idx in range(num_writes):
+        value = b'a' * (idx % 8 + 1)
+        state.update(dev_type=value, dev_serial=value)
+
+class TestSharedState(unittest.TestCase):
+    """
+    Tests for SharedState
+    """
+    def test_fields(self):
+        " Fields can be read and written one at a time "
+        state = SharedState()
+        self.assertFalse(state.claim_status.value)
+        state.claim_status.value = True
+        state.claim_token.value = b'abc'
+        self.assertTrue(state.claim_status.value)
+        self.assertEqual(state.claim_token.value, b'abc')
+
+    def test_version(self):
+        " Every update moves the version on "
+        state = SharedState()
+        version = state.get_version()
+        state.update(dev_type=b'n3xx', dev_product=b'n310')
+        self.assertNotEqual(state.get_version(), version)
+        snapshot = state.get_snapshot()
+        self.assertEqual(snapshot.seq, state.get_version())
+        self.assertEqual(snapshot.dev_type, b'n3xx')
+        self.assertEqual(snapshot.dev_product, b'n310')
+        # Snapshots are copies
+        state.update(dev_type=b'e3xx')
+        self.assertEqual(snapshot.dev_type, b'n3xx')
+
+    def test_lock_free(self):
+        " Readers don't wait for a writer that holds the lock "
+        state = SharedState()
+        state.update(dev_type=b'n3xx')
+        locked = threading.Event()
+        release = threading.Event()
+        released = threading.Event()
+        def hold_lock():
+            " Hold the lock until release is set, or for 5 seconds "
+            with state.lock:
+                locked.set()
+                release.wait(5.0)
+            released.set()
+        holder = threading.Thread(target=hold_lock)
+        holder.start()
+        try:
+            locked.wait(5.0)
+            self.assertEqual(state.get_snapshot().dev_type, b'n3xx')
+            self.assertEqual(state.dev_type.value, b'n3xx')
+            self.assertEqual(state.get_version() % 2, 0)
+            self.assertFalse(released.is_set())
+        finally:
+            release.set()
+            holder.join()
+
+    def test_other_process(self):
+        " Snapshots are consistent while another process writes "
+        state = SharedState()
+        state.update(dev_type=b'a', dev_serial=b'a')
+        num_writes = 20000
+        writer = Process(target=write_pairs, args=(state, num_writes))
+        writer.start()
+        while writer.is_alive():
+            snapshot = state.get_snapshot()
+            self.assertEqual(snapshot.dev_type, snapshot.dev_serial)
+        writer.join(10.0)
+        self.assertEqual(writer.exitcode, 0)
+        # Every write increments the version twice
+        self.assertEqual(state.get_version(), 2 * (num_writes + 1))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,288 @@
+#!/usr/bin/env python3
+#
+# Copyright 2018 Ettus Research, a National Instruments Company
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+#
+"""
+Tests for the MPM utilities
+"""
+
+import logging
+import threading
+import unittest
+from unittest import mock
+from usrp_mpm import mpmutils
+from usrp_mpm.mpmutils import run_task_graph, InitStages, TTLCache
+from usrp_mpm.timeline import Timeline
+
+class TestRunTaskGraph(unittest.TestCase):
+    """
+    Tests for run_task_graph()
+    """
+    def _make_tasks(self, calls):
+        " Return a diamond shaped task graph that appends to calls "
+        def task(name, value):
+            " Return a task function that records its call "
+            def func(*args):
+                " Record the call, return value plus the sum of args "
+                calls.append(name)
+                return value + sum(args)
+            return func
+        return [
+            ('a', task('a', 1), []),
+            ('b', task('b', 10), ['a']),
+            ('c', task('c', 100), ['a']),
+            ('d', task('d', 1000), ['b', 'c']),
+        ]
+
+    def test_results(self):
+        " Tasks get their dependencies' results, and run after them "
+        for serialize in (True, False):
+            calls = []
+            results = run_task_graph(self._make_tasks(calls), serialize)
+            self.assertEqual(
+                results, {'a': 1, 'b': 11, 'c': 101, 'd': 1112})
+            self.assertEqual(calls[0], 'a')
+            self.assertEqual(calls[-1], 'd')
+            self.assertEqual(sorted(calls), ['a', 'b', 'c', 'd'])
+        self.assertEqual(run_task_graph([]), {})
+
+    def test_parallel(self):
+        " Independent tasks run at the same time, unless serialized "
+        barrier = threading.Barrier(2, timeout=5.0)
+        tasks = [
+            ('a', barrier.wait, []),
+            ('b', barrier.wait, []),
+        ]
+        self.assertEqual(sorted(run_task_graph(tasks).values()), [0, 1])
+        barrier = threading.Barrier(2, timeout=0.1)
+        tasks = [
+            ('a', barrier.wait, []),
+            ('b', barrier.wait, []),
+        ]
+        self.assertRaises(
+            threading.BrokenBarrierError,
+            run_task_graph, tasks, True)
+
+    def test_failure(self):
+        " Failures are passed to dependent tasks, and re-raised at the end "
+        calls = []
+        def fail(name, exc_type):
+            " Return a task function that raises exc_type "
+            def func(*_):
+                " Record the call, then raise "
+                calls.append(name)
+                raise exc_type(name)
+            return func
+        tasks = [
+            ('a', fail('a', ValueError), []),
+            ('b', fail('b', KeyError), []),
+            ('c', lambda *_: calls.append('c'), ['a']),
+            ('d', lambda: calls.append('d'), []),
+        ]
+        with self.assertRaises(ValueError):
+            run_task_graph(tasks)
+        # c depends on a, so it never ran. All the other tasks did.
+        self.assertEqual(sorted(calls), ['a', 'b', 'd'])
+        # When serialized, nothing runs after the first failure
+        calls = []
+        with self.assertRaises(ValueError):
+            run_task_graph(tasks, serialize=True)
+        self.assertEqual(calls, ['a'])
+
+    def test_invalid_graph(self):
+        " Cycles, unknown dependencies, and duplicates are refused "
+        calls = []
+        def task(name):
+            " Return a task function that records its call "
+            return lambda *_: calls.append(name)
+        for tasks in (
+                # Cycle
+                [('a', task('a'), ['b']), ('b', task('b'), ['a'])],
+                # Dependency on itself
+                [('a', task('a'), ['a'])],
+                # Unknown dependency
+                [('a', task('a'), []), ('b', task('b'), ['x'])],
+                # Dependency comes later
+                [('b', task('b'), ['a']), ('a', task('a'), [])],
+                # Duplicate name
+                [('a', task('a'), []), ('a', task('a'), [])],
+        ):
+            for serialize in (True, False):
+                self.assertRaises(
+                    RuntimeError, run_task_graph, tasks, serialize)
+        self.assertEqual(calls, [])
+
+    def test_timeline(self):
+        " Every task is recorded as a span "
+        timeline = Timeline('test')
+        run_task_graph(self._make_tasks([]), timeline=timeline)
+        self.assertEqual(
+            sorted(span['name'] for span in timeline.get_spans()),
+            ['a', 'b', 'c', 'd'])
+
+
+class TestInitStages(unittest.TestCase):
+    """
+    Tests for InitStages
+    """
+    def setUp(self):
+        self.init_stages = InitStages(
+            ['clocking', 'rfic', 'rf_cal'],
+            logging.getLogger('test_mpmutils'))
+        self.inputs = {
+            'clocking': {'master_clock_rate': 125e6},
+            'rfic': {'mode': 'normal'},
+            'rf_cal': {'cal_mask': 0xFF},
+        }
+
+    def _set_all_done(self):
+        " Mark all stages as done with the current inputs "
+        for stage in self.init_stages.stages:
+            self.init_stages.set_done(stage, dict(self.inputs[stage]))
+
+    def test_first_run(self):
+        " Nothing can be skipped until the stages were run "
+        self.assertEqual(
+            self.init_stages.get_first_stage(self.inputs), 'clocking')
+        self.init_stages.set_done('clocking', self.inputs['clocking'])
+        self.assertEqual(self.init_stages.get_first_stage(self.inputs), 'rfic')
+        self._set_all_done()
+        self.assertIsNone(self.init_stages.get_first_stage(self.inputs))
+
+    def test_changed_inputs(self):
+        " A stage with changed inputs is the first one to run "
+        self._set_all_done()
+        self.inputs['rfic']['mode'] = 'low_power'
+        self.assertEqual(self.init_stages.get_first_stage(self.inputs), 'rfic')
+        self.inputs['clocking']['master_clock_rate'] = 153.6e6
+        self.assertEqual(
+            self.init_stages.get_first_stage(self.inputs), 'clocking')
+        # Stages without inputs count as changed
+        del self.inputs['clocking']
+        self.assertEqual(
+            self.init_stages.get_first_stage(self.inputs), 'clocking')
+
+    def test_checks(self):
+        " Failing status checks force a re-run, and are only called if needed "
+        self._set_all_done()
+        calls = []
+        def check(name, result):
+            " Return a check that records its call "
+            def func():
+                " Record the call, return result "
+                calls.append(name)
+                return result
+            return func
+        checks = {
+            'clocking': check('clocking', True),
+            'rfic': check('rfic', False),
+            'rf_cal': check('rf_cal', True),
+        }
+        self.assertEqual(
+            self.init_stages.get_first_stage(self.inputs, checks), 'rfic')
+        self.assertEqual(calls, ['clocking', 'rfic'])
+        # Checks aren't called when the inputs changed
+        calls = []
+        self.inputs['clocking']['master_clock_rate'] = 153.6e6
+        self.assertEqual(
+            self.init_stages.get_first_stage(self.inputs, checks), 'clocking')
+        self.assertEqual(calls, [])
+
+    def test_invalidate(self):
+        " Invalidating a stage also invalidates the following ones "
+        self._set_all_done()
+        self.init_stages.invalidate('rf_cal')
+        self.assertEqual(
+            self.init_stages.get_first_stage(self.inputs), 'rf_cal')
+        self._set_all_done()
+        self.init_stages.invalidate('rfic')
+        self.assertEqual(self.init_stages.get_first_stage(self.inputs), 'rfic')
+        # Re-running rfic alone isn't enough
+        self.init_stages.set_done('rfic', self.inputs['rfic'])
+        self.assertEqual(
+            self.init_stages.get_first_stage(self.inputs), 'rf_cal')
+        self.init_stages.invalidate()
+        self.assertEqual(
+            self.init_stages.get_first_stage(self.inputs), 'clocking')
+        self.assertRaises(ValueError, self.init_stages.invalidate, 'foo')
+
+
+class TestTTLCache(unittest.TestCase):
+    """
+    Tests for TTLCache
+    """
+    def setUp(self):
+        patcher = mock.patch.object(mpmutils.time, 'monotonic')
+        self.monotonic = patcher.start()
+        self.monotonic.return_value = 1000.0
+        self.addCleanup(patcher.stop)
+        self.cache = TTLCache()
+        self.calls = []
+
+    def _read(self, value):
+        " Pretend to read a sensor, return value "
+        self.calls.append(value)
+        return value
+
+    def test_ttl(self):
+        " Values are stored until they're ttl seconds old "
+        self.assertEqual(self.cache.get('temp', 2.0, self._read, 40), 40)
+        self.monotonic.return_value += 1.9
+        self.assertEqual(self.cache.get('temp', 2.0, self._read, 41), 40)
+        self.assertEqual(self.cache.get('lock', 2.0, self._read, True), True)
+        self.monotonic.return_value += 0.1
+        self.assertEqual(self.cache.get('temp', 2.0, self._read, 42), 42)
+        self.assertEqual(self.calls, [40, True, 42])
+
+    def test_no_ttl(self):
+        " Without a ttl, nothing is stored "
+        self.cache.get('temp', 2.0, self._read, 40)
+        self.assertEqual(self.cache.get('temp', None, self._read, 41), 41)
+        self.assertEqual(self.cache.get('temp', 0, self._read, 42), 42)
+        self.assertEqual(self.cache.get('temp', 2.0, self._read, 43), 40)
+
+    def test_invalidate(self):
+        " Invalidated values are read again "
+        self.cache.get('temp', 2.0, self._read, 40)
+        self.cache.get('lock', 2.0, self._read, True)
+        self.cache.invalidate('temp')
+        self.assertEqual(self.cache.get('temp', 2.0, self._read, 41), 41)
+        self.assertEqual(self.cache.get('lock', 2.0, self._read, False), True)
+        self.cache.invalidate()
+        self.assertEqual(self.cache.get('temp', 2.0, self._read, 42), 42)
+        self.assertEqual(self.cache.get('lock', 2.0, self._read, False), False)
+        self.cache.invalidate('unknown')
+
+    def test_invalidate_while_reading(self):
+        " A value that was read before an invalidation isn't stored "
+        def read_and_invalidate():
+            " Gets invalidated while reading, like after a clocking change "
+            self.cache.invalidate('lock')
+            return self._read(False)
+        self.assertEqual(
+            self.cache.get('lock', 2.0, read_and_invalidate), False)
+        self.assertEqual(self.cache.get('lock', 2.0, self._read, True), True)
+        self.assertEqual(self.cache.get('lock', 2.0, self._read, False), True)
+
+    def test_threads(self):
+        " A read from another thread can't undo an invalidation "
+        reading = threading.Event()
+        invalidated = threading.Event()
+        def slow_read():
+            " Old value, which is read until after the invalidation "
+            reading.set()
+            invalidated.wait(5.0)
+            return 'old'
+        thread = threading.Thread(
+            target=self.cache.get, args=('lock', 2.0, slow_read))
+        thread.start()
+        reading.wait(5.0)
+        self.cache.invalidate()
+        invalidated.set()
+        thread.join()
+        self.assertEqual(self.cache.get('lock', 2.0, self._read, 'new'), 'new')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+#
+# Copyright 2018 Ettus Research, a National Instruments Company
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+#
+"""
+Tests for the RPC server helpers
+"""
+
+import unittest
+from unittest import mock
+from gevent import monkey
+# Importing rpc_server monkey patches the entire process, which would change
+# how the other tests in the same process behave. These tests don't need it.
+with mock.patch.object(monkey, 'patch_all'):
+    from usrp_mpm.rpc_server import RPCStats, RPC_STATS_BINS
+
+class TestRPCStats(unittest.TestCase):
+    """
+    Tests for RPCStats
+    """
+    def test_counts(self):
+        " Calls and errors are counted per method "
+        stats = RPCStats()
+        stats.record('foo', 1e-3)
+        stats.record('foo', 3e-3, error=True)
+        stats.record('bar', 1e-3)
+        result = stats.get()
+        self.assertEqual(set(result.keys()), {'foo', 'bar'})
+        self.assertEqual(result['foo']['calls'], 2)
+        self.assertEqual(result['foo']['errors'], 1)
+        self.assertEqual(result['bar']['calls'], 1)
+        self.assertEqual(result['bar']['errors'], 0)
+        self.assertAlmostEqual(result['foo']['mean'], 2e-3)
+        self.assertEqual(result['foo']['max'], 3e-3)
+
+    def test_histogram(self):
+        " Durations are sorted into the right bins "
+        stats = RPCStats()
+        stats.record('foo', RPC_STATS_BINS[0] / 2)
+        stats.record('foo', RPC_STATS_BINS[3])
+        stats.record('foo', RPC_STATS_BINS[-1] * 2)
+        histogram = stats.get()['foo']['histogram']
+        self.assertEqual(len(histogram), len(RPC_STATS_BINS) + 1)
+        self.assertEqual(sum(histogram), 3)
+        self.assertEqual(histogram[0], 1)
+        self.assertEqual(histogram[3], 1)
+        self.assertEqual(histogram[-1], 1)
+
+    def test_percentiles(self):
+        " p50 and p99 are the upper limits of their bins "
+        stats = RPCStats()
+        for _ in range(99):
+            stats.record('foo', RPC_STATS_BINS[2] * 0.9)
+        stats.record('foo', 30.0)
+        result = stats.get()['foo']
+        self.assertEqual(result['p50'], RPC_STATS_BINS[2])
+        self.assertEqual(result['p99'], RPC_STATS_BINS[2])
+        # The slowest call is in the overflow bin, so it's reported as max
+        self.assertEqual(result['max'], 30.0)
+        single = RPCStats()
+        single.record('bar', RPC_STATS_BINS[5] * 0.9)
+        # Percentiles never exceed the longest call
+        self.assertEqual(single.get()['bar']['p99'], RPC_STATS_BINS[5] * 0.9)
+
+    def test_reset(self):
+        " reset() drops all statistics "
+        stats = RPCStats()
+        stats.record('foo', 1e-3)
+        stats.reset()
+        self.assertEqual(stats.get(), {})
+        self.assertGreaterEqual(stats.get_age(), 0)
+
+if __name__ == '__main__':
+    unittest.main()
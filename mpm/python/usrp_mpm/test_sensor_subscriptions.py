@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+#
+# Copyright 2018 Ettus Research, a National Instruments Company
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+#
+"""
+Tests for sensor subscriptions
+"""
+
+import logging
+import unittest
+from unittest import mock
+import msgpack
+import gevent
+from gevent import socket
+from usrp_mpm import sensor_subscriptions
+from usrp_mpm.sensor_subscriptions import SensorSubscriptionManager
+
+PERIOD = sensor_subscriptions.MIN_SUBSCRIPTION_PERIOD
+TEMP = ('get_mb_sensor', ('temp',))
+LOCK = ('db_0_get_sensor', ('RX', 'lo_locked', 0))
+
+class TestSensorSubscriptionManager(unittest.TestCase):
+    """
+    Tests for SensorSubscriptionManager
+    """
+    def setUp(self):
+        self.log = logging.getLogger('test_sensor_subscriptions')
+        self.reads = []
+        self.sub_mgr = SensorSubscriptionManager(
+            self._read_sensors, self.log)
+        self.addCleanup(self.sub_mgr.clear)
+
+    def _read_sensors(self, sensors):
+        " Pretend to read sensors, their value is the command name "
+        self.reads.append(sorted(sensors))
+        return [command for command, _ in sensors]
+
+    def test_delivery(self):
+        " Queued updates contain one value per sensor, in order "
+        sub_id = self.sub_mgr.subscribe([LOCK, TEMP], PERIOD)
+        num_dropped, updates = self.sub_mgr.get_updates(sub_id, 5.0)
+        self.assertEqual(num_dropped, 0)
+        self.assertGreaterEqual(len(updates), 1)
+        _, values = updates[0]
+        self.assertEqual(values, ['db_0_get_sensor', 'get_mb_sensor'])
+        # Nothing is delivered twice
+        gevent.sleep(PERIOD * 2.5)
+        _, more_updates = self.sub_mgr.get_updates(sub_id, 5.0)
+        self.assertGreaterEqual(len(more_updates), 2)
+        self.assertGreater(more_updates[0][0], updates[-1][0])
+
+    def test_coalesced(self):
+        " Sensors that are part of multiple subscriptions are read once "
+        sub_ids = [
+            self.sub_mgr.subscribe([TEMP], PERIOD),
+            self.sub_mgr.subscribe([TEMP, LOCK], PERIOD),
+        ]
+        for sub_id in sub_ids:
+            self.sub_mgr.get_updates(sub_id, 5.0)
+        self.assertEqual(self.reads[0], sorted([TEMP, LOCK]))
+
+    def test_udp(self):
+        " Subscriptions with an address send their updates there "
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.addCleanup(sock.close)
+        sock.bind(('127.0.0.1', 0))
+        sock.settimeout(5.0)
+        sub_id = self.sub_mgr.subscribe([TEMP], PERIOD, sock.getsockname())
+        recv_sub_id, _, values = msgpack.unpackb(sock.recv(1024), raw=False)
+        self.assertEqual(recv_sub_id, sub_id)
+        self.assertEqual(values, ['get_mb_sensor'])
+
+    def test_unsubscribe(self):
+        " Removed subscriptions are gone, and the sampler stops "
+        sub_id = self.sub_mgr.subscribe([TEMP], PERIOD)
+        self.sub_mgr.get_updates(sub_id, 5.0)
+        self.sub_mgr.unsubscribe(sub_id)
+        self.assertRaises(RuntimeError, self.sub_mgr.get_updates, sub_id, 0)
+        self.assertRaises(RuntimeError, self.sub_mgr.unsubscribe, sub_id)
+        gevent.sleep(PERIOD * 1.5)
+        num_reads = len(self.reads)
+        gevent.sleep(PERIOD * 2)
+        self.assertEqual(len(self.reads), num_reads)
+        # clear() removes all subscriptions
+        sub_ids = [self.sub_mgr.subscribe([TEMP], PERIOD) for _ in range(2)]
+        self.sub_mgr.clear()
+        for sub_id in sub_ids:
+            self.assertRaises(
+                RuntimeError, self.sub_mgr.get_updates, sub_id, 0)
+
+    def test_limits(self):
+        " Too short periods and too many subscriptions are refused "
+        self.assertRaises(
+            RuntimeError, self.sub_mgr.subscribe, [TEMP], PERIOD / 2)
+        for _ in range(sensor_subscriptions.MAX_SUBSCRIPTIONS):
+            self.sub_mgr.subscribe([TEMP], 10.0)
+        self.assertRaises(RuntimeError, self.sub_mgr.subscribe, [TEMP], 10.0)
+
+    def test_dropped(self):
+        " Updates that aren't fetched in time are dropped "
+        with mock.patch.object(sensor_subscriptions, 'MAX_QUEUED_UPDATES', 2):
+            sub_id = self.sub_mgr.subscribe([TEMP], PERIOD)
+            gevent.sleep(PERIOD * 4.5)
+            num_dropped, updates = self.sub_mgr.get_updates(sub_id, 0)
+        self.assertEqual(len(updates), 2)
+        self.assertGreaterEqual(num_dropped, 2)
+
+    def test_stale(self):
+        " Queued subscriptions that aren't fetched expire "
+        with mock.patch.object(
+                sensor_subscriptions, 'STALE_SUBSCRIPTION_TIMEOUT', PERIOD * 3):
+            stale_id = self.sub_mgr.subscribe([TEMP], PERIOD)
+            fetched_id = self.sub_mgr.subscribe([TEMP], PERIOD)
+            udp_id = self.sub_mgr.subscribe([TEMP], PERIOD, ('127.0.0.1', 9))
+            for _ in range(10):
+                gevent.sleep(PERIOD / 2)
+                self.sub_mgr.get_updates(fetched_id, 0)
+        self.assertRaises(RuntimeError, self.sub_mgr.get_updates, stale_id, 0)
+        self.sub_mgr.get_updates(fetched_id, 0)
+        # UDP subscriptions can't be fetched, so they don't expire
+        self.sub_mgr.unsubscribe(udp_id)
+
+if __name__ == '__main__':
+    unittest.main()
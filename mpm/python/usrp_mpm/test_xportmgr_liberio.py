@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+#
+# Copyright 2018 Ettus Research, a National Instruments Company
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+#
+"""
+Tests for the Liberio transport manager
+"""
+
+import logging
+import unittest
+from unittest import mock
+from usrp_mpm.mpmtypes import SID
+from usrp_mpm.xports import xportmgr_liberio
+from usrp_mpm.xports.xportmgr_liberio import XportMgrLiberio
+
+class TestDmaChannelPool(unittest.TestCase):
+    """
+    Tests for the allocation of Liberio DMA channels
+    """
+    def setUp(self):
+        log = logging.getLogger('test_xportmgr_liberio')
+        log.trace = log.debug
+        for name in ('LiberioDispatcherTable', 'lib'):
+            patcher = mock.patch.object(xportmgr_liberio, name)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.xport_mgr = XportMgrLiberio(log)
+        self.num_streams = 0
+
+    def _open(self, dst_ep, xport_type='RX_DATA'):
+        " Request and commit a stream to block port dst_ep, return its info "
+        # Every stream gets its own source endpoint, like on the device
+        self.num_streams += 1
+        sid = SID((self.num_streams << 16) | (0x02 << 8) | dst_ep)
+        xport_info = self.xport_mgr.request_xport(
+            sid, xport_type, {'rate': '10e6'})[0]
+        self.assertTrue(self.xport_mgr.commit_xport(sid, xport_info))
+        return xport_info
+
+    def _in_use(self):
+        " Return the numbers of all data channels that are in use "
+        return sorted(
+            int(chan)
+            for chan, info in self.xport_mgr.get_utilization().items()
+            if info['in_use'] and int(chan) >= 2
+        )
+
+    def test_muxed(self):
+        " CTRL and ASYNC_MSG transports share their channels "
+        for _ in range(3):
+            self.assertEqual(self._open(0x30, 'CTRL')['dma_chan'], '0')
+            self.assertEqual(self._open(0x30, 'ASYNC_MSG')['dma_chan'], '1')
+        self.assertEqual(self._in_use(), [])
+
+    def test_same_owner(self):
+        " A new stream to the same block port gets a free channel first "
+        old_xport = self._open(0x30)
+        new_xport = self._open(0x30)
+        self.assertNotEqual(old_xport['dma_chan'], new_xport['dma_chan'])
+        self.assertEqual(self._in_use(), [2, 3])
+        info = self.xport_mgr.get_utilization()[old_xport['dma_chan']]
+        self.assertTrue(info['replaced'])
+        self.assertEqual(info['bandwidth'], 0)
+
+    def test_replaced(self):
+        " Channels of replaced streams are reclaimed once all are in use "
+        old_xport = self._open(0x30)
+        self._open(0x30)
+        # No free channel left, so the replaced one is reclaimed
+        new_xport = self._open(0x31)
+        self.assertEqual(new_xport['dma_chan'], old_xport['dma_chan'])
+        self.assertEqual(self._in_use(), [2, 3])
+        info = self.xport_mgr.get_utilization()[new_xport['dma_chan']]
+        self.assertFalse(info['replaced'])
+        self.assertEqual(info['sid'], new_xport['send_sid'])
+        # There's nothing left that a stream to 0x32 could take over
+        self.assertRaises(
+            RuntimeError,
+            self.xport_mgr.request_xport, SID(0x00010232), 'RX_DATA')
+
+    def test_more_streams_than_channels(self):
+        " Streamers can be created again and again during a session "
+        for _ in range(10):
+            self._open(0x30)
+            self._open(0x31, 'TX_DATA')
+        self.assertEqual(self._in_use(), [2, 3])
+        # Only the newest streams count
+        utilization = self.xport_mgr.get_utilization()
+        self.assertFalse(any(info['replaced'] for info in utilization.values()))
+        # request_xport() rounds the bandwidth to bytes/s
+        self.assertEqual(
+            sum(info['bandwidth'] for info in utilization.values()),
+            2 * int(XportMgrLiberio.get_stream_bandwidth(
+                'RX_DATA', {'rate': '10e6'})))
+
+    def test_exhausted(self):
+        " Channels are only handed out once, until they're released "
+        xports = [self._open(0x30 + idx) for idx in range(2)]
+        self.assertRaises(
+            RuntimeError,
+            self.xport_mgr.request_xport, SID(0x00010232), 'RX_DATA')
+        self.xport_mgr.release_xport(SID(xports[0]['send_sid']))
+        self.assertEqual(self._in_use(), [3])
+        self.assertEqual(self._open(0x32)['dma_chan'], xports[0]['dma_chan'])
+        self.xport_mgr.deinit()
+        self.assertEqual(self._in_use(), [])
+
+    def test_prefer_last_owner(self):
+        " Free channels that were used by the same block port are preferred "
+        xports = [self._open(0x30 + idx) for idx in range(2)]
+        self.xport_mgr.deinit()
+        self.assertEqual(self._open(0x31)['dma_chan'], xports[1]['dma_chan'])
+        self.assertEqual(self._open(0x30)['dma_chan'], xports[0]['dma_chan'])
+
+    def test_commit_in_use(self):
+        " Committing to a channel that is in use fails "
+        sid = SID(0x00010230)
+        xport_info = self.xport_mgr.request_xport(sid, 'RX_DATA')[0]
+        self.xport_mgr.commit_xport(sid, xport_info)
+        self.assertRaises(
+            RuntimeError, self.xport_mgr.commit_xport, sid, xport_info)
+
+    def test_utilization(self):
+        " The bytes that were moved are reported as an estimate "
+        xport_info = self._open(0x30)
+        info = self.xport_mgr.get_utilization()[xport_info['dma_chan']]
+        self.assertTrue(info['in_use'])
+        self.assertEqual(info['bandwidth'], float(xport_info['bandwidth']))
+        self.assertEqual(info['num_allocations'], 1)
+        self.assertIn('estimated_bytes', info)
+        self.assertNotIn('bytes_moved', info)
+
+if __name__ == '__main__':
+    unittest.main()
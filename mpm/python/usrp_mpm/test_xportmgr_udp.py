@@ -0,0 +1,229 @@
+#!/usr/bin/env python3
+#
+# Copyright 2018 Ettus Research, a National Instruments Company
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+#
+"""
+Tests for the UDP transport manager
+"""
+
+import logging
+import unittest
+from unittest import mock
+from usrp_mpm.mpmtypes import SID
+from usrp_mpm.xports import xportmgr_udp
+from usrp_mpm.xports.xportmgr_udp import XportMgrUDP
+
+class FakeXportMgrUDP(XportMgrUDP):
+    " UDP transport manager with a 10 GbE and a 1 GbE link "
+    iface_config = {
+        'sfp0': {
+            'label': 'misc-enet-regs0',
+            'xbar': 0,
+            'xbar_port': 0,
+            'ctrl_src_addr': 0,
+            'link_speed': 10000,
+        },
+        'sfp1': {
+            'label': 'misc-enet-regs1',
+            'xbar': 0,
+            'xbar_port': 1,
+            'ctrl_src_addr': 1,
+            'link_speed': 1000,
+        },
+    }
+
+IFACE_INFO = {
+    'sfp0': {'ip_addr': '192.168.10.2'},
+    'sfp1': {'ip_addr': '192.168.20.2'},
+}
+
+def make_xport_mgr(test_case):
+    " Return a FakeXportMgrUDP, patching the network lookups of test_case "
+    log = logging.getLogger('test_xportmgr_udp')
+    log.trace = log.debug
+    for name, value in (
+            ('get_valid_interfaces', list),
+            ('get_iface_info', IFACE_INFO.get),
+            ('get_link_speed', lambda iface: None),
+            ('get_mac_addr', lambda addr: '00:11:22:33:44:55'),
+    ):
+        patcher = mock.patch.object(xportmgr_udp.net, name, value)
+        patcher.start()
+        test_case.addCleanup(patcher.stop)
+    return FakeXportMgrUDP(log)
+
+class TestStreamBandwidth(unittest.TestCase):
+    """
+    Tests for XportMgrUDP.get_stream_bandwidth()
+    """
+    def test_rate(self):
+        " Streams with a rate are costed by their rate and format "
+        sc16 = XportMgrUDP.get_stream_bandwidth(
+            'RX_DATA', {'rate': '10e6'}, 1.25e9)
+        self.assertGreater(sc16, 40e6)
+        self.assertLess(sc16, 41e6)
+        self.assertAlmostEqual(
+            XportMgrUDP.get_stream_bandwidth(
+                'RX_DATA', {'rate': '10e6', 'otw_format': 'sc8'}, 1.25e9),
+            sc16 / 2)
+        self.assertAlmostEqual(
+            XportMgrUDP.get_stream_bandwidth(
+                'TX_DATA', {'rate': '10e6', 'nchans': '2'}, 1.25e9),
+            sc16 * 2)
+        # The link doesn't matter when we know the rate
+        self.assertEqual(
+            XportMgrUDP.get_stream_bandwidth(
+                'RX_DATA', {'rate': '10e6'}, 125e6),
+            sc16)
+
+    def test_no_rate(self):
+        " Streams without a rate use a fraction of the link "
+        fraction = xportmgr_udp.DEFAULT_STREAM_LINK_FRACTION
+        self.assertEqual(
+            XportMgrUDP.get_stream_bandwidth('RX_DATA', {}, 1.25e9),
+            1.25e9 * fraction)
+        self.assertEqual(
+            XportMgrUDP.get_stream_bandwidth(
+                'RX_DATA', {'otw_format': 'sc16'}, 125e6),
+            125e6 * fraction)
+
+    def test_other_xports(self):
+        " Control transports aren't counted, unknown formats raise "
+        self.assertEqual(
+            XportMgrUDP.get_stream_bandwidth('CTRL', {}, 1.25e9), 0)
+        self.assertEqual(
+            XportMgrUDP.get_stream_bandwidth('ASYNC_MSG', {}, 1.25e9), 0)
+        self.assertRaises(
+            RuntimeError,
+            XportMgrUDP.get_stream_bandwidth,
+            'RX_DATA', {'rate': '1e6', 'otw_format': 'fc32'}, 1.25e9)
+
+
+class TestRequestXport(unittest.TestCase):
+    """
+    Tests for the order of the options returned by request_xport()
+    """
+    def setUp(self):
+        self.xport_mgr = make_xport_mgr(self)
+
+    def _request(self, xport_args=None, xport_type='RX_DATA'):
+        " Return the interfaces offered for a new stream, in order "
+        return [
+            xport['iface']
+            for xport in self.xport_mgr.request_xport(
+                SID(0x00020030), xport_type, xport_args)
+        ]
+
+    def _commit(self, iface, bandwidth, direction='rx'):
+        " Pretend a stream was committed on iface "
+        sid = 'stream{}'.format(len(self.xport_mgr._streams))
+        self.xport_mgr._streams[sid] = (iface, direction, bandwidth)
+
+    def test_default_streams(self):
+        " Streams without a rate are spread across fast and slow links "
+        self.assertEqual(self._request(), ['sfp0', 'sfp1'])
+        self._commit('sfp0', 1.25e9 / 2)
+        self.assertEqual(self._request(), ['sfp1', 'sfp0'])
+        self._commit('sfp1', 125e6 / 2)
+        self._commit('sfp0', 1.25e9 / 2)
+        self.assertEqual(self._request(), ['sfp1', 'sfp0'])
+        self._commit('sfp1', 125e6 / 2)
+        # Both are full, so we prefer the one that's the least overbooked
+        self._commit('sfp0', 1.25e9 / 2)
+        self.assertEqual(self._request(), ['sfp1', 'sfp0'])
+
+    def test_fits(self):
+        " Links where a stream with a known rate fits come first "
+        self._commit('sfp0', 1.0e9)
+        # 50 MS/s sc16 doesn't fit into 1 GbE, but it fits into what's left
+        # of 10 GbE
+        self.assertEqual(self._request({'rate': '50e6'}), ['sfp0', 'sfp1'])
+        # 10 MS/s fits both, and sfp1 will have the lower utilization
+        self.assertEqual(self._request({'rate': '10e6'}), ['sfp1', 'sfp0'])
+
+    def test_directions(self):
+        " RX and TX bandwidth are counted separately "
+        self._commit('sfp0', 1.0e9, 'rx')
+        self._commit('sfp1', 100e6, 'tx')
+        self.assertEqual(
+            self._request({'rate': '10e6'}, 'TX_DATA'), ['sfp0', 'sfp1'])
+        self.assertEqual(
+            self._request({'rate': '10e6'}, 'RX_DATA'), ['sfp1', 'sfp0'])
+
+    def test_bandwidth_info(self):
+        " The estimated bandwidth on every link is returned "
+        xports = self.xport_mgr.request_xport(SID(0x00020030), 'RX_DATA')
+        self.assertEqual(
+            {x['iface']: x['bandwidth'] for x in xports},
+            {'sfp0': str(int(1.25e9 / 2)), 'sfp1': str(int(125e6 / 2))})
+        xports = self.xport_mgr.request_xport(SID(0x00020030), 'CTRL')
+        self.assertTrue(all(x['bandwidth'] == '0' for x in xports))
+
+
+class TestCommitXport(unittest.TestCase):
+    """
+    Tests for the bookkeeping of committed streams
+    """
+    def setUp(self):
+        patcher = mock.patch.object(xportmgr_udp, 'lib')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.xport_mgr = make_xport_mgr(self)
+        self.xport_mgr._eth_dispatchers = {
+            iface: mock.Mock() for iface in IFACE_INFO
+        }
+        self.num_streams = 0
+
+    def _open(self, dst_ep, xport_type='RX_DATA'):
+        " Request and commit a 10 MS/s stream to block port dst_ep "
+        # Every stream gets its own source endpoint, like on the device
+        self.num_streams += 1
+        sid = SID((self.num_streams << 16) | (0x02 << 8) | dst_ep)
+        xport_info = self.xport_mgr.request_xport(
+            sid, xport_type, {'rate': '10e6'})[0]
+        xport_info.update({'src_ipv4': '192.168.10.1', 'src_port': '1234'})
+        self.assertTrue(self.xport_mgr.commit_xport(
+            SID(xport_info['send_sid']), xport_info))
+        return xport_info
+
+    def _num_streams(self):
+        " Return the total number of committed streams "
+        return sum(
+            info['num_streams']
+            for info in self.xport_mgr.get_utilization().values())
+
+    def test_replaced(self):
+        " A new stream to the same block port replaces the old one "
+        for _ in range(10):
+            self._open(0x30)
+            self._open(0x31)
+            self._open(0x30, 'TX_DATA')
+        self.assertEqual(self._num_streams(), 3)
+        # request_xport() rounds the bandwidth to bytes/s
+        stream_bandwidth = int(XportMgrUDP.get_stream_bandwidth(
+            'RX_DATA', {'rate': '10e6'}, 1.25e9))
+        utilization = self.xport_mgr.get_utilization()
+        self.assertAlmostEqual(
+            sum(info['rx_bandwidth'] for info in utilization.values()),
+            2 * stream_bandwidth)
+        self.assertAlmostEqual(
+            sum(info['tx_bandwidth'] for info in utilization.values()),
+            stream_bandwidth)
+
+    def test_release(self):
+        " Released and replaced streams stop counting "
+        old_xport = self._open(0x30)
+        new_xport = self._open(0x30)
+        self.xport_mgr.release_xport(SID(old_xport['send_sid']))
+        self.assertEqual(self._num_streams(), 1)
+        self.xport_mgr.release_xport(SID(new_xport['send_sid']))
+        self.assertEqual(self._num_streams(), 0)
+        self._open(0x30)
+        self._open(0x31)
+        self.xport_mgr.deinit()
+        self.assertEqual(self._num_streams(), 0)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,197 @@
+#
+# Copyright 2018 Ettus Research, a National Instruments Company
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+#
+"""
+Timelines for profiling where MPM spends its time
+"""
+
+import json
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from functools import wraps
+from builtins import object
+
+# Number of spans kept by INIT_TIMELINE. Older spans are dropped.
+INIT_TIMELINE_MAX_SPANS = 1024
+
+class Timeline(object):
+    """
+    Records a sequence of named spans (with a start and end time) and marks
+    (spans without a duration). All times are stored in seconds relative to
+    the origin of the timeline. Every span also stores the name of the
+    thread that recorded it.
+
+    A timeline can be split into sessions (see start_session()), e.g. one
+    per UHD session. Spans are stored in a ring buffer, so the timeline
+    can keep recording forever without growing.
+
+    Recording is cheap and doesn't take any locks, so it can be used from
+    any thread or greenlet.
+
+    Arguments:
+    name -- Name of this timeline, for logging
+    origin -- Value of time.time() that counts as time zero. Defaults to
+              the time the timeline is created.
+    maxlen -- Max. number of spans that are stored, or None for no limit
+    """
+    def __init__(self, name, origin=None, maxlen=None):
+        self.name = name
+        self.origin = origin if origin is not None else time.time()
+        # If set, finish() also writes the timeline to this JSON file
+        self.json_path = None
+        self._spans = deque(maxlen=maxlen)
+        self._session = 0
+        self._finished = False
+
+    def get_time(self):
+        " Return the current time relative to the origin "
+        return time.time() - self.origin
+
+    def start_session(self):
+        """
+        Start a new session: The origin moves to the current time, and all
+        spans recorded from now on belong to the new session. Returns the
+        session number.
+        """
+        self.origin = time.time()
+        self._session += 1
+        return self._session
+
+    def _record(self, name, start, end, attrs):
+        " Store a span "
+        if self._finished:
+            return
+        span = {
+            'name': name,
+            'start': start,
+            'end': end,
+            'thread': threading.current_thread().name,
+            'session': self._session,
+        }
+        span.update(attrs)
+        self._spans.append(span)
+
+    def mark(self, name, **attrs):
+        """
+        Record that the event called name happened just now. Any keyword
+        arguments are stored with the mark.
+        """
+        now = self.get_time()
+        self._record(name, now, now, attrs)
+
+    @contextmanager
+    def span(self, name, **attrs):
+        """
+        Context manager that records the time spent in its block as a span
+        called name. The span is recorded even if the block throws. Any
+        keyword arguments are stored with the span.
+        """
+        start = self.get_time()
+        try:
+            yield
+        finally:
+            self._record(name, start, self.get_time(), attrs)
+
+    def timed(self, name, new_session=False):
+        """
+        Method decorator: Records every call of the method as a span called
+        name. If the object has a slot_idx attribute, it's stored as the
+        span's slot. If new_session is True, every call starts a new session
+        (see start_session()).
+        """
+        def decorator(method):
+            " Wrap method "
+            @wraps(method)
+            def timed_method(obj, *args, **kwargs):
+                " Call method in a span "
+                if new_session:
+                    self.start_session()
+                with self.span(name, slot=getattr(obj, 'slot_idx', None)):
+                    return method(obj, *args, **kwargs)
+            return timed_method
+        return decorator
+
+    def get_spans(self, session=None):
+        """
+        Return a list of all recorded spans, sorted by start time. If session
+        is given, only the spans of that session are returned.
+
+        Every span is a dictionary with keys name, start, end, thread,
+        session, plus any attributes that were passed when recording it.
+        """
+        return sorted(
+            [x for x in list(self._spans)
+             if session is None or x['session'] == session],
+            key=lambda x: x['start']
+        )
+
+    def get_last_session(self):
+        """
+        Return the spans of the most recent session as a dictionary with the
+        keys session, origin (as a time.time() value), and spans.
+        """
+        return {
+            'session': self._session,
+            'origin': self.origin,
+            'spans': self.get_spans(self._session),
+        }
+
+    def log_summary(self, log):
+        """
+        Write all spans to log, one line each.
+        """
+        log.info("%s timeline (total: %.3f s):", self.name, self.get_time())
+        for span in self.get_spans(self._session):
+            name = span['name']
+            if span.get('slot') is not None:
+                name += " [slot {}]".format(span['slot'])
+            if span['start'] == span['end']:
+                log.info("  %7.3f s: %s", span['start'], name)
+            else:
+                log.info("  %7.3f s: %s (%.3f s)", span['start'], name,
+                         span['end'] - span['start'])
+
+    def write_json(self, path):
+        """
+        Write the timeline to a JSON file. The file is written atomically, so
+        readers never see partial data.
+        """
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w') as json_file:
+            json.dump({
+                'name': self.name,
+                'origin': self.origin,
+                'pid': os.getpid(),
+                'spans': self.get_spans(self._session),
+            }, json_file, indent=4)
+        os.rename(tmp_path, path)
+
+    def finish(self, log):
+        """
+        Stop recording, and write the timeline to log and, if json_path is
+        set, to a JSON file. Calling this more than once has no effect.
+        """
+        if self._finished:
+            return
+        self._finished = True
+        self.log_summary(log)
+        if self.json_path:
+            try:
+                self.write_json(self.json_path)
+            except (IOError, OSError) as ex:
+                log.warning("Could not write %s timeline to %s: %s",
+                            self.name, self.json_path, str(ex))
+
+
+# Records the startup of MPM, from launching usrp_hwd until the RPC server is
+# ready. It's created when this module is first imported, but usrp_hwd moves
+# the origin to its own start time.
+STARTUP_TIMELINE = Timeline('Startup')
+# Records the initialization of the device for every UHD session. Every
+# call to the periph manager's init() starts a new session.
+INIT_TIMELINE = Timeline('Init', maxlen=INIT_TIMELINE_MAX_SPANS)
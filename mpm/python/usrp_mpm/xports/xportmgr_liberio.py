@@ -7,13 +7,127 @@
 Liberio Transport manager
 """
 
+import time
 from builtins import object
 from usrp_mpm.liberiotable import LiberioDispatcherTable
+from usrp_mpm.xports.xportmgr_udp import OTW_BYTES_PER_SAMPLE
+from usrp_mpm.xports.xportmgr_udp import DEFAULT_STREAM_RATE, DEFAULT_OTW_FORMAT
 from usrp_mpm import lib
 
+# Size of a CHDR header including timestamp, in bytes
+CHDR_HEADER_SIZE = 16
+# Samples per packet that are assumed for computing the header overhead
+DEFAULT_SPP = 1996
+
+class DmaChannel(object):
+    """
+    Bookkeeping for a single Liberio DMA channel.
+
+    Neither the DMA engine nor the liberio driver have any byte counters,
+    so the number of bytes moved can only be estimated from the bandwidth of
+    the streams that were allocated to the channel, and how long they were
+    allocated. It's reported as estimated_bytes.
+    """
+    def __init__(self, chan):
+        self.chan = chan
+        self.owner = None
+        # Owner of the most recent allocation, kept after release()
+        self.last_owner = None
+        self.sid = None
+        self.xport_type = None
+        self.bandwidth = 0
+        # True if a newer stream to the same block port was committed. The
+        # channel may still be open, but it can be reclaimed.
+        self.replaced = False
+        self.num_allocations = 0
+        self._estimated_bytes = 0
+        self._allocated_since = None
+
+    def allocate(self, owner, xport_type, bandwidth):
+        " Hand out this channel. owner identifies the stream using it. "
+        self.release()
+        self.owner = owner
+        self.last_owner = owner
+        self.xport_type = xport_type
+        self.bandwidth = bandwidth
+        self.num_allocations += 1
+        self._allocated_since = time.monotonic()
+
+    def release(self):
+        " Return this channel to the pool "
+        self.replace()
+        self.owner = None
+        self.sid = None
+        self.xport_type = None
+        self.replaced = False
+
+    def replace(self):
+        """
+        Mark this channel as replaced: Its stream no longer receives any data,
+        because a newer stream to the same block port exists.
+        """
+        if self._allocated_since is not None:
+            self._estimated_bytes += \
+                self.bandwidth * (time.monotonic() - self._allocated_since)
+        self.bandwidth = 0
+        self._allocated_since = None
+        self.replaced = True
+
+    def is_free(self):
+        " Returns True if this channel can be allocated "
+        return self.owner is None
+
+    def is_reclaimable(self, owner):
+        """
+        Returns True if this channel is in use, but a new stream of owner may
+        take it over, because the current stream was replaced, or is about to
+        be replaced by the new one.
+        """
+        return not self.is_free() and (self.replaced or self.owner == owner)
+
+    def get_estimated_bytes(self):
+        " Return the estimated number of bytes moved by this channel "
+        if self._allocated_since is None:
+            return self._estimated_bytes
+        return self._estimated_bytes + \
+            self.bandwidth * (time.monotonic() - self._allocated_since)
+
+    def get_info(self):
+        " Return occupancy info for this channel as a dictionary "
+        active_time = 0
+        if self._allocated_since is not None:
+            active_time = time.monotonic() - self._allocated_since
+        return {
+            'in_use': not self.is_free(),
+            'replaced': self.replaced,
+            'xport_type': self.xport_type or "",
+            'sid': str(self.sid) if self.sid is not None else "",
+            'bandwidth': self.bandwidth,
+            'active_time': active_time,
+            'estimated_bytes': int(self.get_estimated_bytes()),
+            'num_allocations': self.num_allocations,
+        }
+
+
 class XportMgrLiberio(object):
     """
     Transport manager for Liberio connections
+
+    Channel 0 is used for CTRL and channel 1 for ASYNC_MSG transports, both
+    of which are muxed by UHD. All other channels form a pool for data
+    transports, which can't be shared. A data channel is allocated when a
+    stream is committed, and is returned to the pool when the stream is
+    released with release_xport(), or when the session ends. UHD doesn't
+    release streams, though. Instead, a new stream to the same block port
+    replaces the previous one, which no longer receives any data. The new
+    stream gets a channel of its own if there is a free one, because the
+    previous stream may still be open. Otherwise, the channel of a replaced
+    stream is reclaimed.
+
+    When picking a channel, the one that was last used for the same block
+    port is preferred: The DMA dispatcher routes are kept, so they don't need
+    to be reprogrammed. After that, the one that moved the fewest bytes is
+    picked, which spreads the load across the channels.
     """
     # udev label for the UIO device that controls the DMA engine
     liberio_label = 'liberio'
@@ -22,11 +136,14 @@ class XportMgrLiberio(object):
     # Crossbar to which the Liberio DMA engine is connected
     xbar_dev = "/dev/crossbar0"
     xbar_port = 2
+    # Total bandwidth the DMA engine can handle, in bytes/s. We warn if the
+    # committed streams add up to more than this.
+    max_bandwidth = 1e9
 
     def __init__(self, log):
         self.log = log
         self._dma_dispatcher = LiberioDispatcherTable(self.liberio_label)
-        self._data_chan_ctr = 0
+        self._channels = [DmaChannel(chan) for chan in range(self.max_chan)]
 
     def init(self, args):
         """
@@ -36,7 +153,8 @@ class XportMgrLiberio(object):
 
     def deinit(self):
         " Clean up after a session terminates "
-        self._data_chan_ctr = 0
+        for channel in self._channels:
+            channel.release()
 
     def get_xport_info(self):
         """
@@ -50,22 +168,76 @@ class XportMgrLiberio(object):
         """
         return {}
 
+    def get_utilization(self):
+        """
+        Return the occupancy of every DMA channel, as a dictionary
+        channel number -> info. See DmaChannel.get_info() for the keys.
+        Note that estimated_bytes is based on the expected bandwidth of the
+        streams, not on what was actually transferred.
+        """
+        return {
+            str(channel.chan): channel.get_info()
+            for channel in self._channels
+        }
+
+    @staticmethod
+    def get_stream_bandwidth(xport_type, xport_args):
+        """
+        Estimate the bandwidth of a transport over DMA, in bytes/s.
+        See XportMgrUDP.get_stream_bandwidth() for xport_args ('mtu' is
+        ignored here, and 'spp' can be used to specify the number of samples
+        per packet).
+        """
+        if xport_type not in ('TX_DATA', 'RX_DATA'):
+            return 0
+        rate = float(xport_args.get('rate', DEFAULT_STREAM_RATE))
+        otw_format = xport_args.get('otw_format', DEFAULT_OTW_FORMAT)
+        if otw_format not in OTW_BYTES_PER_SAMPLE:
+            raise RuntimeError("Unknown OTW format: `{}'".format(otw_format))
+        nchans = int(xport_args.get('nchans', 1))
+        spp = int(xport_args.get('spp', DEFAULT_SPP))
+        bytes_per_sample = OTW_BYTES_PER_SAMPLE[otw_format]
+        return rate * nchans * \
+            (bytes_per_sample + float(CHDR_HEADER_SIZE) / spp)
+
+    def _find_data_channel(self, owner):
+        """
+        Return a data channel for a stream: A free channel if there is one,
+        otherwise one that can be reclaimed (see
+        DmaChannel.is_reclaimable()). Channels that were last used by the
+        same owner are preferred (their routes are likely still valid), and
+        then the ones that moved the fewest bytes.
+        """
+        data_channels = self._channels[2:]
+        channels = [x for x in data_channels if x.is_free()] or \
+            [x for x in data_channels if x.is_reclaimable(owner)]
+        if not channels:
+            raise RuntimeError(
+                "No free Liberio DMA channels! All {} data channels are in "
+                "use.".format(len(data_channels)))
+        return min(
+            channels,
+            key=lambda x: (x.last_owner != owner, x.get_estimated_bytes())
+        )
+
     def request_xport(
             self,
             sid,
             xport_type,
+            xport_args=None,
         ):
         """
         Return liberio xport info
         """
         assert xport_type in ('CTRL', 'ASYNC_MSG', 'TX_DATA', 'RX_DATA')
+        bandwidth = self.get_stream_bandwidth(xport_type, xport_args or {})
         if xport_type == 'CTRL':
             chan = 0
         elif xport_type == 'ASYNC_MSG':
             chan = 1
         else:
-            chan = 2 + self._data_chan_ctr
-            self._data_chan_ctr += 1
+            chan = self._find_data_channel(
+                (xport_type, sid.dst_addr, sid.dst_ep)).chan
         xport_info = {
             'type': 'liberio',
             'send_sid': str(sid),
@@ -73,6 +245,8 @@ class XportMgrLiberio(object):
             'dma_chan': str(chan),
             'tx_dev': "/dev/tx-dma{}".format(chan),
             'rx_dev': "/dev/rx-dma{}".format(chan),
+            'xport_type': xport_type,
+            'bandwidth': str(int(bandwidth)),
         }
         self.log.trace("Liberio: Chan: {} TX Device: {} RX Device: {}".format(
             chan, xport_info['tx_dev'], xport_info['rx_dev']))
@@ -83,9 +257,59 @@ class XportMgrLiberio(object):
     def commit_xport(self, sid, xport_info):
         " Commit liberio transport "
         chan = int(xport_info['dma_chan'])
+        xport_type = xport_info.get('xport_type')
+        if xport_type in ('TX_DATA', 'RX_DATA'):
+            channel = self._channels[chan]
+            owner = (xport_type, sid.dst_addr, sid.dst_ep)
+            if str(channel.sid) == str(sid) or not (
+                    channel.is_free() or channel.is_reclaimable(owner)):
+                raise RuntimeError(
+                    "Liberio DMA channel {} is already in use!".format(chan))
+            if not channel.is_free():
+                self.log.debug("Reclaiming Liberio DMA channel %d from "
+                               "replaced stream %s.", chan, str(channel.sid))
+            for other in self._channels[2:]:
+                if other is not channel and other.owner == owner \
+                        and not other.replaced:
+                    self.log.trace("Stream %s replaces stream %s on DMA "
+                                   "channel %d.",
+                                   str(sid), str(other.sid), other.chan)
+                    other.replace()
+            channel.allocate(
+                owner,
+                xport_type,
+                float(xport_info.get(
+                    'bandwidth',
+                    self.get_stream_bandwidth(xport_type, {}))),
+            )
+            channel.sid = sid
+        elif self._channels[chan].is_free():
+            # CTRL and ASYNC_MSG channels are shared by all streams of their
+            # type, we only track when they were first used
+            self._channels[chan].allocate(xport_type, xport_type, 0)
         xbar_iface = lib.xbar.xbar.make(self.xbar_dev)
         xbar_iface.set_route(sid.src_addr, self.xbar_port)
-        self._dma_dispatcher.set_route(sid.reversed(), chan)
+        if not self._dma_dispatcher.set_route(sid.reversed(), chan):
+            self.log.trace("Reusing existing DMA route for channel %d.", chan)
+        total_bandwidth = sum(x.bandwidth for x in self._channels)
+        if total_bandwidth > self.max_bandwidth:
+            self.log.warning(
+                "Committed Liberio streams require %.1f MB/s, which exceeds "
+                "the DMA engine's capacity of %.1f MB/s.",
+                total_bandwidth / 1e6, self.max_bandwidth / 1e6)
         self.log.trace("Liberio transport successfully committed!")
         return True
 
+    def release_xport(self, sid):
+        """
+        Return the data channel of a stream to the pool. The DMA dispatcher
+        route is left as it is.
+        """
+        for channel in self._channels[2:]:
+            if channel.sid is not None and str(channel.sid) == str(sid):
+                self.log.trace("Releasing Liberio DMA channel %d.",
+                               channel.chan)
+                channel.release()
+                return
+        self.log.warning("Can't release SID %s, it doesn't have a DMA "
+                         "channel.", str(sid))
@@ -14,6 +14,35 @@ from usrp_mpm.sys_utils import net
 from usrp_mpm.mpmtypes import SID
 from usrp_mpm import lib
 
+# Link speed (in Mbit/s) that is assumed if the kernel can't tell us
+DEFAULT_LINK_SPEED = 10000
+# Bytes per sample for every OTW format (one sample = I and Q for complex
+# formats)
+OTW_BYTES_PER_SAMPLE = {
+    'sc16': 4,
+    'sc12': 3,
+    'sc8': 2,
+    's16': 2,
+    's8': 1,
+}
+# If the client doesn't tell us anything about a data stream, we assume it's
+# a single channel at this rate (in samples per second), using sc16
+DEFAULT_STREAM_RATE = 125e6
+DEFAULT_OTW_FORMAT = 'sc16'
+# If the client doesn't tell us the sample rate of a data stream, we can't
+# estimate its bandwidth, and instead assume every channel uses this fraction
+# of the capacity of the link it's on. That way, streams are spread across all
+# links, no matter how fast they are.
+DEFAULT_STREAM_LINK_FRACTION = 0.5
+# IP MTU that is assumed for computing the per-packet overhead
+DEFAULT_MTU = 8000
+# Per-packet overhead on the wire that is not part of the IP MTU: Ethernet
+# header, FCS, preamble, and inter-frame gap
+ETH_FRAME_OVERHEAD = 14 + 4 + 8 + 12
+# Per-packet overhead inside the IP MTU: IPv4 and UDP headers, and the CHDR
+# header including a timestamp
+CHDR_PACKET_OVERHEAD = 20 + 8 + 16
+
 class XportMgrUDP(object):
     """
     Transport manager for UDP connections
@@ -25,6 +54,8 @@ class XportMgrUDP(object):
     #         'label': 'misc-enet-regs0', # UIO label for the Eth table
     #         'xbar': 0, # Which crossbar? 0 -> /dev/crossbar0
     #         'xbar_port': 0, # Which port on the crossbar it is connected to
+    #         'link_speed': 10000, # Optional: Link speed in Mbit/s. If not
+    #                              # given, it's read from the kernel.
     #     },
     # }
     iface_config = {}
@@ -47,7 +78,11 @@ class XportMgrUDP(object):
         self._chdr_ifaces = \
             self._init_interfaces(self._possible_chdr_ifaces)
         self._eth_dispatchers = {}
-        self._allocations = {}
+        # Committed data streams: SID -> (iface, direction, bytes/s)
+        self._streams = {}
+        # Most recent data stream of every block port:
+        # (direction, dst_addr, dst_ep) -> SID
+        self._stream_owners = {}
         self._previous_block_ep = {}
 
     def _init_interfaces(self, possible_ifaces):
@@ -130,7 +165,8 @@ class XportMgrUDP(object):
 
     def deinit(self):
         " Clean up after a session terminates "
-        self._allocations = {}
+        self._streams = {}
+        self._stream_owners = {}
 
     def get_xport_info(self):
         """
@@ -180,15 +216,17 @@ class XportMgrUDP(object):
             eth_dispatcher = eth_dispatchers[eth_iface]
             self.log.debug("Preloading {} dispatch table".format(eth_iface))
             try:
+                routes = []
                 for dst_ep, udp_data in iteritems(data):
                     sid = SID()
                     sid.set_dst_ep(int(dst_ep))
-                    eth_dispatcher.set_route(
+                    routes.append((
                         sid,
                         udp_data['ip_addr'],
                         udp_data['port'],
                         udp_data.get('mac_addr', None)
-                    )
+                    ))
+                eth_dispatcher.set_routes(routes)
             except ValueError as ex:
                 self.log.warning(
                     "Bad values in preloading table file: %s",
@@ -203,13 +241,101 @@ class XportMgrUDP(object):
         xbar_idx = self.iface_config[iface]['xbar']
         return "/dev/crossbar{}".format(xbar_idx)
 
+    def _get_link_capacity(self, iface):
+        """
+        Return the capacity of an Ethernet interface in bytes/s, per
+        direction.
+        """
+        link_speed = self.iface_config[iface].get('link_speed') \
+            or net.get_link_speed(iface) \
+            or DEFAULT_LINK_SPEED
+        return link_speed * 1e6 / 8
+
+    def _get_committed_bandwidth(self, iface, direction):
+        """
+        Return the bandwidth (in bytes/s) of all data streams committed on
+        iface in the given direction ('rx' or 'tx').
+        """
+        return sum(
+            bandwidth
+            for stream_iface, stream_dir, bandwidth in itervalues(self._streams)
+            if stream_iface == iface and stream_dir == direction
+        )
+
+    @staticmethod
+    def get_stream_bandwidth(xport_type, xport_args, link_capacity):
+        """
+        Estimate the bandwidth a transport will use on the wire, in bytes/s.
+
+        Arguments:
+        xport_type -- One of CTRL, ASYNC_MSG, TX_DATA, RX_DATA. Only data
+                      transports are counted, the others return 0.
+        xport_args -- Dictionary describing the stream. All keys are
+                      optional:
+                      - rate: Sample rate in samples/s
+                      - otw_format: OTW format, e.g. 'sc16'
+                      - nchans: Number of channels on this transport
+                      - mtu: IP MTU in bytes
+                      Values may be strings.
+        link_capacity -- Capacity of the link in bytes/s. Streams without a
+                         rate use DEFAULT_STREAM_LINK_FRACTION of it per
+                         channel.
+        """
+        if xport_type not in ('TX_DATA', 'RX_DATA'):
+            return 0
+        otw_format = xport_args.get('otw_format', DEFAULT_OTW_FORMAT)
+        if otw_format not in OTW_BYTES_PER_SAMPLE:
+            raise RuntimeError("Unknown OTW format: `{}'".format(otw_format))
+        nchans = int(xport_args.get('nchans', 1))
+        if 'rate' not in xport_args:
+            return link_capacity * DEFAULT_STREAM_LINK_FRACTION * nchans
+        rate = float(xport_args['rate'])
+        mtu = int(xport_args.get('mtu', DEFAULT_MTU))
+        payload_rate = rate * OTW_BYTES_PER_SAMPLE[otw_format] * nchans
+        return payload_rate * (mtu + ETH_FRAME_OVERHEAD) \
+                / (mtu - CHDR_PACKET_OVERHEAD)
+
+    def get_utilization(self):
+        """
+        Return the current bandwidth allocation of every CHDR interface, as a
+        dictionary iface -> info, where info has the following keys:
+        - capacity: Link capacity in bytes/s (per direction)
+        - rx_bandwidth, tx_bandwidth: Committed bandwidth in bytes/s
+        - rx_utilization, tx_utilization: Committed bandwidth divided by
+          link capacity
+        - num_streams: Number of committed data streams
+        """
+        utilization = {}
+        for iface in self._chdr_ifaces:
+            capacity = self._get_link_capacity(iface)
+            info = {
+                'capacity': capacity,
+                'num_streams': len([
+                    x for x in itervalues(self._streams) if x[0] == iface
+                ]),
+            }
+            for direction in ('rx', 'tx'):
+                bandwidth = self._get_committed_bandwidth(iface, direction)
+                info[direction + '_bandwidth'] = bandwidth
+                info[direction + '_utilization'] = bandwidth / capacity
+            utilization[iface] = info
+        return utilization
+
     def request_xport(
             self,
             sid,
             xport_type,
+            xport_args=None,
         ):
         """
         Return UDP xport info
+
+        The options are sorted by the bandwidth that is already committed on
+        each link: Links where the new stream fits into the remaining
+        capacity come first, and among those, the ones that will have the
+        lowest utilization afterwards. See get_stream_bandwidth() for
+        xport_args. The estimated bandwidth of the stream on each link is
+        returned as 'bandwidth'.
         """
         def fixup_sid(sid, iface_name):
             " Modify the source SID (e.g. the UHD SID) "
@@ -219,42 +345,47 @@ class XportMgrUDP(object):
 
         def sort_xport_info(xport):
             """
-            We sort xport_info (which is a list of xport) as follows:
-            1. Look at current allocation of xport src_addr (which is the addr
-               of host). If the allocation too large, in this case larger or
-               equal to 2 (since 2*125 = 250MS/s = max bandwidth of SFP+ port),
-               we will use the allocation for sorting.
-            2. Else, we need to look at the destination block. The priority will
-               yield to the xport that has the previous destination block
-               that is the same as this coming destination block.
-            Note: smaller number return is the higher chance to be picked
+            Return the sort key for an xport option. Smaller keys are
+            preferred:
+            1. Options where the stream fits into the remaining capacity of
+               the link
+            2. Lower link utilization after adding this stream
+            3. If there's still a tie, we prefer the link which was last used
+               for the same destination block.
             """
+            iface_name = xport['iface']
+            capacity = self._get_link_capacity(iface_name)
+            new_usage = float(xport['allocation']) + float(xport['bandwidth'])
             sid = SID(xport['send_sid'])
-            src_addr = sid.src_addr
-            prev_block = -1
-            if src_addr in self._previous_block_ep:
-                prev_block = self._previous_block_ep[src_addr]
-            allocation = int(xport['allocation'])
-            if allocation >= 2:
-                return allocation
-            else:
-                return allocation if prev_block != sid.get_dst_block() else -1;
+            prev_block = self._previous_block_ep.get(sid.src_addr, -1)
+            return (
+                new_usage > capacity,
+                new_usage / capacity,
+                prev_block != sid.get_dst_block(),
+            )
 
         assert xport_type in ('CTRL', 'ASYNC_MSG', 'TX_DATA', 'RX_DATA')
-        allocation_getter = lambda iface: {
-            'CTRL': 0,
-            'ASYNC_MSG': 0,
-            'RX_DATA': self._allocations.get(iface, {}).get('rx', 0),
-            'TX_DATA': self._allocations.get(iface, {}).get('tx', 0),
-        }[xport_type]
+        direction = {
+            'RX_DATA': 'rx',
+            'TX_DATA': 'tx',
+        }.get(xport_type)
+        xport_args = xport_args or {}
         xport_info = sorted([
             {
                 'type': 'UDP',
                 'ipv4': str(iface_info['ip_addr']),
                 'port': str(self.chdr_port),
                 'send_sid': str(fixup_sid(sid, iface_name)),
-                'allocation': str(allocation_getter(iface_name)),
+                'allocation': str(int(
+                    self._get_committed_bandwidth(iface_name, direction)
+                    if direction else 0)),
+                'bandwidth': str(int(self.get_stream_bandwidth(
+                    xport_type,
+                    xport_args,
+                    self._get_link_capacity(iface_name),
+                ))),
                 'xport_type': xport_type,
+                'iface': iface_name,
             }
             for iface_name, iface_info in iteritems(self._chdr_ifaces)
         ]
@@ -291,20 +422,49 @@ class XportMgrUDP(object):
         xbar_iface = lib.xbar.xbar.make(self.get_xbar_dev(eth_iface))
         xbar_iface.set_route(sid.src_addr, xbar_port)
         self._eth_dispatchers[eth_iface].set_route(
-            sid.reversed(), sender_addr, sender_port)
+            sid.reversed(), sender_addr, sender_port, mac_addr)
         self.log.trace("UDP transport successfully committed!")
         self._previous_block_ep[sid.src_addr] = sid.get_dst_block()
-        if xport_info.get('xport_type') == 'TX_DATA':
-            self._allocations[eth_iface] = \
-                {'tx': self._allocations.get(eth_iface, {}).get('tx', 0) + 1}
-        if xport_info.get('xport_type') == 'RX_DATA':
-            self._allocations[eth_iface] = \
-                {'rx': self._allocations.get(eth_iface, {}).get('rx', 0) + 1}
+        direction = {
+            'RX_DATA': 'rx',
+            'TX_DATA': 'tx',
+        }.get(xport_info.get('xport_type'))
+        if direction is not None:
+            bandwidth = float(xport_info.get(
+                'bandwidth',
+                self.get_stream_bandwidth(
+                    xport_info['xport_type'],
+                    {},
+                    self._get_link_capacity(eth_iface),
+                )))
+            # A block port only streams to one destination, so a new stream
+            # replaces the previous one, even if it's never released
+            owner = (direction, sid.dst_addr, sid.dst_ep)
+            replaced_sid = self._stream_owners.get(owner)
+            if replaced_sid is not None and replaced_sid != str(sid):
+                self.log.trace("Stream %s replaces stream %s.",
+                               str(sid), replaced_sid)
+                self._streams.pop(replaced_sid, None)
+            self._stream_owners[owner] = str(sid)
+            self._streams[str(sid)] = (eth_iface, direction, bandwidth)
         self.log.trace(
-            "New link allocations for %s: TX: %d  RX: %d",
+            "New link allocations for %s: TX: %.1f MB/s  RX: %.1f MB/s",
             eth_iface,
-            self._allocations.get(eth_iface, {}).get('tx', 0),
-            self._allocations.get(eth_iface, {}).get('rx', 0),
+            self._get_committed_bandwidth(eth_iface, 'tx') / 1e6,
+            self._get_committed_bandwidth(eth_iface, 'rx') / 1e6,
         )
         return True
 
+    def release_xport(self, sid):
+        """
+        Stop counting the bandwidth of a stream. The routes are left as they
+        are. Streams that were replaced by a new stream to the same block
+        port (see commit_xport()) don't need to be released.
+        """
+        self._streams.pop(str(sid), None)
+        self._stream_owners = {
+            owner: owner_sid
+            for owner, owner_sid in iteritems(self._stream_owners)
+            if owner_sid != str(sid)
+        }
+